@@ -0,0 +1,489 @@
+"""
+Space Engineers Server Maintenance utility - Benchmark
+
+Makes up Space Engineers saves (Sandbox.sbc & SANDBOX_0_0_0_.sbs) of whatever size you want, then runs
+SEMaintenanceUtility over copies of them in each of its modes and reports how long each took and how much memory it used.
+Real player saves can't be handed around, these can.
+
+Run it at a few scales (--scales 1 2 4) to see how the time grows with the size of the save. Anything growing much
+faster than the save does is flagged, that's usually a loop over everything inside another loop over everything.
+
+ e.g. SEMaintenanceBenchmark.py --grids 2000 --scales 1 2 4
+      SEMaintenanceBenchmark.py --generate C:\\test\\save --grids 500 --players 200
+
+"""
+
+import argparse #Used for CLI arguments
+import os #For file system work
+import shutil #For copying the generated saves for each run
+import sys #For finding the python to run the utility with
+import random #For making up the saves
+import subprocess #For running the utility, a process per run so memory use is measured on its own
+import tempfile #For somewhere to put the saves while benchmarking
+import time #For timing runs
+import glob #For finding the run report
+import json #For reading the run report & writing --output
+import math #For working out how the time grows
+import collections #For the mode table
+
+#########################################
+### Functions ###########################
+#########################################
+
+utilitypath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SEMaintenanceUtility.py")
+
+#The modes that get benchmarked, name: utility options. -B is always added so backups aren't part of the timing
+#{plan} is swapped for a plan file in the run's folder, see RunUtility
+benchmodes = collections.OrderedDict([
+    ("full-cleanup", ["--full-cleanup"]),
+    ("full-cleanup-stream", ["--full-cleanup", "--stream"]),
+    ("full-cleanup-etree", ["--full-cleanup", "--xml-backend", "etree"]),
+    ("full-cleanup-map-joints", ["--full-cleanup", "--map-joints"]),
+    ("full-cleanup-jobs", ["--full-cleanup", "--jobs", "4"]),
+    ("full-cleanup-map-joints-jobs", ["--full-cleanup", "--map-joints", "--jobs", "4"]),
+    ("full-cleanup-warm-cache", ["--full-cleanup"]),
+    ("full-cleanup-whatif", ["--full-cleanup", "--whatif", "--plan-file", "{plan}"]),
+    ("apply-plan", ["--apply-plan", "{plan}"]),
+    ("cleanup-items", ["--cleanup-items"]),
+    ("cleanup-items-splice", ["--cleanup-items", "--splice"]),
+    ("cleanup-unpowered", ["--cleanup-unpowered"]),
+    ("remove-npc-ships", ["--remove-npc-ships"]),
+    ("prune-players", ["--prune-players"]),
+    ("prune-factions", ["--prune-factions"]),
+    ("stop-movement", ["--stop-movement"]),
+    ("disable-factories", ["--disable-factories", "hard"]),
+    ("remove-refinery-queue", ["--remove-refinery-queue"]),
+    ("disable-spotlights", ["--disable-spotlights"]),
+    ("save-asteroids", ["--save-asteroids"]),
+    ("respawn-asteroids", ["--respawn-asteroids"]),
+])
+
+#Modes that need another run done first on the same copy of the save, name: utility options for that run. It isn't timed
+#The warm cache run goes over the save a --full-cleanup has already been done to, like the next run on a server would
+benchsetups = {
+    "full-cleanup-warm-cache": ["--full-cleanup"],
+    "apply-plan": ["--full-cleanup", "--whatif", "--plan-file", "{plan}"],
+}
+
+#Beacon names the utility counts as NPC ships
+npcnames = ["Private Sail", "Business Shipment", "Commercial Freighter", "Mining Carriage", "Mining Transport", "Mining Hauler", "Military Escort", "Military Minelayer", "Military Transporter"]
+
+firstplayerid = 144115188075855873 #Player IDs in real saves are about here
+firstfactionid = 182311957475155
+
+
+#Function to write the position & orientation of an entity
+def WritePosition(w, indent, pos):
+    w('%s<PositionAndOrientation>\n' % indent)
+    w('%s  <Position x="%.4f" y="%.4f" z="%.4f" />\n' % ((indent,) + pos))
+    w('%s  <Forward x="0" y="0" z="-1" />\n' % indent)
+    w('%s  <Up x="0" y="1" z="0" />\n' % indent)
+    w('%s</PositionAndOrientation>\n' % indent)
+
+
+#Function to write a single block. extra is any more nodes to put in it, already formatted
+def WriteBlock(w, attrib, subtype, entityid, blockmin, owner=None, extra=""):
+    w('        <MyObjectBuilder_CubeBlock xsi:type="%s">\n' % attrib)
+    w('          <SubtypeName>%s</SubtypeName>\n' % subtype)
+    if entityid is not None:
+        w('          <EntityId>%d</EntityId>\n' % entityid)
+    w('          <Min x="%d" y="%d" z="%d" />\n' % blockmin)
+    w('          <BlockOrientation Forward="Forward" Up="Up" />\n')
+    if owner is not None:
+        w('          <Owner>%s</Owner>\n' % owner)
+        w('          <ShareMode>None</ShareMode>\n')
+    w(extra)
+    w('        </MyObjectBuilder_CubeBlock>\n')
+
+
+#Function to write an inventory with a number of ore stacks in it
+def InventoryNode(name, items):
+    if items == 0:
+        return '          <%s>\n            <Items />\n            <nextItemId>0</nextItemId>\n          </%s>\n' % (name, name)
+    node = '          <%s>\n            <Items>\n' % name
+    for i in range(items):
+        node += ('              <MyObjectBuilder_InventoryItem>\n                <Amount>%d</Amount>\n'
+                 '                <PhysicalContent xsi:type="MyObjectBuilder_Ingot">\n                  <SubtypeName>Uranium</SubtypeName>\n'
+                 '                </PhysicalContent>\n                <ItemId>%d</ItemId>\n              </MyObjectBuilder_InventoryItem>\n') % (i + 1, i)
+    return node + '            </Items>\n            <nextItemId>%d</nextItemId>\n          </%s>\n' % (items, name)
+
+
+#Function to write a CubeGrid entity. Returns the next free entity ID
+#kind is what sort of grid to make; powered, unpowered, npc, station or junk. joint, if given, is ("stator" or "piston", id of the other half)
+def WriteGrid(w, rnd, entityid, pos, blocks, owner, kind, queueitems, gridsize="Large", joint=None, name=None):
+    gridid = entityid
+    entityid += 1
+    w('    <MyObjectBuilder_EntityBase xsi:type="MyObjectBuilder_CubeGrid">\n')
+    w('      <EntityId>%d</EntityId>\n' % gridid)
+    w('      <PersistentFlags>CastShadows InScene</PersistentFlags>\n')
+    WritePosition(w, "      ", pos)
+    w('      <GridSizeEnum>%s</GridSizeEnum>\n' % gridsize)
+    w('      <CubeBlocks>\n')
+
+    x = 0
+    if joint is not None: #Joint goes at 0,0,0 so the other half can be put right on top of it
+        jointkind, otherid = joint
+        if jointkind == "stator":
+            WriteBlock(w, "MyObjectBuilder_MotorStator", "LargeStator", entityid, (0, 0, 0), owner, '          <RotorEntityId>%d</RotorEntityId>\n' % otherid)
+        elif jointkind == "piston":
+            WriteBlock(w, "MyObjectBuilder_PistonBase", "LargePistonBase", entityid, (0, 0, 0), owner, '          <TopBlockId>%d</TopBlockId>\n' % otherid)
+        elif jointkind == "rotor":
+            WriteBlock(w, "MyObjectBuilder_MotorRotor", "LargeRotor", otherid, (0, 0, 0), owner)
+        else:
+            WriteBlock(w, "MyObjectBuilder_PistonTop", "LargePistonTop", otherid, (0, 0, 0), owner)
+        entityid += 1
+        x += 1
+
+    if kind == "powered":
+        WriteBlock(w, "MyObjectBuilder_Reactor", "LargeBlockSmallGenerator", entityid, (x, 0, 0), owner, InventoryNode("Inventory", 1) + '          <Enabled>true</Enabled>\n')
+        entityid += 1
+        x += 1
+    elif kind == "unpowered":
+        WriteBlock(w, "MyObjectBuilder_Reactor", "LargeBlockSmallGenerator", entityid, (x, 0, 0), owner, InventoryNode("Inventory", 0) + '          <Enabled>true</Enabled>\n')
+        WriteBlock(w, "MyObjectBuilder_BatteryBlock", "LargeBlockBatteryBlock", entityid + 1, (x + 1, 0, 0), owner, '          <Enabled>true</Enabled>\n          <CurrentStoredPower>0</CurrentStoredPower>\n          <ProducerEnabled>true</ProducerEnabled>\n')
+        entityid += 2
+        x += 2
+    elif kind == "station":
+        WriteBlock(w, "MyObjectBuilder_BatteryBlock", "LargeBlockBatteryBlock", entityid, (x, 0, 0), owner, '          <Enabled>true</Enabled>\n          <CurrentStoredPower>2.5</CurrentStoredPower>\n          <ProducerEnabled>true</ProducerEnabled>\n')
+        WriteBlock(w, "MyObjectBuilder_SolarPanel", "LargeBlockSolarPanel", entityid + 1, (x + 1, 0, 0), owner, '          <Enabled>true</Enabled>\n')
+        entityid += 2
+        x += 2
+
+    if kind == "npc":
+        WriteBlock(w, "MyObjectBuilder_Beacon", "LargeBlockBeacon", entityid, (x, 0, 0), owner, '          <CustomName>%s</CustomName>\n          <Enabled>true</Enabled>\n' % rnd.choice(npcnames))
+        entityid += 1
+        x += 1
+    elif rnd.random() < 0.3:
+        WriteBlock(w, "MyObjectBuilder_RadioAntenna", "LargeBlockRadioAntenna", entityid, (x, 0, 0), owner, '          <CustomName>Antenna %d</CustomName>\n          <Enabled>true</Enabled>\n' % gridid)
+        entityid += 1
+        x += 1
+
+    #Factories & lights, mostly on stations
+    if kind in ("station", "powered", "unpowered") and rnd.random() < (0.6 if kind == "station" else 0.2):
+        queue = ""
+        if queueitems > 0:
+            queue = '          <Queue>\n' + '            <Item>\n              <Amount>1000</Amount>\n              <Blueprint>IronOreToIngot</Blueprint>\n            </Item>\n' * queueitems + '          </Queue>\n'
+        WriteBlock(w, "MyObjectBuilder_Refinery", "LargeRefinery", entityid, (x, 0, 0), owner,
+                   '          <Enabled>true</Enabled>\n' + InventoryNode("InputInventory", rnd.randint(0, 2)) + InventoryNode("OutputInventory", 0) + queue)
+        WriteBlock(w, "MyObjectBuilder_Assembler", "LargeAssembler", entityid + 1, (x + 3, 0, 0), owner,
+                   '          <Enabled>true</Enabled>\n' + InventoryNode("InputInventory", 0) + InventoryNode("OutputInventory", 0) + '          <Queue />\n')
+        entityid += 2
+        x += 6
+    if rnd.random() < 0.2:
+        WriteBlock(w, "MyObjectBuilder_ReflectorLight", "LargeBlockFrontLight", entityid, (x, 0, 0), owner, '          <Enabled>true</Enabled>\n')
+        entityid += 1
+        x += 1
+
+    #Fill the rest up with armour, which is what most of every real grid is
+    while x < blocks:
+        WriteBlock(w, "MyObjectBuilder_CubeBlock", "LargeBlockArmorBlock", None, (x % 16, (x // 16) % 16, x // 256))
+        x += 1
+
+    w('      </CubeBlocks>\n')
+    w('      <IsStatic>%s</IsStatic>\n' % ("true" if kind == "station" else "false"))
+    if kind == "npc" or rnd.random() < 0.3:
+        w('      <LinearVelocity x="%.2f" y="%.2f" z="%.2f" />\n' % (rnd.uniform(-50, 50), rnd.uniform(-50, 50), rnd.uniform(-50, 50)))
+        w('      <AngularVelocity x="%.3f" y="0" z="0" />\n' % rnd.uniform(-1, 1))
+    else:
+        w('      <LinearVelocity x="0" y="0" z="0" />\n')
+        w('      <AngularVelocity x="0" y="0" z="0" />\n')
+    w('      <DampenersEnabled>%s</DampenersEnabled>\n' % ("false" if kind == "npc" else "true"))
+    if name is not None:
+        w('      <DisplayName>%s</DisplayName>\n' % name)
+    w('    </MyObjectBuilder_EntityBase>\n')
+
+    return entityid
+
+
+#Function to make up a save folder. Returns a dict of how many of everything was made
+#Grids are a mix of powered ships, stations, unpowered junk and NPC ships, with some joined to a second grid by a rotor or piston
+def GenerateSave(savedir, grids=500, blocks=60, floating=500, voxels=50, players=200, factions=40, relations=200,
+                 refineryqueue=20, characters=20, joints=0.1, seed=1):
+    rnd = random.Random(seed)
+    if not os.path.isdir(savedir):
+        os.makedirs(savedir)
+
+    playerids = [str(firstplayerid + i) for i in range(players)]
+    owners = playerids[:max(1, players // 2)] #Only half the players own anything, the rest are prunable
+    worldsize = 20000.0 * max(1.0, (grids / 1000.0) ** (1.0 / 3)) #Keep the density about the same as it grows
+    counts = collections.Counter()
+
+    def RandomPosition():
+        return (rnd.uniform(-worldsize, worldsize), rnd.uniform(-worldsize, worldsize), rnd.uniform(-worldsize, worldsize))
+
+    ### Large save ###
+    out = []
+    w = out.append
+    w('<?xml version="1.0"?>\n')
+    w('<MyObjectBuilder_Sector xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n')
+    w('  <Position>\n    <X>0</X>\n    <Y>0</Y>\n    <Z>0</Z>\n  </Position>\n')
+    w('  <SectorEvents>\n    <Events />\n  </SectorEvents>\n')
+    w('  <AppVersion>1043</AppVersion>\n')
+    w('  <SectorObjects>\n')
+
+    entityid = 100000000000000000
+    for g in range(grids):
+        roll = rnd.random()
+        if roll < 0.35:
+            kind = "powered"
+        elif roll < 0.5:
+            kind = "station"
+        elif roll < 0.6:
+            kind = "npc"
+        elif roll < 0.8:
+            kind = "unpowered"
+        else:
+            kind = "junk" #No power at all
+        counts[kind] += 1
+        owner = rnd.choice(owners)
+        pos = RandomPosition()
+        size = max(1, int(rnd.gauss(blocks, blocks / 3.0)))
+
+        if rnd.random() < joints:
+            #Joined pair, the top half goes right where the joint block is
+            jointkind, topkind = rnd.choice([("stator", "rotor"), ("piston", "pistontop")])
+            topblockid = entityid + 10 ** 9
+            entityid = WriteGrid(w, rnd, entityid, pos, size, owner, kind, refineryqueue, joint=(jointkind, topblockid), name="Ship %d" % g)
+            entityid = WriteGrid(w, rnd, entityid, pos, max(1, size // 4), owner, "junk", 0, joint=(topkind, topblockid))
+            counts["joints"] += 1
+        else:
+            entityid = WriteGrid(w, rnd, entityid, pos, size, owner, kind, refineryqueue, name="Ship %d" % g if rnd.random() < 0.5 else None)
+
+    for f in range(floating):
+        ore = rnd.choice(["Iron", "Nickel", "Silicon", "Cobalt", "Stone"])
+        w('    <MyObjectBuilder_EntityBase xsi:type="MyObjectBuilder_FloatingObject">\n')
+        w('      <EntityId>%d</EntityId>\n' % entityid)
+        WritePosition(w, "      ", RandomPosition())
+        w('      <Item>\n        <Amount>%d</Amount>\n        <PhysicalContent xsi:type="MyObjectBuilder_Ore">\n          <SubtypeName>%s</SubtypeName>\n        </PhysicalContent>\n      </Item>\n' % (rnd.randint(1, 5000), ore))
+        w('    </MyObjectBuilder_EntityBase>\n')
+        entityid += 1
+
+    for c in range(characters):
+        w('    <MyObjectBuilder_EntityBase xsi:type="MyObjectBuilder_Character">\n')
+        w('      <EntityId>%d</EntityId>\n' % entityid)
+        WritePosition(w, "      ", RandomPosition())
+        w('      <CharacterModel>Default_Astronaut</CharacterModel>\n')
+        w('    </MyObjectBuilder_EntityBase>\n')
+        entityid += 1
+
+    for v in range(voxels):
+        asteroidname = ("moon%d.vox" if v % 4 == 0 else "asteroid%d.vox") % v
+        with open(os.path.join(savedir, asteroidname), "wb") as voxfile:
+            voxfile.write(bytes(rnd.getrandbits(8) for i in range(2048)))
+        w('    <MyObjectBuilder_EntityBase xsi:type="MyObjectBuilder_VoxelMap">\n')
+        w('      <EntityId>%d</EntityId>\n' % entityid)
+        WritePosition(w, "      ", RandomPosition())
+        w('      <Filename>%s</Filename>\n' % asteroidname)
+        w('    </MyObjectBuilder_EntityBase>\n')
+        entityid += 1
+
+    w('  </SectorObjects>\n')
+    w('  <SectorNumber>0</SectorNumber>\n')
+    w('</MyObjectBuilder_Sector>')
+    with open(os.path.join(savedir, "SANDBOX_0_0_0_.sbs"), "w") as savefile:
+        savefile.write("".join(out))
+
+    ### Small save ###
+    out = []
+    w = out.append
+    w('<?xml version="1.0"?>\n')
+    w('<MyObjectBuilder_Checkpoint xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n')
+    w('  <SessionName>Benchmark</SessionName>\n')
+    w('  <AllPlayers>\n')
+    for i, playerid in enumerate(playerids):
+        w('    <PlayerItem>\n      <PlayerId>%s</PlayerId>\n      <IsDead>%s</IsDead>\n      <Name>Player %d</Name>\n      <SteamId>%d</SteamId>\n    </PlayerItem>\n'
+          % (playerid, "true" if rnd.random() < 0.3 else "false", i, 76561190000000000 + i))
+    w('  </AllPlayers>\n')
+    w('  <Players>\n    <dictionary>\n')
+    for i, playerid in enumerate(playerids):
+        w('      <item>\n        <Key>\n          <ClientId>%d</ClientId>\n          <SerialId>0</SerialId>\n        </Key>\n        <Value>\n          <PlayerId>%s</PlayerId>\n        </Value>\n      </item>\n'
+          % (76561190000000000 + i, playerid))
+    w('    </dictionary>\n  </Players>\n')
+
+    factionids = [str(firstfactionid + i) for i in range(factions)]
+    members = collections.OrderedDict((factionid, []) for factionid in factionids)
+    if factions > 0:
+        for playerid in playerids:
+            if rnd.random() < 0.6: #Some players are in a faction
+                members[rnd.choice(factionids)].append(playerid)
+    #And some factions are empty
+    for factionid in factionids:
+        if rnd.random() < 0.2:
+            members[factionid] = []
+
+    w('  <Factions>\n    <Factions>\n')
+    for i, factionid in enumerate(factionids):
+        w('      <MyObjectBuilder_Faction>\n        <FactionId>%s</FactionId>\n        <Tag>F%d</Tag>\n        <Name>Faction %d</Name>\n' % (factionid, i, i))
+        w('        <Members>\n')
+        for playerid in members[factionid]:
+            w('          <MyObjectBuilder_FactionMember>\n            <PlayerId>%s</PlayerId>\n            <IsLeader>false</IsLeader>\n            <IsFounder>false</IsFounder>\n          </MyObjectBuilder_FactionMember>\n' % playerid)
+        w('        </Members>\n        <JoinRequests>\n')
+        if players > 0 and rnd.random() < 0.3:
+            w('          <MyObjectBuilder_FactionMember>\n            <PlayerId>%s</PlayerId>\n            <IsLeader>false</IsLeader>\n            <IsFounder>false</IsFounder>\n          </MyObjectBuilder_FactionMember>\n' % rnd.choice(playerids))
+        w('        </JoinRequests>\n')
+        w('        <AutoAcceptMember>false</AutoAcceptMember>\n        <AutoAcceptPeace>false</AutoAcceptPeace>\n')
+        w('      </MyObjectBuilder_Faction>\n')
+    w('    </Factions>\n')
+
+    w('    <Players>\n      <dictionary>\n')
+    for factionid, playerlist in members.items():
+        for playerid in playerlist:
+            w('        <item>\n          <Key>%s</Key>\n          <Value>%s</Value>\n        </item>\n' % (playerid, factionid))
+    w('      </dictionary>\n    </Players>\n')
+
+    w('    <Relations>\n')
+    pairs = set()
+    if factions > 1:
+        while len(pairs) < min(relations, factions * (factions - 1) // 2):
+            pair = tuple(sorted(rnd.sample(factionids, 2)))
+            pairs.add(pair)
+    for factionid1, factionid2 in sorted(pairs):
+        w('      <MyObjectBuilder_FactionRelation>\n        <FactionId1>%s</FactionId1>\n        <FactionId2>%s</FactionId2>\n        <Relation>%s</Relation>\n      </MyObjectBuilder_FactionRelation>\n'
+          % (factionid1, factionid2, rnd.choice(["Enemies", "Neutral"])))
+    w('    </Relations>\n')
+
+    w('    <Requests>\n')
+    for factionid in factionids:
+        if factions > 1 and rnd.random() < 0.3:
+            w('      <MyObjectBuilder_FactionRequests>\n        <FactionId>%s</FactionId>\n        <FactionRequests>\n          <long>%s</long>\n        </FactionRequests>\n      </MyObjectBuilder_FactionRequests>\n'
+              % (factionid, rnd.choice([f for f in factionids if f != factionid])))
+    w('    </Requests>\n')
+    w('  </Factions>\n')
+    w('</MyObjectBuilder_Checkpoint>')
+    with open(os.path.join(savedir, "Sandbox.sbc"), "w") as savefile:
+        savefile.write("".join(out))
+
+    counts.update({"grids": grids, "floating": floating, "voxels": voxels, "players": players, "factions": factions, "relations": len(pairs), "characters": characters})
+    return dict(counts)
+
+
+#Function to run the utility once on a fresh copy of a save. Returns a dict of how it went
+#Each run is its own process in its own folder, so the peak memory in its run report is just that run
+#setup is the options for a run to do first on the same copy, which isn't timed (see benchsetups)
+def RunUtility(savedir, workdir, options, setup=None):
+    if os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    runsavedir = os.path.join(workdir, "save")
+    shutil.copytree(savedir, runsavedir)
+    planpath = os.path.join(workdir, "plan.json")
+
+    if setup is not None:
+        result = RunUtilityProcess(runsavedir, workdir, [planpath if option == "{plan}" else option for option in setup])
+        if result["status"] != "OK":
+            result["status"] = "SETUP " + result["status"]
+            return result
+        shutil.rmtree(os.path.join(workdir, "semu_logs"), ignore_errors=True) #So the report found below is the timed run's
+
+    result = RunUtilityProcess(runsavedir, workdir, [planpath if option == "{plan}" else option for option in options])
+
+    reports = glob.glob(os.path.join(workdir, "semu_logs", "*.report.json"))
+    if len(reports) > 0:
+        with open(reports[0]) as reportfile:
+            report = json.load(reportfile)
+        result["peak_rss_mb"] = report.get("peak_rss_mb")
+        result["phases"] = dict((phase["phase"], phase["wall_seconds"]) for phase in report["phases"])
+
+    return result
+
+
+#Function to start the utility on a save and wait for it. Returns a dict of how it went
+def RunUtilityProcess(runsavedir, workdir, options):
+    starttime = time.perf_counter()
+    process = subprocess.run([sys.executable, utilitypath, runsavedir, "-B", "--quiet"] + options, cwd=workdir,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    seconds = time.perf_counter() - starttime
+
+    result = {"seconds": round(seconds, 3), "status": "OK" if process.returncode == 0 else "FAILED (exit %d)" % process.returncode}
+    if "Traceback" in process.stderr:
+        result["status"] = "FAILED (%s)" % process.stderr.strip().splitlines()[-1][:80]
+    return result
+
+
+#Function to work out roughly how the time grows with the size of the save, from the smallest & biggest scale
+#1 is linear, 2 is quadratic
+def GrowthExponent(scales, seconds):
+    if len(scales) < 2 or seconds[0] <= 0 or seconds[-1] <= 0:
+        return None
+    return math.log(seconds[-1] / seconds[0]) / math.log(scales[-1] / scales[0])
+
+
+#########################################
+### Main ################################
+#########################################
+
+def BuildArgParser():
+    argparser = argparse.ArgumentParser(description="Makes up Space Engineers saves and benchmarks SEMaintenanceUtility against them.")
+    argparser.add_argument('--generate', help="Just make a save in this folder and stop, don't benchmark anything.", default='')
+    argparser.add_argument('--grids', help="How many CubeGrids at scale 1.", type=int, default=500)
+    argparser.add_argument('--blocks', help="Average blocks per CubeGrid.", type=int, default=60)
+    argparser.add_argument('--floating', help="How many free floating objects at scale 1.", type=int, default=500)
+    argparser.add_argument('--voxels', help="How many asteroids at scale 1.", type=int, default=50)
+    argparser.add_argument('--players', help="How many players at scale 1.", type=int, default=200)
+    argparser.add_argument('--factions', help="How many factions at scale 1.", type=int, default=40)
+    argparser.add_argument('--relations', help="How many faction relations at scale 1.", type=int, default=200)
+    argparser.add_argument('--refinery-queue', help="How many items in each refinery queue.", type=int, default=20)
+    argparser.add_argument('--characters', help="How many player characters floating about at scale 1.", type=int, default=20)
+    argparser.add_argument('--joints', help="Fraction of CubeGrids joined to another by a rotor or piston.", type=float, default=0.1)
+    argparser.add_argument('--seed', help="Random seed, the same seed makes the same save.", type=int, default=1)
+    argparser.add_argument('--scales', help="Multiply the counts above by each of these and benchmark them all, e.g. --scales 1 2 4", nargs="+", type=float, default=[1])
+    argparser.add_argument('--modes', help="Which modes to run. Defaults to all of them; %s" % ", ".join(benchmodes), nargs="+", choices=list(benchmodes), default=list(benchmodes))
+    argparser.add_argument('--repeat', help="Run each mode this many times and keep the fastest.", type=int, default=1)
+    argparser.add_argument('--workdir', help="Where to put the saves while benchmarking. Defaults to a temp folder that's removed afterwards.", default='')
+    argparser.add_argument('--output', '-o', help="Also write the results to this JSON file.", default='')
+
+    return argparser
+
+
+def main():
+    args = BuildArgParser().parse_args()
+
+    if args.generate != '':
+        counts = GenerateSave(args.generate, args.grids, args.blocks, args.floating, args.voxels, args.players, args.factions,
+                              args.relations, args.refinery_queue, args.characters, args.joints, args.seed)
+        print("Generated %s: %s" % (args.generate, ", ".join("%s %d" % item for item in sorted(counts.items()))))
+        return
+
+    workdir = args.workdir if args.workdir != '' else tempfile.mkdtemp(prefix="semu-bench-")
+    results = []
+    try:
+        for scale in args.scales:
+            savedir = os.path.join(workdir, "scale-%g" % scale)
+            counts = GenerateSave(savedir, int(args.grids * scale), args.blocks, int(args.floating * scale), int(args.voxels * scale),
+                                  int(args.players * scale), int(args.factions * scale), int(args.relations * scale),
+                                  args.refinery_queue, int(args.characters * scale), args.joints, args.seed)
+            savemb = (os.path.getsize(os.path.join(savedir, "SANDBOX_0_0_0_.sbs")) + os.path.getsize(os.path.join(savedir, "Sandbox.sbc"))) / (1024.0 * 1024)
+            print("Scale %g: %.1f MB, %d grids, %d players, %d factions" % (scale, savemb, counts["grids"], counts["players"], counts["factions"]))
+
+            for mode in args.modes:
+                best = None
+                for i in range(max(1, args.repeat)):
+                    result = RunUtility(savedir, os.path.join(workdir, "run"), benchmodes[mode], benchsetups.get(mode))
+                    if best is None or result["seconds"] < best["seconds"]:
+                        best = result
+                best.update({"scale": scale, "mode": mode, "save_mb": round(savemb, 2), "counts": counts})
+                results.append(best)
+                print("  %-28s %8.2fs %10s MB  %s" % (mode, best["seconds"], "%.1f" % best["peak_rss_mb"] if best.get("peak_rss_mb") is not None else "?", best["status"]))
+    finally:
+        if args.workdir == '':
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    #How does each mode grow with the size of the save?
+    if len(args.scales) > 1:
+        print("")
+        print("Growth from scale %g to %g (1 = linear, 2 = quadratic)" % (args.scales[0], args.scales[-1]))
+        for mode in args.modes:
+            moderesults = [result for result in results if result["mode"] == mode]
+            if any(result["status"] != "OK" for result in moderesults): #Failed runs don't say anything about speed
+                continue
+            exponent = GrowthExponent(args.scales, [result["seconds"] for result in moderesults])
+            if exponent is None:
+                continue
+            print("  %-28s %5.2f%s" % (mode, exponent, "  <-- grows much faster than the save" if exponent > 1.5 else ""))
+
+    if args.output != '':
+        with open(args.output, "w") as outputfile:
+            json.dump(results, outputfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
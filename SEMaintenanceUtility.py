@@ -80,6 +80,72 @@ v1.2.1
  v1.3.7
  - Added function to remove Spotlights. Only standard, might not work with Steam Workshop spotlights
 
+ v1.4
+ - Added --stream. Reads the large save one entity at a time and writes kept entities straight back out, so RAM use
+     depends on the biggest single grid instead of the whole save
+ - Fixed the SectorObjects loop, it was checking the builtin 'object' instead of the entity
+ - Fixed faction pruning crashing on the Requests table
+ - Fixed the log lines that passed their values as extra arguments with no %s, they threw an error instead of logging
+ - Each CubeGrid's blocks are now only walked once (SummariseCluster) instead of once per check
+ - SectorObjects is now rebuilt once after every entity has been checked, instead of removing entities one at a time
+ - Player & faction pruning now run off an index of the small save (PlayerFactionIndex) instead of rescanning every faction per player
+ - Fixed player pruning never matching anything in the Players table
+ - Asteroid respawn checks now use a spatial hash of grid & player positions instead of checking every one of them per asteroid
+ - Added --respawn-euclidean to use the straight line distance for the asteroid respawn range
+ - Fixed asteroid respawn using a range of 0, so asteroids were respawned no matter what was near them
+ - Added --map-joints. Pairs up stators with rotors and piston bases with tops by their position in the world, so grids
+     joined together are checked & removed as one cluster instead of being skipped
+ - Added --batch, --workers & --batch-memory to do a whole lot of save folders at once, one process per save
+ - Added --jobs to check the CubeGrids of a single save in several processes at once. The checks now give back a
+     decision (EntityDecision) which is then applied, so they can be done anywhere
+ - Log lines pass their values as %-style arguments now, so nothing is formatted for a line that's turned off
+ - Per-entity log lines now go through their own logger, added --quiet (--summary-only) to turn them off and just log totals
+ - Each run now writes a JSON report next to its log with the wall time, CPU time, peak memory and amount of work done
+     in each phase. Added --trace-memory to get the peak Python memory of each phase as well
+ - Backups now go into a chunk store in semu-backups, only the parts of the save that changed since the last backup are
+     written. --big-backup keeps every backup instead of just the last one. Added --list-backups & --restore-backup
+ - Fixed the normal backups, they were trying to write inside the save files instead of beside them
+ - Backups & asteroid snapshots are now compressed, gzip by default. Added --compress (none, gzip, lzma or zstd) &
+     --compress-level. Asteroids are respawned from whichever kind of snapshot is there
+ - Fixed --save-asteroids & --respawn-asteroids, they were using variables that only existed inside the main function
+ - Asteroid snapshots now have a manifest with the size, age & hash of each voxel file. Asteroids that haven't changed
+     aren't snapshotted again, and asteroids that already match their snapshot aren't respawned
+ - Asteroid snapshots & respawns are now copied several at a time (--io-threads) and the throughput is logged
+ - Saves are now written by SaveWriter, with the exact header SE expects, to a temp file that replaces the save once it's
+     all written. Entities that weren't changed are copied straight from the old save instead of being written out again
+ - Added --splice. Goes by an index of where every entity is in the large save (cached beside it) and only parses the
+     entities the options given actually need, the rest of the save is copied through untouched
+ - Added SEMaintenanceBenchmark.py, makes up saves of any size and times each mode against them at a few different sizes
+ - Saves are now loaded with lxml if it's installed, falling back to Python's own XML library if it isn't (or with
+     --stream, where it's quicker). Added --xml-backend to pick one. The saves are written out exactly the same either way
+ - The cleanup options are now compiled once into a RulePlan. Each CubeGrid's blocks are only looked at for what the
+     options need, and when nothing needs every block (owners, factories, names for the log) it stops reading a grid
+     as soon as it knows it's staying
+ - Fixed --full-cleanup not disabling any factories, it was passing "s" instead of "soft"
+ - Grids are now gone through for the blocks that usually decide things first (joints, reactors, batteries, beacons)
+     and stop at the first one that does. The blocks that didn't need reading are counted as "Blocks skipped".
+     This only happens when nothing needs every block, so not without --quiet (names for the log) or with
+     --full-cleanup, --prune-players, --disable-factories, --remove-refinery-queue or --disable-spotlights. Without
+     --ignore-joint or --map-joints a grid is still read to the end, in case there's a joint further on
+ - Fixed NPC detection to stop at a grid's first beacon like it was meant to
+ - What was decided for each CubeGrid is now cached in semu-cache, along with a hash of the grid. Grids that haven't
+     changed since the last run with the same options aren't checked again, and with --splice they aren't even
+     parsed if there's nothing to change on them. Added --no-cache & --cache-size
+ - Added --export-catalog, writes the save's entities, blocks by type & subtype, owners, positions, players & factions
+     to an SQLite database in semu-cache in a single pass. Added --query to answer questions from it, either one of the
+     reports (owners, grids, refineries, floating...) or SQL
+ - Added --watch. Keeps running and does the maintenance whenever the server writes a new save, once the save files
+     have stopped changing (--watch-settle). Uses inotify on Linux, otherwise checks the files every --watch-poll seconds.
+     The rule plan, entity index and decision cache stay loaded between runs. Added --watch-runs & --watch-skip-current
+ - --whatif now writes a plan of everything it would remove & change (--plan-file), keyed by EntityId & PlayerId with a
+     checksum of the save. Added --apply-plan to make those changes later without checking anything again
+ - What's kept between phases is now in compact records instead of the XML. With the large save loaded, its XML is let
+     go as soon as SectorObjects has been checked (only the entities that changed are kept, as bytes), so the asteroid
+     & player phases and the save don't hold it. Asteroid & grid positions and the entity index are packed into arrays
+ - --whatif doesn't write to the save folder any more. It skips the decision cache and doesn't save the entity index
+ - Fixed a normal backup throwing away the ones --big-backup was meant to keep. It only replaces the last normal backup now
+ - Fixed player & faction pruning leaving a list's closing tag indented like one of its entries when the last one was removed
+
 
 """
 
@@ -90,38 +156,90 @@ import shutil #For copying files to backups
 import datetime #For timestamps
 import sys #for propper sys.exit()
 import traceback #For some error handling verbosity
+import glob #For finding --batch save folders
+import copy #For giving each --batch save its own copy of the options
+import concurrent.futures #For running --batch saves side by side
+import multiprocessing #For --jobs worker processes
+import mmap #For scanning the large save for entities without parsing it
+import array #For packing positions & offsets into compact arrays
+import math #For the NaN that stands in for a missing position
 import logging
+import collections #For the tally of what's been done
+import re #For picking bits out of entities in the large save without parsing them
+import time #For timing each phase in the run report
+import json #For writing the run report & the backup manifests
+import hashlib #For naming backup chunks by their contents
+import zlib #For picking backup chunk boundaries
+import gzip #For compressed backups & snapshots
+import lzma #For compressed backups & snapshots
+import sqlite3 #For the decision cache
+import select #For waiting on --watch changes
+import struct #For reading inotify events
+import ctypes #For inotify, used by --watch on Linux, & finding out how much RAM there is on Windows
+import ctypes.util
+try:
+    import zstandard #Optional, for --compress zstd
+except ImportError:
+    zstandard = None
+import tracemalloc #For --trace-memory
+try:
+    import resource #For peak RSS in the run report, not on Windows
+except ImportError:
+    resource = None
+try:
+    from lxml import etree as lxmletree #Optional, much quicker at reading big saves. See --xml-backend
+except ImportError:
+    lxmletree = None
+from xml.sax.saxutils import quoteattr, escape #For writing the saves out
 
 #########################################
 ### Functions ###########################
 #########################################
 logger = None
+logfilename = None #Set by OpenLog, the run report goes next to it
+
+#Per-entity, per-block and per-player lines go through here instead, so --quiet can turn them all off at once and
+#   anything costly that's only needed for them can be skipped with detaillogger.isEnabledFor(logging.INFO)
+detaillogger = logging.getLogger("semu.detail")
+
+#Running count of what's been done, logged at the end of a run. With --quiet it's all you get
+tally = collections.Counter()
+
+#Which XML library reads the saves, "lxml" or "etree". Set by UseXMLBackend
+xmlbackend = "etree"
 
 
 #Function to open the log
-def OpenLog():
+#name is added on to the file name, for when there's more than one save being done at a time. Returns the log's path
+def OpenLog(name="", console=True):
+    global logfilename
     logfoldername = "./semu_logs/"
     if not os.path.isdir(logfoldername):
         #and make it if it doesn't
         os.makedirs(logfoldername)
 
-    filename = '{0}.log'.format(datetime.datetime.now().strftime("%Y%m%d_%H%M"))
+    filename = '{0}{1}.log'.format(datetime.datetime.now().strftime("%Y%m%d_%H%M"), name)
     filename = os.path.join(logfoldername, filename)
     logging.basicConfig(filename=filename,
                         filemode='w',
                         format='%(asctime)s %(levelname)-8s %(message)s',
                         datefmt='%d.%m %H:%M',
-                        level='INFO')
+                        level='INFO',
+                        force=True) #Batch workers may have inherited the parent's log, start fresh
 
-    # define a Handler which writes INFO messages or higher to the sys.stderr
-    console = logging.StreamHandler()
-    console.setLevel(logging.INFO)
-    # set a format which is simpler for console use
-    formatter = logging.Formatter('%(levelname)-8s %(message)s')
-    # tell the handler to use this format
-    console.setFormatter(formatter)
-    # add the handler to the root logger
-    logging.getLogger('').addHandler(console)
+    if console:
+        # define a Handler which writes INFO messages or higher to the sys.stderr
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        # set a format which is simpler for console use
+        formatter = logging.Formatter('%(levelname)-8s %(message)s')
+        # tell the handler to use this format
+        console.setFormatter(formatter)
+        # add the handler to the root logger
+        logging.getLogger('').addHandler(console)
+
+    logfilename = filename
+    return filename
 
 
 #Got shitty with crazy UTF characters breaking things. This function will attempt to make sense of it and return "<unicode>" if it breaks
@@ -136,58 +254,379 @@ def SafeString(input):
         return(str(input))
 
 
-#Function to possibly find a CubeGrid's name. Search for the name(s) of Antennae and Beacons
-def FindObjectName(objectcluster):
-    foundnames = []
+#Function to pick which XML library reads the saves. "lxml" uses lxml if it's installed, "etree" is the one built into
+#   Python. "auto" is lxml unless streaming, lxml loads a whole save several times quicker but its iterparse is slower
+#   as every node has to be handed back to Python. Returns the one that's being used, so etree if lxml isn't there
+#Either way the saves are written out by SaveWriter, so they come out exactly the same
+def UseXMLBackend(name="auto", stream=False):
+    global xmlbackend
+    if name == "lxml" or (name == "auto" and not stream):
+        xmlbackend = "lxml" if lxmletree is not None else "etree"
+    else:
+        xmlbackend = "etree"
+    return xmlbackend
 
-    for obj in objectcluster:
-        if obj.find('DisplayName') is not None: #if a name has been specified under the Info tab
-            if obj.find('DisplayName').text is not None: #Blank name, ignore it
-                foundnames.append(SafeString(object.find('DisplayName').text))
 
-        for block in obj.find('CubeBlocks'):
-            attrib = FindAttrib(block)
-            if attrib == "MyObjectBuilder_Beacon" or attrib == "MyObjectBuilder_RadioAntenna":
-                #If it hasn't been given a custom name, then it's either called "Antenna" or "Beacon"
-                if block.find('CustomName') is None:
-                    if attrib == "MyObjectBuilder_Beacon":
-                        foundnames.append("Beacon")
-                    if attrib == "MyObjectBuilder_RadioAntenna":
-                        foundnames.append("Antenna")
-                else: #If it has a custom name
-                    n = block.find('CustomName').text
-                    if n is None: #If it has a blank name, use the default block names
-                        if attrib == "MyObjectBuilder_Beacon":
-                            foundnames.append("Beacon")
-                        if attrib == "MyObjectBuilder_RadioAntenna":
-                            foundnames.append("Antenna")
-                    else:
-                        foundnames.append(SafeString(n))
-    #End block loop
+#The lxml parser for the saves, made once. huge_tree lets it read text nodes over 10 MB (big blueprints, scripts)
+#Comments & processing instructions are dropped, same as xml.etree does
+lxmlparser = None
+def LXMLParser():
+    global lxmlparser
+    if lxmlparser is None:
+        lxmlparser = lxmletree.XMLParser(huge_tree=True, remove_comments=True, remove_pis=True)
+    return lxmlparser
+
+
+#Function to load a whole save file with the XML backend, gives back a tree with getroot()
+def ParseXML(filepath):
+    if xmlbackend == "lxml":
+        return lxmletree.parse(filepath, LXMLParser())
+    return ET.parse(filepath)
+
+
+#Function to parse a bit of XML held in memory with the XML backend, gives back its root node
+def ParseXMLString(data):
+    if xmlbackend == "lxml":
+        return lxmletree.fromstring(data, LXMLParser())
+    return ET.fromstring(data)
+
+
+#Function to go through a save file a node at a time with the XML backend, see ET.iterparse
+#Both give "start-ns" events as (prefix, uri) with "" for the default namespace
+def IterParseXML(filepath, events):
+    if xmlbackend == "lxml":
+        return lxmletree.iterparse(filepath, events=events, huge_tree=True, remove_comments=True, remove_pis=True)
+    return ET.iterparse(filepath, events=events)
+
+
+#Function to possibly find a CubeGrid's name. Search for the name(s) of Antennae and Beacons
+#The names are picked up by SummariseCluster, pass its summary in if you've already got one
+def FindObjectName(objectcluster, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
 
     #Had unicode checking here, moved to SafeString function
 
-    return " / ".join(foundnames)
+    return " / ".join(summary.names)
 
 
 #Function to remove the Queue node from refineries
-def RemoveRefineryQueue(objectcluster):
-    for obj in objectcluster:
-        for cube in obj.find('CubeBlocks'):
-            if cube.find('Queue') is not None and FindAttrib(cube) == "MyObjectBuilder_Refinery": #if there's a Queue node and it's a refinery, remove it
-                logger.info("Removing refinery queue on entity: ", obj.find('EntityId').text)
-                cube.remove(cube.find('Queue'))
+def RemoveRefineryQueue(objectcluster, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
+
+    ApplyMutations(objectcluster, FindRefineryQueues(summary))
+
+
+#Function to list the refinery Queue nodes RemoveRefineryQueue would remove, as mutations for ApplyMutations
+def FindRefineryQueues(summary):
+    return [("refineryqueue", gridindex, blockindex) for gridindex, blockindex, cube in summary.refineryqueues] #Refineries that have a Queue node
 
 
 #Function to see if a node has an attrib, and then return it. Return empty string if not found
 def FindAttrib(objnode):
-    if len(objnode.attrib.values()) > 0:
-        return list(objnode.attrib.values())[0]
+    for value in objnode.attrib.values():
+        return value
 
     #Made it out to here, no attrib
     return ""
 
 
+#Everything the per-grid checks & modifications need to know about an object cluster, gathered in one pass over the blocks
+#Saves walking CubeBlocks again for every single check, which adds up fast on grids with tens of thousands of blocks
+class ClusterSummary:
+    __slots__ = ("hasjoint", "fueledreactors", "emptyreactors", "chargedbatteries", "deadbatteries", "enabledsolar", "attribs", "subtypes",
+                 "owners", "refineries", "assemblers", "refineryqueues", "spotlights", "beacons", "names", "couldbenpc", "blocksskipped")
+
+    def __init__(self):
+        self.hasjoint = False
+        self.fueledreactors = 0
+        self.emptyreactors = 0
+        self.chargedbatteries = 0
+        self.deadbatteries = 0
+        self.enabledsolar = 0
+        self.attribs = set() #Every block attribute in the cluster, or just the wanted ones with a RulePlan
+        self.subtypes = set() #Every block subtype in the cluster, or just the wanted ones with a RulePlan
+        self.owners = [] #In the order they were found
+        self.refineries = [] #(index of the entity in the cluster, index of the block in CubeBlocks, block)
+        self.assemblers = []
+        self.refineryqueues = []
+        self.spotlights = []
+        self.beacons = []
+        self.names = [] #Display names, beacon and antenna names, see FindObjectName
+        self.couldbenpc = True #See ClusterCouldBeNPC
+        self.blocksskipped = 0 #Blocks SummariseUntilSettled didn't need to read
+
+    #Whether anything in the cluster can power it, see DoIRemoveThisCluster
+    def HasPower(self, allowsolar=False):
+        return self.fueledreactors > 0 or self.chargedbatteries > 0 or (allowsolar and self.enabledsolar > 0)
+
+
+#Block attribs that mean it's joined to another grid
+jointattribs = frozenset(["MyObjectBuilder_MotorRotor", "MyObjectBuilder_MotorStator", "MyObjectBuilder_PistonBase", "MyObjectBuilder_PistonTop"])
+
+
+#What SummariseCluster does with each kind of block, looked up by its attrib in blockrules instead of going down a list of ifs
+#Each one fills in the summary and returns True if the block might settle what happens to the grid, see RulePlan.Settled
+def NoteJoint(summary, gridindex, blockindex, block):
+    summary.hasjoint = True
+    return True
+
+
+def NoteReactor(summary, gridindex, blockindex, block):
+    #Is it fueled? No matter what, if there's an item in a reactor, it's fueled. Possibility of fucking-up if SE starts allowing non-fuel into a reactor in future versions.
+    if len(block.find('Inventory').find('Items')) > 0:
+        summary.fueledreactors += 1 #Has power, even if it's disabled
+        return True
+    summary.emptyreactors += 1
+    return False
+
+
+def NoteBattery(summary, gridindex, blockindex, block):
+    if block.find('CurrentStoredPower').text != '0':
+        summary.chargedbatteries += 1 #Battery is juicing the juices, but may be disabled
+        return True
+    summary.deadbatteries += 1
+    return False
+
+
+def NoteSolarPanel(summary, gridindex, blockindex, block):
+    if block.find('Enabled').text == "true": #If by some miracle, they've managed to disable the panel
+        summary.enabledsolar += 1
+        return True
+    return False
+
+
+def NoteRefinery(summary, gridindex, blockindex, block):
+    summary.refineries.append((gridindex, blockindex, block))
+    if block.find('Queue') is not None:
+        summary.refineryqueues.append((gridindex, blockindex, block))
+    return False
+
+
+def NoteAssembler(summary, gridindex, blockindex, block):
+    summary.assemblers.append((gridindex, blockindex, block))
+    return False
+
+
+def NoteSpotlight(summary, gridindex, blockindex, block):
+    summary.spotlights.append((gridindex, blockindex, block))
+    return False
+
+
+#If it hasn't been given a custom name, then it's either called "Antenna" or "Beacon"
+def NoteBlockName(summary, block, defaultname):
+    n = block.find('CustomName')
+    if n is not None:
+        n = n.text
+    if n is None: #No name or a blank name, use the default block names
+        summary.names.append(defaultname)
+    else:
+        summary.names.append(SafeString(n))
+
+
+def NoteBeacon(summary, gridindex, blockindex, block):
+    summary.beacons.append((gridindex, blockindex, block))
+    NoteBlockName(summary, block, "Beacon")
+    return True
+
+
+def NoteAntenna(summary, gridindex, blockindex, block):
+    NoteBlockName(summary, block, "Antenna")
+    return False
+
+
+blockrules = dict((attrib, NoteJoint) for attrib in jointattribs)
+blockrules.update({"MyObjectBuilder_Reactor": NoteReactor,
+                   "MyObjectBuilder_BatteryBlock": NoteBattery,
+                   "MyObjectBuilder_SolarPanel": NoteSolarPanel,
+                   "MyObjectBuilder_Refinery": NoteRefinery,
+                   "MyObjectBuilder_Assembler": NoteAssembler,
+                   "MyObjectBuilder_ReflectorLight": NoteSpotlight,
+                   "MyObjectBuilder_Beacon": NoteBeacon,
+                   "MyObjectBuilder_RadioAntenna": NoteAntenna})
+
+
+#The cleanup options compiled into just what SummariseCluster & DecideSectorObject need to do for them, see GetRulePlan
+#Only the block rules the options need are kept, the wanted attribs & subtypes are frozensets and if nothing needs the
+#   whole grid (owners, factories, names for the log...) SummariseCluster stops as soon as the grid's fate is settled
+#With no args it fills out everything and never stops early, for summaries made outside of a run
+class RulePlan:
+    def __init__(self, args=None):
+        self.args = args
+        self.everything = args is None
+        if self.everything:
+            self.musthavepower = self.allowsolar = self.removenpcs = self.ignorejoint = False
+            self.findattribs = self.findsubtypes = frozenset()
+            self.factorymode = ""
+            self.removequeues = self.disablespotlights = self.stopmovement = False
+            self.collectowners = self.collectnames = True
+        else:
+            self.musthavepower = args.cleanup_unpowered
+            self.allowsolar = args.cleanup_include_solar
+            self.findattribs = frozenset(args.cleanup_missing_attrib)
+            self.findsubtypes = frozenset(args.cleanup_missing_subtype)
+            self.removenpcs = args.remove_npc_ships
+            self.ignorejoint = args.ignore_joint
+            self.factorymode = args.disable_factories[0] if len(args.disable_factories) > 0 else ""
+            self.removequeues = args.remove_refinery_queue
+            self.disablespotlights = args.disable_spotlights
+            self.stopmovement = args.stop_movement
+            self.collectowners = args.prune_players #Only player pruning looks at who owns what
+            self.collectnames = not args.quiet #Names only ever end up in the log
+        self.checkremoval = self.musthavepower or len(self.findattribs) > 0 or len(self.findsubtypes) > 0
+
+        #Joints are always needed, they decide whether a grid is checked at all
+        self.blockrules = dict((attrib, NoteJoint) for attrib in jointattribs)
+        if self.everything or self.musthavepower:
+            self.blockrules["MyObjectBuilder_Reactor"] = NoteReactor
+            self.blockrules["MyObjectBuilder_BatteryBlock"] = NoteBattery
+        if self.everything or (self.musthavepower and self.allowsolar):
+            self.blockrules["MyObjectBuilder_SolarPanel"] = NoteSolarPanel
+        if self.everything or self.factorymode != "" or self.removequeues:
+            self.blockrules["MyObjectBuilder_Refinery"] = NoteRefinery
+        if self.everything or self.factorymode != "":
+            self.blockrules["MyObjectBuilder_Assembler"] = NoteAssembler
+        if self.everything or self.disablespotlights:
+            self.blockrules["MyObjectBuilder_ReflectorLight"] = NoteSpotlight
+        if self.everything or self.removenpcs or self.collectnames:
+            self.blockrules["MyObjectBuilder_Beacon"] = NoteBeacon
+        if self.everything or self.collectnames:
+            self.blockrules["MyObjectBuilder_RadioAntenna"] = NoteAntenna
+
+        #Can only stop early if nothing needs to see every block
+        self.canstop = not (self.everything or self.collectowners or self.collectnames or self.factorymode != "" or self.removequeues or self.disablespotlights)
+
+    #Whether what's in summary so far settles what DecideSectorObject will do with the cluster, whatever's in the rest of it
+    def Settled(self, objectcluster, summary, jointsmapped=False):
+        if not (self.ignorejoint or jointsmapped):
+            return summary.hasjoint #Left alone if it's got a joint, but one further on would change everything
+
+        if self.removenpcs and summary.couldbenpc:
+            if len(summary.beacons) == 0:
+                return False #Its first beacon decides if it's an NPC, see IsClusterAnNPC
+            if IsClusterAnNPC(objectcluster, summary):
+                return True #Removed
+
+        #Kept, see DoIRemoveThisCluster
+        return (not self.musthavepower or summary.HasPower(self.allowsolar)) \
+            and (len(self.findattribs) == 0 and len(self.findsubtypes) == 0 or len(summary.attribs) > 0 or len(summary.subtypes) > 0)
+
+
+    #A hash of everything in the plan that changes what gets decided, see DecisionCache
+    def Fingerprint(self):
+        settings = [decisioncacheversion, self.musthavepower, self.allowsolar, sorted(self.findattribs), sorted(self.findsubtypes), self.removenpcs,
+                    self.ignorejoint, self.factorymode, self.removequeues, self.disablespotlights, self.stopmovement, self.collectowners, self.collectnames]
+        return hashlib.sha1(json.dumps(settings).encode('utf-8')).hexdigest()
+
+
+#The RulePlan for the options in args, only compiled again when it's given a different args
+ruleplan = None
+def GetRulePlan(args):
+    global ruleplan
+    if ruleplan is None or ruleplan.args is not args:
+        ruleplan = RulePlan(args)
+    return ruleplan
+
+
+#Function to walk the blocks of an object cluster once and fill out a ClusterSummary
+#With a RulePlan only what it needs is filled out, the attribs & subtypes are just the wanted ones, and if the plan can
+#   stop early it's left to SummariseUntilSettled. jointsmapped is the same as for DecideSectorObject
+def SummariseCluster(objectcluster, plan=None, jointsmapped=False):
+    if plan is None:
+        plan = RulePlan()
+    summary = ClusterSummary()
+    if plan.canstop:
+        SummariseUntilSettled(objectcluster, plan, jointsmapped, summary)
+        return summary
+
+    owners = set()
+
+    #Pulled out of the plan once, they're needed for every block
+    rules = plan.blockrules
+    everything = plan.everything
+    findattribs = plan.findattribs
+    findsubtypes = plan.findsubtypes
+    checksubtypes = everything or len(findsubtypes) > 0
+    collectowners = plan.collectowners
+
+    for gridindex, obj in enumerate(objectcluster):
+        if plan.collectnames and obj.find('DisplayName') is not None: #if a name has been specified under the Info tab
+            if obj.find('DisplayName').text is not None: #Blank name, ignore it
+                summary.names.append(SafeString(obj.find('DisplayName').text))
+
+        for blockindex, block in enumerate(obj.find('CubeBlocks')):
+            attrib = FindAttrib(block)
+            if everything or attrib in findattribs:
+                summary.attribs.add(attrib)
+
+            if checksubtypes:
+                subtype = block.find('SubtypeName')
+                if subtype is not None and (everything or subtype.text in findsubtypes):
+                    summary.subtypes.add(subtype.text)
+
+            if collectowners:
+                owner = block.find('Owner')
+                if owner is not None and owner.text not in owners: #If this owner isn't currently recorded
+                    owners.add(owner.text)
+                    summary.owners.append(owner.text)
+
+            rule = rules.get(attrib)
+            if rule is not None:
+                rule(summary, gridindex, blockindex, block)
+        #End block loop
+
+    return summary
+
+
+#Function to fill out summary for a plan that can stop early (see RulePlan.canstop), stopping at the first block that
+#   settles the cluster. Blocks are gone through by their attrib alone first, as that's all the blocks that usually
+#   settle it (joints, reactors, batteries, beacons & wanted attribs) need. Subtypes are only read if that didn't do it
+#Sets summary.blocksskipped to how many blocks were left unread. The subtype pass only happens after every block's
+#   attrib has been read, so nothing it stops short of counts as skipped
+def SummariseUntilSettled(objectcluster, plan, jointsmapped, summary):
+    cubeblocks = [obj.find('CubeBlocks') for obj in objectcluster]
+    total = sum(len(blocks) for blocks in cubeblocks)
+
+    if plan.removenpcs:
+        summary.couldbenpc = ClusterCouldBeNPC(objectcluster)
+    if plan.Settled(objectcluster, summary, jointsmapped): #The options don't need any of the blocks
+        summary.blocksskipped = total
+        return
+
+    rules = plan.blockrules
+    findattribs = plan.findattribs
+    seen = 0
+    for gridindex, blocks in enumerate(cubeblocks):
+        for blockindex, block in enumerate(blocks):
+            seen += 1
+            attrib = FindAttrib(block)
+            decisive = False
+            if attrib in findattribs:
+                summary.attribs.add(attrib)
+                decisive = True
+
+            rule = rules.get(attrib)
+            if rule is not None and rule(summary, gridindex, blockindex, block):
+                decisive = True
+
+            if decisive and plan.Settled(objectcluster, summary, jointsmapped):
+                summary.blocksskipped = total - seen
+                return
+
+    if len(plan.findsubtypes) == 0:
+        return
+
+    findsubtypes = plan.findsubtypes
+    for blocks in cubeblocks:
+        for block in blocks:
+            subtype = block.find('SubtypeName')
+            if subtype is not None and subtype.text in findsubtypes:
+                summary.subtypes.add(subtype.text)
+                if plan.Settled(objectcluster, summary, jointsmapped):
+                    return
+
+
 #Function to fetch what faction a playerID belongs to
 def FindPlayerFaction(factiontree, playerID):
     for faction in factiontree:
@@ -199,20 +638,6 @@ def FindPlayerFaction(factiontree, playerID):
     return None
 
 
-#Function to return the XMl node for a specific node with a matching ID
-#Mainly used for finding entities in SectorObjects
-def FindByID(rootnode, idfieldname, idtosearchfor):
-    for node in rootnode:
-        if node.find(idfieldname) is None: #Field not found in this node
-            continue #Move on to the next node
-
-        if node.find(idfieldname).text == idtosearchfor:
-            return node
-
-    #If it made it out of the loop, didn't find entity
-    return None
-
-
 #Function to get the name of a floating object
 def GetFloatingItemName(objnode):
     #try:
@@ -221,115 +646,206 @@ def GetFloatingItemName(objnode):
         return ""
 
 
-#Function to map out the entities all joined by rotors, known as a cluster
-#attrib:MyObjectBuilder_MotorRotor connects to attrib:MyObjectBuilder_MotorStator, stator's having the numbers on them
-#BROKEN - FIX IT LATER
-def MapObjectCluster(sectorobjectsnode, objnode):
-    entitymap = [objnode] #Final table of entity ID's that will be returned
-    entityqueue = [objnode] #Queue list of entites to be processed
-
-    #Add the initial entity
-    entitymap.append(objnode)
-
-    #Begin the loop!
-
-    while len(entityqueue) > 0: #While the queue isn't empty
-        ent = entityqueue.pop()
-
-        if ent in entitymap: #If there comes a time where multiple rotors can join 2 objects together, I've got it covered
+#Grid sizes in metres, by GridSizeEnum
+gridsizes = {"Large": 2.5, "Small": 0.5}
+
+#How far apart the two halves of a joint can be and still be counted as joined, in metres
+#Rotor heads sit right on top of the stator, pistons can be extended up to 10m plus the length of the base
+rotorjoinrange = 6.0
+pistonjoinrange = 20.0
+
+
+#Function to work out where a grid is and which way it's facing
+#Returns the position and the world directions of the grid's X, Y & Z axes
+def GridTransform(obj):
+    posandorient = obj.find('PositionAndOrientation')
+    pos = PositionTuple(posandorient.find('Position'))
+
+    if posandorient.find('Forward') is not None and posandorient.find('Up') is not None:
+        fwd = PositionTuple(posandorient.find('Forward'))
+        up = PositionTuple(posandorient.find('Up'))
+        #Right = Forward x Up, and grid Z points backwards
+        right = (fwd[1] * up[2] - fwd[2] * up[1], fwd[2] * up[0] - fwd[0] * up[2], fwd[0] * up[1] - fwd[1] * up[0])
+        back = (-fwd[0], -fwd[1], -fwd[2])
+    elif posandorient.find('Orientation') is not None: #Newer saves store a quaternion instead
+        orient = posandorient.find('Orientation')
+        x, y, z, w = [float(orient.find(axis).text) for axis in ('X', 'Y', 'Z', 'W')]
+        right = (1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w))
+        up = (2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w))
+        back = (2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y))
+    else: #No idea, assume it's lined up with the world
+        right, up, back = (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)
+
+    return pos, right, up, back
+
+
+#Function to get the world position of a block, from its grid's transform and the block's Min offset
+def BlockWorldPosition(transform, gridsize, block):
+    pos, right, up, back = transform
+    blockmin = block.find('Min')
+    if blockmin is None:
+        return pos
+    lx, ly, lz = [float(blockmin.attrib.get(axis, 0)) * gridsize for axis in ('x', 'y', 'z')]
+    return (pos[0] + lx * right[0] + ly * up[0] + lz * back[0],
+            pos[1] + lx * right[1] + ly * up[1] + lz * back[1],
+            pos[2] + lx * right[2] + ly * up[2] + lz * back[2])
+
+
+#Function to map out the entities all joined by rotors & pistons, known as clusters
+#Rotors are joined by proximity when the server starts, not by an ID, so the same is done here. Every rotor head & piston
+#   top goes into a SpatialHash by world position, then each stator & piston base is paired with the closest free one
+#   in range on another grid. Newer saves have the ID of the other half on the stator / base, that's used when it's there
+#Returns a dict of CubeGrid node -> (cluster, complete) for every grid that has a joint, cluster being the list of
+#   grid nodes joined together and complete being False if any joint in it couldn't be paired up
+def MapObjectClusters(sectorobjectsnode):
+    topsbyid = {} #Block EntityId -> rotor / piston top block, for the ID lookups
+    bases = [] #(grid, block, world position, range, id of the other half)
+    tops = SpatialHash(pistonjoinrange)
+    topgrids = {} #id() of top block -> its grid
+    toplist = []
+    jointgrids = []
+
+    for obj in sectorobjectsnode:
+        if FindAttrib(obj) != "MyObjectBuilder_CubeGrid":
             continue
 
-        entitymap.append(ent.find('EntityId').text)
-        cubes = ent.find('CubeBlocks')
-        for cube in cubes:
-            if cube.find('SubtypeName') == "LargeRotor" or cube.find('SubtypeName') == "SmallRotor":
-                entityqueue.append(FindByID(sectorobjectsnode, "EntityId", cube.find('EntityId').text)) #Add that entity to the list
-                entitymap.append(FindByID(sectorobjectsnode, "EntityId", cube.find('EntityId').text))
+        transform = None
+        for block in obj.find('CubeBlocks'):
+            attrib = FindAttrib(block)
+            if attrib not in jointattribs:
+                continue
+
+            if transform is None: #Only bother with the maths for grids that have joints
+                transform = GridTransform(obj)
+                gridsize = gridsizes.get(obj.findtext('GridSizeEnum'), gridsizes["Large"])
+                jointgrids.append(obj)
+
+            blockpos = BlockWorldPosition(transform, gridsize, block)
+            if attrib == "MyObjectBuilder_MotorStator":
+                bases.append((obj, block, blockpos, rotorjoinrange, block.findtext('RotorEntityId')))
+            elif attrib == "MyObjectBuilder_PistonBase":
+                bases.append((obj, block, blockpos, pistonjoinrange, block.findtext('TopBlockId')))
+            else: #MotorRotor or PistonTop
+                tops.Insert(blockpos, block)
+                topgrids[id(block)] = obj
+                toplist.append(block)
+                if block.findtext('EntityId') is not None:
+                    topsbyid[block.findtext('EntityId')] = block
+
+    #Work out every possible pairing, closest first
+    candidates = []
+    for baseindex, (obj, block, blockpos, joinrange, otherid) in enumerate(bases):
+        if otherid is not None and otherid in topsbyid: #The save says exactly what it's joined to
+            candidates.append((-1.0, baseindex, topsbyid[otherid]))
+            continue
 
-    return entitymap
+        istator = FindAttrib(block) == "MyObjectBuilder_MotorStator"
+        for toppos, top in tops.Query(blockpos, joinrange, True):
+            if topgrids[id(top)] is obj: #Can't join to itself
+                continue
+            if (FindAttrib(top) == "MyObjectBuilder_MotorRotor") != istator: #Rotors go on stators, tops go on pistons
+                continue
+            dist = sum((toppos[axis] - blockpos[axis]) ** 2 for axis in range(3))
+            candidates.append((dist, baseindex, top))
+    candidates.sort(key=lambda c: (c[0], c[1]))
+
+    #Union-find over the grids
+    parent = {}
+    def Root(obj):
+        while parent.get(obj, obj) is not obj:
+            obj = parent[obj]
+        return obj
+
+    pairedbases = set()
+    pairedtops = set()
+    for dist, baseindex, top in candidates:
+        if baseindex in pairedbases or id(top) in pairedtops:
+            continue
+        pairedbases.add(baseindex)
+        pairedtops.add(id(top))
+        a = Root(bases[baseindex][0])
+        b = Root(topgrids[id(top)])
+        if a is not b:
+            parent[b] = a
+
+    #Gather up the clusters, and mark the ones with a joint that didn't pair
+    clusters = {}
+    for obj in jointgrids:
+        clusters.setdefault(Root(obj), []).append(obj)
+
+    complete = dict((root, True) for root in clusters)
+    for baseindex, base in enumerate(bases):
+        if baseindex not in pairedbases:
+            complete[Root(base[0])] = False
+    for top in toplist:
+        if id(top) not in pairedtops:
+            complete[Root(topgrids[id(top)])] = False
+
+    clustermap = {}
+    for root, cluster in clusters.items():
+        for obj in cluster:
+            clustermap[obj] = (cluster, complete[root])
+
+    return clustermap
 
 
 #Function to find out of an entity has a rotor, stator, pistontop or pistonbase
-def HasJoint(objectcluster):
-    for obj in objectcluster:
-        for block in obj.find('CubeBlocks'):
-            attrib = FindAttrib(block)
-            if attrib == "MyObjectBuilder_MotorRotor" or attrib == "MyObjectBuilder_MotorStator" or attrib == "MyObjectBuilder_PistonBase" or attrib == "MyObjectBuilder_PistonTop":
-                return True #Entity has a joint
+def HasJoint(objectcluster, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
 
-            """
-            if len(block.attrib.values()) > 0: #If it has an attribute
-                if block.attrib.values()[0] == "MyObjectBuilder_MotorRotor" or block.attrib.values()[0] == "MyObjectBuilder_MotorStator" or block.attrib.values()[0] == "MyObjectBuilder_PistonBase" or block.attrib.values()[0] == "MyObjectBuilder_PistonTop":
-                    return True #Entity has a joint
-            """
-
-    #Made it out here, musn't have a joint
-    return False
+    return summary.hasjoint
 
 
 #Function to remove all inertia
 def KillClusterInertia(objectcluster):
-    for obj in objectcluster:
-        obj.find('LinearVelocity').attrib["x"] = "0"
-        obj.find('LinearVelocity').attrib["z"] = "0"
-        obj.find('LinearVelocity').attrib["y"] = "0"
-
-        obj.find('AngularVelocity').attrib["x"] = "0"
-        obj.find('AngularVelocity').attrib["y"] = "0"
-        obj.find('AngularVelocity').attrib["z"] = "0"
+    ApplyMutations(objectcluster, [("stop", gridindex, -1) for gridindex in range(len(objectcluster))])
 #End KillClsterIntertia
 
 
 #Function to decide whether to remove an object cluster
-def DoIRemoveThisCluster(objectcluster, findattribs, findsubtypes, musthavepower=False, allowsolar=False):
+def DoIRemoveThisCluster(objectcluster, findattribs, findsubtypes, musthavepower=False, allowsolar=False, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
+
     #Define checks
     haspower = False
-    attribmatch = False
-    subtypematch = False
     neededblock = False
 
-    #Begin checking through object blocks
-    for obj in objectcluster:
-        logger.info("Checking entity:", obj.find("EntityId").text, " ", FindObjectName(objectcluster))
-        for block in obj.find('CubeBlocks'):
-            attrib = FindAttrib(block)
-            logger.debug("'" + attrib + "'")
-            subtype = block.find('SubtypeName').text
-
-            #Power checks
-            if attrib == "MyObjectBuilder_Reactor" and musthavepower: #If it's a reactor
-                #Is it fueled? No matter what, if there's an item in a reactor, it's fueled. Possibility of fucking-up if SE starts allowing non-fuel into a reactor in future versions.
-                if len(block.find('Inventory').find('Items')) > 0:
-                    logger.info("- Found fueled reactor")
-                    haspower = True #Has power, even if it's disabled
-                else:
-                    logger.info("- Found empty reactor")
-            #End reactor check
-
-            if attrib == "MyObjectBuilder_BatteryBlock" and musthavepower: #If it's a battery
-                if block.find('CurrentStoredPower').text != '0':
-                    logger.info("- Found charged battery")
-                    haspower = True #Battery is juicing the juices, but may be disabled
-                else:
-                    logger.info("- Found dead battery")
-            #End Battery check
-
-            if attrib == "MyObjectBuilder_SolarPanel" and allowsolar and musthavepower: #If it's a battery and we're checking for power AND its been specified that we should include solar panels
-                if block.find('Enabled').text == "true": #If by some miracle, they've managed to disable the panel
-                    logger.info("- Found solar panel, including in power check")
-                    haspower = True #Include it in the power check. I remind you that THIS IS NOT COUNTED BY DEFAULT.
-
-            #Attrib & subtype checks
-            if (subtype in findsubtypes):
-                logger.info("- Found wanted subtype: " + subtype)
-                neededblock = True #It has a block that we're after
-
-            if (attrib in findattribs):
-                logger.info("- Found wanted attribute: " + attrib)
-                neededblock = True
-
-        #End of block loop
-    #End of cluster loop
+    if detaillogger.isEnabledFor(logging.INFO): #Don't bother finding the name if it's not going anywhere
+        detaillogger.info("Checking entity: %s %s", objectcluster[0].find("EntityId").text, FindObjectName(objectcluster, summary))
+    else: #Nothing to log, so stop at the first check that decides it
+        if musthavepower and not summary.HasPower(allowsolar):
+            return True #Blast it
+        return not (len(findattribs) == 0 and len(findsubtypes) == 0 or not summary.subtypes.isdisjoint(findsubtypes) or not summary.attribs.isdisjoint(findattribs))
+
+    #Power checks
+    if musthavepower:
+        #Is it fueled? Has power, even if it's disabled
+        if summary.fueledreactors > 0:
+            detaillogger.info("- Found fueled reactor")
+            haspower = True
+        elif summary.emptyreactors > 0:
+            detaillogger.info("- Found empty reactor")
+
+        if summary.chargedbatteries > 0:
+            detaillogger.info("- Found charged battery")
+            haspower = True #Battery is juicing the juices, but may be disabled
+        elif summary.deadbatteries > 0:
+            detaillogger.info("- Found dead battery")
+
+        if summary.enabledsolar > 0 and allowsolar: #If it's been specified that we should include solar panels
+            detaillogger.info("- Found solar panel, including in power check")
+            haspower = True #Include it in the power check. I remind you that THIS IS NOT COUNTED BY DEFAULT.
+
+    #Attrib & subtype checks
+    for subtype in summary.subtypes.intersection(findsubtypes):
+        detaillogger.info("- Found wanted subtype: %s", subtype)
+        neededblock = True #It has a block that we're after
+
+    for attrib in summary.attribs.intersection(findattribs):
+        detaillogger.info("- Found wanted attribute: %s", attrib)
+        neededblock = True
 
     logger.debug("-DoIRemoveThisCluster-")
     logger.debug(haspower or not musthavepower)
@@ -342,38 +858,39 @@ def DoIRemoveThisCluster(objectcluster, findattribs, findsubtypes, musthavepower
 
 
 #Function to loop through an object cluster and disable factories, hard or soft
-def DisableFactories(objectcluster, mode):
+def DisableFactories(objectcluster, mode, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
+
+    ApplyMutations(objectcluster, FindFactoriesToDisable(summary, mode))
+
+
+#Function to work out which factories DisableFactories would turn off, as mutations for ApplyMutations
+def FindFactoriesToDisable(summary, mode):
+    mutations = []
+
     logger.debug("Checking for factories")
-    logger.debug(objectcluster)
     logger.debug(mode)
-    for obj in objectcluster:
-        for block in obj.find('CubeBlocks'):
-            attrib = FindAttrib(block)
-            if attrib == "MyObjectBuilder_Refinery": #Is a refinery
-                logger.debug("Found Refinery")
-                if (mode == 'soft' and len(block.find('InputInventory').find('Items')) == 0) or mode == 'hard': #If the mode is 'soft' and there's nothing inside to be refined; or it's 'hard' mode to turn it off regardless
-                    block.find('Enabled').text = "false" #Turn it off
-                    logger.info("Turning off refinery on entity: ", obj.find('EntityId').text)
+    for gridindex, blockindex, block in summary.refineries: #Is a refinery
+        logger.debug("Found Refinery")
+        if (mode == 'soft' and len(block.find('InputInventory').find('Items')) == 0) or mode == 'hard': #If the mode is 'soft' and there's nothing inside to be refined; or it's 'hard' mode to turn it off regardless
+            mutations.append(("refinery", gridindex, blockindex))
 
-            if attrib == "MyObjectBuilder_Assembler": #Is an assembler
-                logger.debug("Found Assembler")
-                #Well aint that some shit, SE removes the 'Queue' node if there's nothing in the queue instead of leaving an empty node...
-                if (mode == 'soft' and block.find('Queue') is None) or mode == 'hard': #If the mode is 'soft' and there's nothing in the queue; or it's 'hard' mode to turn it off regardless
-                    block.find('Enabled').text = "false" #Turn it off
-                    logger.info("Turning off assembler on entity: " + obj.find('EntityId').text)
+    for gridindex, blockindex, block in summary.assemblers: #Is an assembler
+        logger.debug("Found Assembler")
+        #Well aint that some shit, SE removes the 'Queue' node if there's nothing in the queue instead of leaving an empty node...
+        if (mode == 'soft' and block.find('Queue') is None) or mode == 'hard': #If the mode is 'soft' and there's nothing in the queue; or it's 'hard' mode to turn it off regardless
+            mutations.append(("assembler", gridindex, blockindex))
 
+    return mutations
 
-#Function to get a list of players that own at least a part of this object cluster
-def GetClusterOwners(objectcluster):
-    shareholders = []
 
-    for obj in objectcluster:
-        for cube in obj.find('CubeBlocks'):
-            if cube.find('Owner') is not None: #If there is an Owner tag on this block
-                if not cube.find('Owner').text in shareholders: #If this owner isn't currently recorded
-                    shareholders.append(cube.find('Owner').text) #Add it to the list
+#Function to get a list of players that own at least a part of this object cluster
+def GetClusterOwners(objectcluster, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
 
-    return shareholders
+    return summary.owners
 
 
 #Function to get members of a faction
@@ -386,522 +903,3091 @@ def GetFactionMembers(factionNode):
     return members
 
 
-#Function to determine if the cluster is an NPC ship or not
-def IsClusterAnNPC(objectcluster):
-    namestofind = ["Private Sail", "Business Shipment", "Commercial Freighter", "Mining Carriage", "Mining Transport", "Mining Hauler", "Military Escort", "Military Minelayer", "Military Transporter"]
+#Function to cut the children of node down to keep, some of them in the same order
+#Each child's tail is the whitespace before the next one, or before node's closing tag for the last. So if the last one
+#   goes, its tail goes onto the last one kept (or node's text if none are), and the closing tag stays where it was
+def KeepChildren(node, keep):
+    if len(keep) == len(node):
+        return
+    last = node[-1]
+    if len(keep) == 0:
+        node.text = last.tail
+    elif keep[-1] is not last:
+        keep[-1].tail = last.tail
+    node[:] = keep
+
+
+#Index over the players & factions in the small save (Sandbox.sbc)
+#Built once up front so the player & faction checks are all hash lookups, instead of rescanning every faction for every player
+#Anything that removes players or factions should go through here so the XML and the lookups stay in step
+class PlayerFactionIndex:
+    def __init__(self, smallsaveroot):
+        self.root = smallsaveroot
+        self.factionsnode = smallsaveroot.find('Factions')
+        self.playerlist = smallsaveroot.find('AllPlayers')
+
+        self.players = {} #PlayerId -> AllPlayers node
+        self.factions = {} #FactionId -> faction node
+        self.factionmembers = {} #FactionId -> list of member PlayerIds
+        self.playerfaction = {} #PlayerId -> faction node
+        self.relations = {} #FactionId -> list of relation nodes it's on either side of
+
+        if self.playerlist is not None:
+            for player in self.playerlist:
+                self.players[player.find('PlayerId').text] = player
+
+        if self.factionsnode is None:
+            return
+
+        for faction in self.factionsnode.find('Factions'):
+            factionId = faction.find('FactionId').text
+            self.factions[factionId] = faction
+            self.factionmembers[factionId] = []
+            for member in faction.find('Members'):
+                playerID = member.find('PlayerId').text
+                self.factionmembers[factionId].append(playerID)
+                if playerID not in self.playerfaction: #Same as the old scan, first faction found wins
+                    self.playerfaction[playerID] = faction
+
+        factionrelations = self.factionsnode.find('Relations')
+        if factionrelations is not None:
+            for factionrelation in factionrelations:
+                for idfield in ('FactionId1', 'FactionId2'):
+                    self.relations.setdefault(factionrelation.find(idfield).text, []).append(factionrelation)
+
+    #Function to fetch what faction node a playerID belongs to, None if they're not in one
+    def FindPlayerFaction(self, playerID):
+        return self.playerfaction.get(playerID)
+
+    #Function to get the PlayerIds of a faction's members
+    def GetFactionMembers(self, factionId):
+        return self.factionmembers.get(factionId, [])
+
+    #Function to remove a set of players from AllPlayers, Players, faction members & join requests and the faction player table
+    def RemovePlayers(self, playerIDtoremove):
+        #AllPlayers section
+        if self.playerlist is not None:
+            for player in self.playerlist:
+                if player.find('PlayerId').text in playerIDtoremove:
+                    detaillogger.info("Removing %s from All Players list", player.find('PlayerId').text)
+                    tally["Players removed"] += 1
+            KeepChildren(self.playerlist, [player for player in self.playerlist if player.find('PlayerId').text not in playerIDtoremove])
+
+        for playerID in playerIDtoremove:
+            self.players.pop(playerID, None)
+
+        #Players section. Yes, there's a second one
+        if self.root.find('Players') is not None and len(self.root.find('Players')) > 0:
+            pllist = self.root.find('Players')[0]
+            keep = []
+            for player in pllist:
+                if player.find('Value').find('PlayerId').text in playerIDtoremove:
+                    detaillogger.info("Removing %s from Players list", player.find('Value').find('PlayerId').text)
+                else:
+                    keep.append(player)
+            KeepChildren(pllist, keep)
+
+        if self.factionsnode is None:
+            return
+
+        #Factions
+        #Loop through members of each faction.
+        for factionId, faction in self.factions.items():
+            memberlist = faction.find('Members')
+            joinrequests = faction.find('JoinRequests')
+
+            #Cleanup Members
+            keep = []
+            for member in memberlist:
+                if member.find('PlayerId').text in playerIDtoremove:
+                    detaillogger.info("Removing %s from faction %s %s", member.find('PlayerId').text, factionId, faction.find('Name').text)
+                else:
+                    keep.append(member)
+            if len(keep) != len(memberlist):
+                KeepChildren(memberlist, keep)
+                self.factionmembers[factionId] = [playerID for playerID in self.factionmembers[factionId] if playerID not in playerIDtoremove]
+
+            #Cleanup Join Requests
+            if joinrequests is not None:
+                keep = []
+                for joinrequest in joinrequests:
+                    if joinrequest.find('PlayerId').text in playerIDtoremove:
+                        detaillogger.info("Removing %s from faction request list %s %s", joinrequest.find('PlayerId').text, factionId, faction.find('Name').text)
+                    else:
+                        keep.append(joinrequest)
+                KeepChildren(joinrequests, keep)
+
+        for playerID in playerIDtoremove:
+            self.playerfaction.pop(playerID, None)
+
+        #Factions Players, yep another second one
+        if self.factionsnode.find('Players') is not None and len(self.factionsnode.find('Players')) > 0:
+            factionplayers = self.factionsnode.find('Players')[0]
+            keep = []
+            for factionplayer in factionplayers:
+                if factionplayer.find('Key').text in playerIDtoremove:
+                    detaillogger.info("Removing %s from faction player list", factionplayer.find('Key').text)
+                else:
+                    keep.append(factionplayer)
+            KeepChildren(factionplayers, keep)
+
+    #Function to remove a set of factions from the faction list, the Relations table and the Requests table
+    def RemoveFactions(self, factionIDtoremove):
+        factionlist = self.factionsnode.find('Factions')
+        KeepChildren(factionlist, [faction for faction in factionlist if faction.find('FactionId').text not in factionIDtoremove])
+
+        #Skip the FactionPlayer table. Will only remove factions that have no players, so it should never even be present in the FactionPlayers list
+
+        #Remove from Relations table, only need to look at the ones the removed factions are on
+        deadrelations = set()
+        for factionId in factionIDtoremove:
+            for factionrelation in self.relations.get(factionId, []):
+                deadrelations.add(factionrelation)
+
+        if len(deadrelations) > 0:
+            factionrelations = self.factionsnode.find('Relations')
+            KeepChildren(factionrelations, [factionrelation for factionrelation in factionrelations if factionrelation not in deadrelations])
+            for factionId in list(self.relations):
+                self.relations[factionId] = [factionrelation for factionrelation in self.relations[factionId] if factionrelation not in deadrelations]
+
+        #Clean from FactionRequests
+        #2 kinds, either an entire entry for the faction or another entry referring to the faction
+        factionrequests = self.factionsnode.find('Requests')
+        if factionrequests is not None:
+            keep = []
+            for factionrequest in factionrequests:
+                #First, is this entry about a faction to be removed
+                if factionrequest.find('FactionId').text in factionIDtoremove:
+                    continue #Go to the next entry, don't bother about the individual requests
+
+                #Second, loop through the requests that've been sent by this faction
+                factionsubrequests = factionrequest.find('FactionRequests')
+                if factionsubrequests is not None:
+                    KeepChildren(factionsubrequests, [factionsubrequest for factionsubrequest in factionsubrequests if factionsubrequest.text not in factionIDtoremove])
+                keep.append(factionrequest)
+            KeepChildren(factionrequests, keep)
+
+        for factionId in factionIDtoremove:
+            self.factions.pop(factionId, None)
+            self.factionmembers.pop(factionId, None)
+            self.relations.pop(factionId, None)
+
+
+#Beacon names NPC ships spawn with
+npcnames = frozenset(["Private Sail", "Business Shipment", "Commercial Freighter", "Mining Carriage", "Mining Transport", "Mining Hauler", "Military Escort", "Military Minelayer", "Military Transporter"])
+
+
+#Function to see if an object cluster could be an NPC at all without looking at its blocks; not a station, and at
+#   least one of its grids is adrift with its dampeners off
+def ClusterCouldBeNPC(objectcluster):
+    for obj in objectcluster:
+        if obj.findtext('IsStatic') == 'true':
+            return False
+
+    for obj in objectcluster:
+        if obj.findtext('DampenersEnabled') == 'false':
+            return True
+    return False
+
 
+#Function to determine if the cluster is an NPC ship or not
+def IsClusterAnNPC(objectcluster, summary=None):
     for obj in objectcluster:
         if obj.find('IsStatic') is not None:
             if obj.find('IsStatic').text == 'true': #Is a station, ignore it
                 return False
 
-        for block in obj.find('CubeBlocks'):
-            attrib = FindAttrib(block)
-            if attrib == "MyObjectBuilder_Beacon": #Stop on first beacon, NPC ships only every have one beacon
-                if block.find('CustomName') is not None: #If the beacon doesn't have a custom name
-                    if block.find('CustomName').text is not None: #If it has a blank custom name, blank custom names have a node, but it doens't have a text value
-                        if (block.find('CustomName').text in namestofind) and obj.find('DampenersEnabled') is not None: #If the beacon name matches one in the list and InertialDampners are off (it's adrift, no one's taken it)
-                            if obj.find('DampenersEnabled').text == 'false':
-                                return True #Sounds like an NPC
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
+
+    for gridindex, blockindex, block in summary.beacons[:1]: #Stop on first beacon, NPC ships only every have one beacon
+        obj = objectcluster[gridindex]
+        if block.find('CustomName') is not None: #If the beacon doesn't have a custom name
+            if block.find('CustomName').text is not None: #If it has a blank custom name, blank custom names have a node, but it doens't have a text value
+                if (block.find('CustomName').text in npcnames) and obj.find('DampenersEnabled') is not None: #If the beacon name matches one in the list and InertialDampners are off (it's adrift, no one's taken it)
+                    if obj.find('DampenersEnabled').text == 'false':
+                        return True #Sounds like an NPC
 
     #Made it out here, musn't be an NPC
     return False
 
 
-#Function to decide if it's safe to respawn an asteroid, based on the proximity of players and cubegrids
-def CanRespawnAsteroid(avoidcoordslist, entpos, saferange):
+#Uniform grid hash over world positions, so "is anything close to this point" only has to look at the nearby cells
+#   instead of every CubeGrid and player in the sector
+#Positions are (x, y, z) float tuples, cellsize should be about the biggest range you'll be asking about
+class SpatialHash:
+    def __init__(self, cellsize):
+        self.cellsize = float(cellsize)
+        self.cells = {}
+
+    def Insert(self, pos, item=None):
+        cell = (int(pos[0] // self.cellsize), int(pos[1] // self.cellsize), int(pos[2] // self.cellsize))
+        self.cells.setdefault(cell, []).append((pos, item))
+
+    #Generator for every (pos, item) within range of pos. Manhattan distance (the old way) unless euclidean is given
+    def Query(self, pos, saferange, euclidean=False):
+        lo = [int((pos[axis] - saferange) // self.cellsize) for axis in range(3)]
+        hi = [int((pos[axis] + saferange) // self.cellsize) for axis in range(3)]
+        rangesq = saferange * saferange
+
+        for cx in range(lo[0], hi[0] + 1):
+            for cy in range(lo[1], hi[1] + 1):
+                for cz in range(lo[2], hi[2] + 1):
+                    for c, item in self.cells.get((cx, cy, cz), ()):
+                        if euclidean:
+                            dx = c[0] - pos[0]
+                            dy = c[1] - pos[1]
+                            dz = c[2] - pos[2]
+                            if dx * dx + dy * dy + dz * dz < rangesq:
+                                yield c, item
+                        elif abs(c[0] - pos[0]) + abs(c[1] - pos[1]) + abs(c[2] - pos[2]) < saferange:
+                            yield c, item
+
+    #Function to check if there's anything at all within range of pos
+    def AnyWithin(self, pos, saferange, euclidean=False):
+        for found in self.Query(pos, saferange, euclidean):
+            return True
+        return False
+
+
+#Function to turn an XML node with x, y & z attribs (like Position) into a float tuple
+def PositionTuple(node):
+    return (float(node.attrib["x"]), float(node.attrib["y"]), float(node.attrib["z"]))
 
-    #Numbers are currently in strings. Convert to floats
-    entpos["x"] = float(entpos["x"])
-    entpos["y"] = float(entpos["y"])
-    entpos["z"] = float(entpos["z"])
 
-    for c in avoidcoordslist:
-        c["x"] = float(c["x"])
-        c["y"] = float(c["y"])
-        c["z"] = float(c["z"])
-        dist = (abs(c["x"] - entpos["x"]) + abs(c["y"] - entpos["y"]) + abs(c["z"] - entpos["z"]))
-        if dist < saferange: #If something is too close
-            return False #Do not respawn. God help you if you trap some poor bastard in an asteroid
+#Function to decide if it's safe to respawn an asteroid, based on the proximity of players and cubegrids
+#avoidindex is a SpatialHash of everything that needs to be avoided, entpos is an (x, y, z) tuple
+def CanRespawnAsteroid(avoidindex, entpos, saferange, euclidean=False):
+    if avoidindex.AnyWithin(entpos, saferange, euclidean): #If something is too close
+        return False #Do not respawn. God help you if you trap some poor bastard in an asteroid
 
     #Made it outside, must be good
     return True
 
 
+#The ways backups & snapshots can be compressed, codec: file extension
+compressionextensions = collections.OrderedDict([("none", ""), ("gzip", ".gz"), ("lzma", ".xz"), ("zstd", ".zst")])
+copychunk = 1024 * 1024 #Copies are done this much at a time, so a big file is never all in memory
+
+
+#Function to open a file that's compressed with the given codec, like open(). level is the codec's own compression level,
+#   None for the codec's default
+def OpenCompressed(filepath, mode, codec="none", level=None):
+    writing = "w" in mode or "a" in mode or "x" in mode
+    if codec == "gzip":
+        return gzip.open(filepath, mode, compresslevel=level if level is not None else 6)
+    if codec == "lzma":
+        return lzma.open(filepath, mode, preset=level if writing else None)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd needs the zstandard module, install it with: pip install zstandard")
+        if writing:
+            return zstandard.open(filepath, mode, cctx=zstandard.ZstdCompressor(level=level if level is not None else 3))
+        return zstandard.open(filepath, mode)
+    return open(filepath, mode)
+
+
+#Function to copy a file, compressing or decompressing it on the way. Written beside the destination & swapped in when done
+def CopyCompressed(sourcepath, destpath, sourcecodec="none", destcodec="none", level=None):
+    temppath = destpath + ".semu-tmp"
+    with OpenCompressed(sourcepath, "rb", sourcecodec) as infile:
+        with OpenCompressed(temppath, "wb", destcodec, level) as outfile:
+            shutil.copyfileobj(infile, outfile, copychunk)
+    os.replace(temppath, destpath)
+
+
+#Function to find the snapshot of an asteroid, however it was compressed. Returns (path, codec), or (None, None) if there isn't one
+def FindAsteroidSnapshot(snapshotdir, asteroidname):
+    for codec, extension in compressionextensions.items():
+        snapshotpath = os.path.join(snapshotdir, asteroidname + extension)
+        if os.path.isfile(snapshotpath):
+            return snapshotpath, codec
+    return None, None
+
+
+#Function to get the sha256 of a file's contents, decompressing it first if it's compressed
+def HashFile(filepath, codec="none"):
+    filehash = hashlib.sha256()
+    with OpenCompressed(filepath, "rb", codec) as infile:
+        for data in iter(lambda: infile.read(copychunk), b""):
+            filehash.update(data)
+    return filehash.hexdigest()
+
+
+#The asteroid snapshot manifest records what each voxel file was like when its snapshot was taken, so unchanged
+#   asteroids don't need saving again and asteroids that already match their snapshot don't need respawning
+#asteroid name: {"size", "mtime_ns", "sha256"} of the voxel file at snapshot time, plus "restored", the size & mtime_ns
+#   of the voxel file the last time it was respawned, so that can be recognised without hashing it again
+snapshotmanifestname = "manifest.json"
+
+
+def LoadSnapshotManifest(snapshotdir):
+    manifestpath = os.path.join(snapshotdir, snapshotmanifestname)
+    if not os.path.isfile(manifestpath):
+        return {}
+    try:
+        with open(manifestpath) as manifestfile:
+            return json.load(manifestfile)["asteroids"]
+    except (ValueError, KeyError): #Broken, start again. It'll just mean everything is snapshotted
+        logger.warning("Asteroid snapshot manifest is damaged, ignoring it")
+        return {}
+
+
+def SaveSnapshotManifest(snapshotdir, snapshotmanifest):
+    if not os.path.isdir(snapshotdir):
+        os.makedirs(snapshotdir)
+    WriteFileAtomic(os.path.join(snapshotdir, snapshotmanifestname), json.dumps({"version": 1, "asteroids": snapshotmanifest}, indent=1, sort_keys=True).encode("utf-8"))
+
+
 #Function to save a backup of an asteroid / asteroid moon
 #With asteroids, we work with the Voxel files. Simple backups and overwrites
 #Graps if from the sectorobject's "FileName" node, so will always have the .vox extension included
-def SaveAsteroid(asteroidname):
-    logger.info("Saving snapshot of asteroid: " + asteroidname)
-
-    #First, make sure the snapshot folder exists
-    if not os.path.isdir(asteroidsnapshotdir):
-        #and make it if it doesn't
-        os.makedirs(asteroidsnapshotdir)
+#The snapshot is compressed with codec, so it gets the codec's extension on the end too
+#With a snapshotmanifest (see LoadSnapshotManifest), asteroids that haven't changed since their last snapshot are skipped.
+#   The same size & age means it's not even read, otherwise it's hashed and compared
+#Returns what it did (for the tally) & how many bytes were copied. Safe to run on several asteroids at once, see RunAsteroidIO
+def SaveAsteroid(savedir, snapshotdir, asteroidname, codec="none", level=None, whatif=False, snapshotmanifest=None):
+    asteroidpath = os.path.join(savedir, asteroidname)
+
+    if snapshotmanifest is not None and asteroidname in snapshotmanifest and FindAsteroidSnapshot(snapshotdir, asteroidname)[0] is not None:
+        entry = snapshotmanifest[asteroidname]
+        stat = os.stat(asteroidpath)
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            detaillogger.info("Asteroid hasn't changed since its snapshot: %s", asteroidname)
+            return "Asteroids unchanged since snapshot", 0
+        if entry["size"] == stat.st_size and HashFile(asteroidpath) == entry["sha256"]: #Touched but not changed
+            detaillogger.info("Asteroid hasn't changed since its snapshot: %s", asteroidname)
+            if not whatif:
+                entry["mtime_ns"] = stat.st_mtime_ns
+            return "Asteroids unchanged since snapshot", 0
+
+    detaillogger.info("Saving snapshot of asteroid: %s", asteroidname)
+
+    if whatif:
+        return "Asteroids saved", 0
+
+    #First, make sure the snapshot folder exists, and make it if it doesn't
+    #exist_ok as another thread could be making it at the same time
+    os.makedirs(snapshotdir, exist_ok=True)
 
     #Do the copy
-    if not args.whatif:
-        shutil.copyfile(os.path.join(args.save_path, asteroidname), os.path.join(asteroidsnapshotdir, asteroidname))
+    stat = os.stat(asteroidpath)
+    CopyCompressed(asteroidpath, os.path.join(snapshotdir, asteroidname + compressionextensions[codec]), "none", codec, level)
+
+    #Get rid of any older snapshot of it that was compressed differently, it could be found instead of this one
+    for othercodec, extension in compressionextensions.items():
+        if othercodec != codec and os.path.isfile(os.path.join(snapshotdir, asteroidname + extension)):
+            os.remove(os.path.join(snapshotdir, asteroidname + extension))
+
+    if snapshotmanifest is not None:
+        snapshotmanifest[asteroidname] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": HashFile(asteroidpath)}
+
+    return "Asteroids saved", stat.st_size
 
 
 #Function to loop through an object cluster and disable spotlights
 #Written by RottieLover 30/08/2014
-def DisableSpotLights(objectcluster):
+def DisableSpotLights(objectcluster, summary=None):
+    if summary is None:
+        summary = SummariseCluster(objectcluster)
+
+    ApplyMutations(objectcluster, FindSpotLights(summary))
+
+
+#Function to list the spotlights DisableSpotLights would turn off, as mutations for ApplyMutations
+def FindSpotLights(summary):
     logger.debug("Checking for Spotlights")
-    logger.debug(objectcluster)
-    for obj in objectcluster:
-        for block in obj.find('CubeBlocks'):
-            attrib = FindAttrib(block)
-            if attrib == "MyObjectBuilder_ReflectorLight": #Is a spotlight
-                logger.debug ("Found Spotlight")
-                block.find('Enabled').text = "false" #Turn it off
-                logger.info("Turning off spotlight on entity: ", obj.find('EntityId').text)
+    return [("spotlight", gridindex, blockindex) for gridindex, blockindex, block in summary.spotlights] #Is a spotlight
+
+
+#What each kind of mutation is counted as in the tally
+mutationtallies = {"refinery": "Refineries turned off", "assembler": "Assemblers turned off", "spotlight": "Spotlights turned off",
+                   "refineryqueue": "Refinery queues removed", "stop": "Entities stopped"}
+
+
+#Function to make the changes to an object cluster that the Find functions above have worked out
+#Each mutation is (kind, index of the entity in the cluster, index of the block in CubeBlocks), so they can be worked
+#   out somewhere else (like a --jobs worker) and applied here. Kinds are refinery, assembler & spotlight to turn them off,
+#   refineryqueue to remove the Queue node and stop to kill the entity's movement (no block)
+#Every entity that's changed is added to dirtyobjects if it's given, so the save writer knows it can't just copy it
+def ApplyMutations(objectcluster, mutations, dirtyobjects=None):
+    for kind, gridindex, blockindex in mutations:
+        obj = objectcluster[gridindex]
+        if dirtyobjects is not None:
+            dirtyobjects.add(obj)
+
+        if kind == "stop":
+            tally[mutationtallies[kind]] += 1
+            obj.find('LinearVelocity').attrib["x"] = "0"
+            obj.find('LinearVelocity').attrib["z"] = "0"
+            obj.find('LinearVelocity').attrib["y"] = "0"
+
+            obj.find('AngularVelocity').attrib["x"] = "0"
+            obj.find('AngularVelocity').attrib["y"] = "0"
+            obj.find('AngularVelocity').attrib["z"] = "0"
+            continue
+
+        block = obj.find('CubeBlocks')[blockindex]
+        if kind == "refineryqueue":
+            detaillogger.info("Removing refinery queue on entity: %s", obj.find('EntityId').text)
+            block.remove(block.find('Queue'))
+        else: #Turn it off
+            block.find('Enabled').text = "false"
+            detaillogger.info("Turning off %s on entity: %s", kind, obj.find('EntityId').text)
+        tally[mutationtallies[kind]] += 1
 
 
 #Function to do the oposite, copy the contents of the snapshot back into the current voxel file
 #Once again, fields from the filename node so will have .vox on the end
-def RestoreAsteroid(asteroidname):
-    if os.path.isfile(os.path.join(asteroidsnapshotdir, asteroidname)): #Does a backup for that asteroid exist?
-        logger.info("Respawning asteroid: " + asteroidname)
-        if not args.whatif:
-            shutil.copyfile(os.path.join(asteroidsnapshotdir,+ asteroidname), os.path.join(savedir, asteroidname))
+#The snapshot can be compressed any way SaveAsteroid can write it
+#With a snapshotmanifest, asteroids that already match their snapshot are left alone. Rewriting the file would just make
+#   the game reload the voxel for nothing
+#Returns what it did & how many bytes were copied, like SaveAsteroid
+def RestoreAsteroid(savedir, snapshotdir, asteroidname, whatif=False, snapshotmanifest=None):
+    asteroidpath = os.path.join(savedir, asteroidname)
+    snapshotpath, codec = FindAsteroidSnapshot(snapshotdir, asteroidname)
+    if snapshotpath is not None: #Does a backup for that asteroid exist?
+        entry = snapshotmanifest.get(asteroidname) if snapshotmanifest is not None else None
+        if entry is not None and os.path.isfile(asteroidpath):
+            stat = os.stat(asteroidpath)
+            statnow = [stat.st_size, stat.st_mtime_ns]
+            if statnow == [entry["size"], entry["mtime_ns"]] or statnow == entry.get("restored") or \
+                    (stat.st_size == entry["size"] and HashFile(asteroidpath) == entry["sha256"]):
+                detaillogger.info("Asteroid already matches its snapshot: %s", asteroidname)
+                return "Asteroids already matching snapshot", 0
+
+        detaillogger.info("Respawning asteroid: %s", asteroidname)
+        if whatif:
+            return "Asteroids respawned", 0
+        CopyCompressed(snapshotpath, asteroidpath, codec, "none")
+        stat = os.stat(asteroidpath)
+        if entry is not None:
+            entry["restored"] = [stat.st_size, stat.st_mtime_ns]
+        return "Asteroids respawned", stat.st_size
     else: #If it doesn't exist
-        logger.info("Unable to respawn asteroid, no backup exists: " + asteroidname)
-
-
-#########################################
-### Main ################################
-#########################################
-def main():
-    global logger
+        detaillogger.info("Unable to respawn asteroid, no backup exists: %s", asteroidname)
+        return "Asteroids without a snapshot", 0
+
+
+#Function to run SaveAsteroid or RestoreAsteroid over a whole list of asteroids, a few at a time on a thread pool
+#It's all file copying, so the threads spend their time waiting on the disk rather than fighting over Python
+#Each item in work is the list of arguments for a single call. Tallies what was done & returns (copies, bytes copied)
+#Two VoxelMaps can use the same file, only the first is done so they're never copying over the top of each other
+def RunAsteroidIO(function, work, threads=4):
+    copies = 0
+    bytescopied = 0
+    asteroidnames = set()
+    uniquework = []
+    for arguments in work:
+        if arguments[2] not in asteroidnames: #The asteroid name for both SaveAsteroid & RestoreAsteroid
+            asteroidnames.add(arguments[2])
+            uniquework.append(arguments)
+    work = uniquework
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        for category, size in pool.map(lambda arguments: function(*arguments), work):
+            tally[category] += 1
+            if size > 0:
+                copies += 1
+                bytescopied += size
+    return copies, bytescopied
+
+
+#Function to log how fast the asteroid copies went
+def LogAsteroidThroughput(action, copies, bytescopied, seconds):
+    megabytes = bytescopied / (1024.0 * 1024)
+    logger.info("%s %d asteroids, %.1f MB in %.2fs (%.1f MB/s)", action, copies, megabytes, seconds, megabytes / seconds if seconds > 0 else 0)
+
+
+#What's to be done with an entity (or a whole object cluster), worked out by DecideSectorObject and done by ApplyDecision
+#Kept small & plain so it can be sent back from a --jobs worker process
+class EntityDecision:
+    __slots__ = ("entityid", "keep", "reason", "reasonargs", "category", "owners", "mutations", "blocks", "blocksskipped")
+
+    def __init__(self, entityid, keep=True, reason="", reasonargs=(), category="", owners=None, mutations=None):
+        self.entityid = entityid
+        self.keep = keep
+        self.reason = reason #What to log when removing it, with reasonargs filled in
+        self.reasonargs = reasonargs
+        self.category = category #What it's counted as in the tally, if anything
+        self.owners = owners if owners is not None else []
+        self.mutations = mutations if mutations is not None else [] #See ApplyMutations
+        self.blocks = 0 #How many blocks the cluster has
+        self.blocksskipped = 0 #Blocks that didn't need to be read to decide, see SummariseUntilSettled
+
+
+#Function to run all the per-entity checks on a single SectorObjects entity and decide what to do with it
+#Doesn't change anything, returns an EntityDecision for ApplyDecision
+#For CubeGrids joined to others, pass the whole cluster from MapObjectClusters and whether all its joints were paired up.
+#   The decision is then for the cluster as a whole
+#Rewrote to be more dynamic and to allow treating multiple entites / objects as one (motor joins). Lets call these 'object clusters'
+#Lets always treat things as a cluster. Even if it's a cluster of 1. Will need to modify functions to match
+def DecideSectorObject(obj, args, objectcluster=None, jointsmapped=False):
+    objectclass = FindAttrib(obj)
+    decision = EntityDecision(obj.findtext('EntityId'))
+
+    #---Process non-cubegrid stuff first---
+
+    #Remove free floating objects
+    if objectclass == "MyObjectBuilder_FloatingObject" and args.cleanup_items:
+        decision.keep = False
+        decision.reason = "Removing free-floating object: %s %s"
+        decision.reasonargs = (decision.entityid, GetFloatingItemName(obj))
+        decision.category = "Floating objects removed"
+        return decision #Next object
+
+    #---CubeGrid Stuff---
+    if objectclass == "MyObjectBuilder_CubeGrid":
+
+        #ROTORS ARE JOINED BY PROXIMITY WHEN THE SERVER STARTS
+        #Without --map-joints there's no cluster map, so just use a single cluster per object
+        # AND IGNORE PRUNING ALL OBJECTS THAT HAVE ROTORS ATTACHED TO THEM
+        if objectcluster is None:
+            objectcluster = [obj]
 
-    #Load up argparse
-    argparser = argparse.ArgumentParser(description="Utility for performing maintenance & cleanup on SE save files.")
-    argparser.add_argument('save_path', nargs='?', help='Path to the share folder.', default='') #? used to compress into single item (not list) and will accept it if it's missing
-    argparser.add_argument('--skip-backup', '-B', help='Skip backup up the save files.', default=False, action='store_true')
-    argparser.add_argument('--big-backup', '-b', help='Save the backups as their own files with timestamps. Can make save folder huge after a few backups.', default=False, action='store_true')
-    argparser.add_argument('--cleanup-items', '-i', help="Clean up free floating objects like ores and components. Doesn't do corpses, they are more complicated.", default=False, action='store_true')
-    argparser.add_argument('--prune-players', '-p', help="Removes old entries in the player list. Considered old if they don't own any blocks and either don't belong to a faction or IsDead is true. WARNING: Running this on a single-player save will force you to respawn.", default=False, action='store_true')
-    argparser.add_argument('--prune-factions', '-f', help="Remove empty factions", default=False, action='store_true')
-    argparser.add_argument('--whatif', '-w', help="For debugging, won't do any backups and won't save changes.", default=False, action='store_true')
-    argparser.add_argument('--disable-factories', '-d', help='To save on wasted CPU cycles, turn off factories. Soft turns off idle assemblers and empty refineries. Hard turns off assemblers and refineries regardless.', default="", metavar="soft / hard", choices=['soft', 'hard'], nargs=1)
-    argparser.add_argument('--stop-movement', '-m', help="Stops all CubeGrid linear and angular velocity, stopping them still. WARNING: This will affect civilian ships as well, may lead to a buildup of civilian ships as they rely on inertia to leave the sector.", default=False, action='store_true')
-    argparser.add_argument('--remove-npc-ships', '-n', help='Removes any ship with inertial dampners turned off and have a beacon named Private Sail, Business Shipment, Commercial Freighter, Mining Carriage / Transport / Hauler and Military Escort / Minelayer / Transporter. Is a rough match but the option is there.', default=False, action='store_true')
-    argparser.add_argument('--ignore-joint', '-I', help="At current, the utility won't remove anything with a joint on it (e.g. motor). This restriction can be ignored but use with caution as it may leave 1-ended joints.", default=False, action='store_true')
-    argparser.add_argument('--full-cleanup', '-F', help="A complete cleanup. Cleans Factions, Players, Items and all unpowered Objects. Also soft-disables factories and stops movement", default=False, action='store_true')
-    argparser.add_argument('--save-asteroids', '-s', help="Saves a copy of all asteroids as they are", default=False, action='store_true')
-    argparser.add_argument('--respawn-asteroids', '-r', help="If there's nothing close to the asteroids, restores them to their original state from a backup", default=False, action='store_true')
-    argparser.add_argument('--cleanup-unpowered', '-u', help="When setting up a cleanup, removes objects without reactors or batteries or with unfueled reactors or dead batteries. By default, doesn't count solar panels as power", default=False, action='store_true')
-    argparser.add_argument('--cleanup-include-solar', '-S', help="Normally solar panels are excluded because its impossible to confirm with certainty that it's powered. Using this switch forces them to be included in the power check.", default=False, action='store_true')
-    argparser.add_argument('--cleanup-missing-attrib', '-c', help="Removes objects that are missing cubes with the given attribute, except those that have cubes that match --cleanup-missing-subtype. A list of attributes can be found on the wiki.", nargs="*", default=[])
-    argparser.add_argument('--cleanup-missing-subtype', '-C', help="Removes objects that are missing cubes with the given subtype, except those that have cubes that match --cleanup-missing-attrib. A list of subtypes can be found on the wiki.", nargs="*", default=[])
-    argparser.add_argument('--remove-refinery-queue', '-Q', help="As of SE 01.043, the refinery queue self-replicates and can easily get out of control and cause serious lag. This removes the 'queue' node from refineries which doesn't seem to really do anything.", default=False, action='store_true')
-    argparser.add_argument('--disable-spotlights', '-L', help="Turns off all spotlights.", default=False, action='store_true')
+        #One pass over the blocks to get everything the checks below need, and only that
+        plan = GetRulePlan(args)
+        summary = SummariseCluster(objectcluster, plan, jointsmapped)
+        decision.blocks = sum(len(o.find('CubeBlocks')) for o in objectcluster)
+        decision.blocksskipped = summary.blocksskipped
+
+        #---Always process removal stuff before modify---
+        #DO NOT REMOVE ANYTHING WITH A ROTOR OR STATOR OR PISTON unless the override is given, or every joint in the cluster was mapped
+        if not HasJoint(objectcluster, summary) or plan.ignorejoint or jointsmapped:
+            if plan.removenpcs and IsClusterAnNPC(objectcluster, summary):
+                decision.keep = False
+                decision.reason = "! Removing NPC entity: %s %s"
+                decision.reasonargs = (decision.entityid, FindObjectName(objectcluster, summary))
+                decision.category = "NPC ships removed"
+                return decision #Next sector object
+
+            if plan.checkremoval: #If its cleanup o'clock and it's a CubeGrid like a station or ship
+                if DoIRemoveThisCluster(objectcluster, plan.findattribs, plan.findsubtypes, plan.musthavepower, plan.allowsolar, summary):
+                    decision.keep = False
+                    decision.reason = "! Removing CubeGrid %s"
+                    decision.reasonargs = (decision.entityid,)
+                    decision.category = "CubeGrids removed"
+                    return decision #Next sector object, we're removing this one anyway
+                else:
+                    detaillogger.info("  Entity passed check")
+                    decision.category = "CubeGrids passed check"
 
-    args = argparser.parse_args()
+        #Joints that couldn't be mapped, leave it be
+        else:
+            detaillogger.info("Skipping object that has an unmapped joint: %s", objectcluster[0].find('EntityId').text)
+            decision.category = "CubeGrids skipped, unmapped joint"
 
-    print("")
-    #print(args)
-    #print("")
+        #End of If HasJoint
 
-    #Definition for a full cleanup
-    if args.full_cleanup:
-        args.cleanup_unpowered = True
-        args.cleanup_items = True
-        args.prune_players = True
-        args.prune_factions = True
-        args.stop_movement = True
-        args.disable_factories = "soft"
-        args.remove_refinery_queue = True
+        #---After processing removal stuff, THEN do modify stuff---
 
-    #Check to see if an action has been specified
-    simpleusagemsg = """
-    To quickly use this utility in Windows;
-    - Hold the Windows keyboard key and press R
-        A window saying Open or Run will appear
-    - Type in "cmd" and press Enter
-        A black window with white writing will appear
-    - Drag & drop SEMU into the window, hit Space and then type "-h" and hit enter
-        This is the list of available options for SEMU
-    - Drag & drop SEMU into the window again
-    - Press space, then drag & drop the save folder to clean into the window
-    - Press space, then enter the commands you want to use
-    e.g. Semu.exe C:\save\path\ --full-cleanup
+        #Add to owner list
+        decision.owners = GetClusterOwners(objectcluster, summary)
 
-    For instructions on how to make shortcuts & scripts
-    for frequent cleanups, check out the wiki on the SEMU site;
-    https://sourceforge.net/projects/semaintenanceutility/
-    """
+        #Turn off factories
+        if plan.factorymode != "":
+            decision.mutations.extend(FindFactoriesToDisable(summary, plan.factorymode))
 
-    #Ok, we're good. Get the log ready
-    logfilename = OpenLog()
-    logger = logging.getLogger()
+        #Remove refinery queues
+        if plan.removequeues:
+            decision.mutations.extend(FindRefineryQueues(summary))
 
-    if not sys.argv[1:]:
-        logger.error("no actions given.")
-        print(simpleusagemsg)
-        raw_input("Press the ENTER key to exit.")
-        sys.exit()
+        #Turn off Spotlights
+        if plan.disablespotlights:
+            decision.mutations.extend(FindSpotLights(summary))
 
-    if args.save_path == '':
-        logger.error("No save path given.")
-        print(simpleusagemsg)
-        raw_input("Press the ENTER key to exit.")
-        sys.exit()
+        #Stop movement
+        if plan.stopmovement:
+            decision.mutations.extend(("stop", gridindex, -1) for gridindex in range(len(objectcluster)))
 
-    #Replace all "\" with "/" and add an "/" on the end if it's missing
-    args.save_path = args.save_path.replace("\\", "/")
-    if args.save_path[-1:] != "/":
-        args.save_path = args.save_path + "/"
+    #end CubeGrid if
 
-    ### Save some in-built vars ###
-    savedir = args.save_path
-    asteroidsnapshotdir = os.path.join(savedir, "semu-asteroid-snapshots")
-    entitysnapshotdir = os.path.join(savedir, "semu-entity-snapshots")
-    asteroidspawnrange = 600 #Nothing can be within this many units of an asteroid for it to safely respawn
-    moonspawnrange = 200 #Nothing can be within this many units of an asteroid moon for it to safely respawn
+    return decision
 
-    #Set up names
-    smallsavefilename = "Sandbox.sbc"
-    largesavefilename = "SANDBOX_0_0_0_.sbs"
 
-    smallsavefilepath = os.path.join(savedir, smallsavefilename)
-    largesavefilepath = os.path.join(savedir, largesavefilename)
+#Function to carry out an EntityDecision on the entity / object cluster it was made for
+#Returns False if it's to be removed, True if it's to be kept. Changed entities are added to dirtyobjects, see ApplyMutations
+def ApplyDecision(objectcluster, decision, owningplayers, dirtyobjects=None):
+    if decision.category != "":
+        tally[decision.category] += 1
 
-    #Attempt to find the save folder
-    if not os.path.isdir(savedir):
-        logger.error("Unable to load save folder.")
-        logger.info(savedir)
-        sys.exit()
+    if decision.blocks > 0:
+        tally["Blocks checked"] += decision.blocks
+    if decision.blocksskipped > 0:
+        tally["Blocks skipped"] += decision.blocksskipped
 
-    #Check for save files
-    if not os.path.isfile(smallsavefilepath):
-        logger.error("Unable to find small save: %s" % smallsavefilename)
-        sys.exit()
-    if not os.path.isfile(largesavefilepath):
-        logger.error("Unable to find small save: %s" % largesavefilename)
-        sys.exit()
+    if changeplan is not None: #--whatif, note it down for --apply-plan
+        changeplan.AddDecision(objectcluster, decision)
 
-    #Save backups
-    if not args.skip_backup and not args.whatif:
-        logger.info("Saving backups...")
-        if args.big_backup:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            smallbackupname = "%s.%s.backup" % (smallsavefilepath, timestamp)
-            largebackupname = "%s.%s.backup" % (largesavefilepath, timestamp)
-        else:
-            smallbackupname = os.path.join(smallsavefilepath, ".backup")
-            largebackupname = os.path.join(largesavefilepath, ".backup")
+    if not decision.keep:
+        detaillogger.info(decision.reason, *decision.reasonargs)
+        return False
 
-        #print "Saving: " + smallbackupname
-        logger.info("Saving smallsave backup...")
-        shutil.copyfile(smallsavefilepath, smallbackupname)
-        #print "Saving: " + largebackupname
-        logger.info("Saving largesave backup...")
-        shutil.copyfile(largesavefilepath, largebackupname)
+    owningplayers.update(decision.owners)
+    ApplyMutations(objectcluster, decision.mutations, dirtyobjects)
+    return True
 
-    #Load saves
-    logger.info("Loading %s..." % smallsavefilename)
-    xmlsmallsavetree = ET.parse(smallsavefilepath)
-    xmlsmallsave = xmlsmallsavetree.getroot()
 
-    logger.info("Loading %s file..." % largesavefilename)
-    xmllargesavetree = ET.parse(largesavefilepath)
-    xmllargesave = xmllargesavetree.getroot()
+#Function to note down what the asteroid phases need to know about a kept entity, in asteroids (AsteroidRecords) &
+#   avoidents (a PositionArray). Positions are packed into float arrays, so nothing holds on to the XML once it's been written out
+def CollectAsteroidInfo(obj, asteroids, avoidents):
+    objectclass = FindAttrib(obj)
+    if objectclass == "MyObjectBuilder_VoxelMap":
+        asteroids.Append(obj.find('Filename').text, PositionTuple(obj.find('PositionAndOrientation').find('Position')))
+    elif objectclass == "MyObjectBuilder_Character" or objectclass == "MyObjectBuilder_CubeGrid": #Only do checks for CubeGrids and players. Who cares about floating items or other asteroids.
+        avoidents.Append(PositionTuple(obj.find('PositionAndOrientation').find('Position'))) #Add the XYZ to the list
 
-    logger.info("Getting Started...")
 
-    #Try to find the Sector Objects node
-    if xmllargesave.find('SectorObjects') is None:
-        logger.error("Unable to locate SectorObjects node!")
-        sys.exit()
+#Function to serialise a single entity without the namespace declarations ElementTree puts on it
+#They've already been declared on the root node, so they'd just bloat the save
+#ElementTree serialises lxml nodes too, so the saves come out byte for byte the same whichever backend read them
+def EntityToBytes(node, nsdecls):
+    data = ET.tostring(node)
+    head, sep, rest = data.partition(b">")
+    for prefix, uri in nsdecls:
+        head = head.replace((' xmlns:%s="%s"' % (prefix, uri)).encode('ascii'), b"", 1)
 
-    sectorobjects = xmllargesave.find('SectorObjects')
+    return head + sep + rest
 
-    #Init the ownership table
-    owningplayers = []
 
-    #Big loop through entity list
-    logger.info("===Beginning SectorObject check...===")
+#Function to find the byte range of every SectorObjects entity in the large save, in the order they're in the file
+#Just a quick scan for the start and end tags, nothing is parsed. Returns a list of (offset, length)
+def ScanEntitySpans(largesavefilepath):
+    spans = []
+    if os.path.getsize(largesavefilepath) == 0:
+        return spans
 
-    #Rewrote to be more dynamic and to allow treating multiple entites / objects as one (motor joins). Lets call these 'object clusters'
-    #Lets always treat things as a cluster. Even if it's a cluster of 1. Will need to modify functions to match
-    #Removing clusters this way should be safe. The big concern was that if I were to start removing mid-loop, not only
-    #   would my end point be changed, but so would the current position and objects would be skipped. This way,
-    #   as long as touching any part of the cluster reveals the entire cluster, it will never remove backwards, always forwards
-    i = 0
-    while i < len(sectorobjects):
-        #---If removing an entity, DO NOT i++ !!!---
-        obj = sectorobjects[i]
-        objectclass = FindAttrib(object)
-
-        #print("Checking object")
-        #print(objectclass)
-
-        #---Process non-cubegrid stuff first---
-
-        #Remove free floating objects
-        if objectclass == "MyObjectBuilder_FloatingObject" and args.cleanup_items:
-            #logger.info("Removing free-floating object: ",  object.find('EntityId').text)
-            logger.info("Removing free-floating object: ", obj.find('EntityId').text, " ", GetFloatingItemName(object))
-            sectorobjects.remove(object)
-            continue #Next object
-
-        #---CubeGrid Stuff---
-        #if IsCubeGrid(object) == True:
-        if objectclass == "MyObjectBuilder_CubeGrid":
-
-            #ROTORS ARE JOINED BY PROXIMITY WHEN THE SERVER STARTS
-            #UNTIL YOU FIGURE OUT HOW TO CALCULATE THIS IN THE SAVE, JUST USE A SINGLE CLUSTER PER OBJECT
-            # AND IGNORE PRUNING ALL OBJECTS THAT HAVE ROTORS ATTACHED TO THEM
-            #objectcluster = MapObjectCluster(sectorobjects, object) #Generate the entity cluster map
-            objectcluster = [obj]
+    with open(largesavefilepath, "rb") as fh:
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = data.find(b"<SectorObjects")
+            if start < 0:
+                return spans
+            stop = data.find(b"</SectorObjects>", start)
+            if stop < 0:
+                stop = len(data)
+
+            pos = start
+            while True:
+                begin = data.find(b"<MyObjectBuilder_EntityBase", pos, stop)
+                if begin < 0:
+                    break
+                end = data.find(b"</MyObjectBuilder_EntityBase>", begin, stop)
+                if end < 0:
+                    break
+                end += len(b"</MyObjectBuilder_EntityBase>")
+                spans.append((begin, end - begin))
+                pos = end
+        finally:
+            data.close()
+
+    return spans
+
+
+#The entity index is a list of everything in SectorObjects, in file order, worked out without parsing the save
+#Each entry is [offset, length, xsi:type (what FindAttrib gives), EntityId, x, y, z]. Anything that couldn't be found is None
+#It's cached beside the large save as JSON and thrown away as soon as the save's size or age changes. Once loaded it's
+#   kept as an EntityIndex, which goes through the same entries
+entityindexversion = 1
+entitytyperegex = re.compile(rb'\btype="([^"]*)"')
+entityidregex = re.compile(rb'<EntityId>([^<]*)</EntityId>')
+entitypositionregex = re.compile(rb'<Position\s+x="([^"]*)"\s+y="([^"]*)"\s+z="([^"]*)"')
+
+
+#Function to index the large save from scratch, see entityindexversion
+def IndexLargeSave(largesavefilepath):
+    index = []
+    spans = ScanEntitySpans(largesavefilepath)
+    if len(spans) == 0:
+        return index
+
+    with open(largesavefilepath, "rb") as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, length in spans:
+                end = offset + length
+                entitytype = entitytyperegex.search(data, offset, data.find(b">", offset, end))
+                entityid = entityidregex.search(data, offset, end)
+                position = entitypositionregex.search(data, offset, end)
+                entry = [offset, length,
+                         entitytype.group(1).decode('ascii') if entitytype is not None else None,
+                         entityid.group(1).decode('ascii') if entityid is not None else None]
+                try:
+                    entry.extend(float(axis) for axis in position.groups())
+                except (AttributeError, ValueError): #No position, or not a number
+                    entry.extend([None, None, None])
+                index.append(entry)
+
+    return index
+
+
+#Entity indexes already loaded, large save path -> (size, mtime_ns, index). Saves --watch reading them again
+entityindexes = {}
+
+
+#Function to get the entity index of the large save, from the cache if it's still good or by indexing it again
+#With whatif a new index isn't saved beside the large save, nothing in the save folder is touched
+def LoadEntityIndex(largesavefilepath, whatif=False):
+    stat = os.stat(largesavefilepath)
+    loaded = entityindexes.get(largesavefilepath)
+    if loaded is not None and loaded[0] == stat.st_size and loaded[1] == stat.st_mtime_ns:
+        return loaded[2]
+    index = EntityIndex(ReadEntityIndex(largesavefilepath, stat, whatif))
+    entityindexes[largesavefilepath] = (stat.st_size, stat.st_mtime_ns, index)
+    return index
+
+
+#Function to read the entries of the entity index cached beside the large save, or index it again if it's out of date
+def ReadEntityIndex(largesavefilepath, stat, whatif=False):
+    indexpath = largesavefilepath + ".semu-index"
+    if os.path.isfile(indexpath):
+        try:
+            with open(indexpath) as indexfile:
+                cached = json.load(indexfile)
+            if cached["version"] == entityindexversion and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+                return cached["entities"]
+        except (ValueError, KeyError):
+            pass #Broken, just index it again
+
+    index = IndexLargeSave(largesavefilepath)
+    if whatif:
+        return index
+    try:
+        WriteFileAtomic(indexpath, json.dumps({"version": entityindexversion, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "entities": index}).encode('ascii'))
+    except OSError as err: #Not being able to cache it isn't the end of the world
+        logger.warning("Unable to save the entity index: %s", err)
+    return index
+
+
+#Function to work out if an entity has to be parsed for the options given, going just by its type
+#Anything that doesn't is copied straight through by --splice without ever being looked at
+def EntityNeedsParsing(entitytype, args):
+    if entitytype == "MyObjectBuilder_CubeGrid":
+        return args.cleanup_unpowered or len(args.cleanup_missing_attrib) > 0 or len(args.cleanup_missing_subtype) > 0 or args.remove_npc_ships \
+            or args.stop_movement or len(args.disable_factories) > 0 or args.remove_refinery_queue or args.disable_spotlights \
+            or args.prune_players #Needs the owners of every grid
+    if entitytype == "MyObjectBuilder_FloatingObject":
+        return args.cleanup_items
+    if entitytype == "MyObjectBuilder_VoxelMap":
+        return args.save_asteroids or args.respawn_asteroids #Needs the file name
+    return False
 
-            #---Always process removal stuff before modify---
-            #DO NOT REMOVE ANYTHING WITH A ROTOR OR STATOR OR PISTON unless the override is given, currently unable to map past joints
-
-            #print(HasJoint(objectcluster))
-            if not HasJoint(objectcluster) or args.ignore_joint:
-                #print("Checking object: " + objectcluster[0].find('EntityId').text + " " + objectclass)
-                if args.remove_npc_ships and IsClusterAnNPC(objectcluster):
-                    #print "Removing NPC entity: " + " ,".join(objectcluster)
-                    logger.info("! Removing NPC entity: ", obj.find('EntityId').text, " ", FindObjectName(objectcluster)) #Just until clusters get sorted
-                    for o in objectcluster:
-                        sectorobjects.remove(o)
-                    continue #Next sector object
-
-                if args.cleanup_unpowered or len(args.cleanup_missing_attrib) > 0 or len(args.cleanup_missing_subtype) > 0: #If its cleanup o'clock and it's a CubeGrid like a station or ship
-                    #print("Do I remove this?")
-                    if DoIRemoveThisCluster(objectcluster, args.cleanup_missing_attrib, args.cleanup_missing_subtype, args.cleanup_unpowered, args.cleanup_include_solar):
-                        #print "Removing CubeGrid entites: " + " ,".join(objectcluster)
-                        logger.info("! Removing CubeGrid") #Just until clusters get sorted
-                        for o in objectcluster:
-                            sectorobjects.remove(o)
-                        continue #Next sector object, we're removing this one anyway
-                    else:
-                        logger.info("  Entity passed check")
-                        #print("Object passes inspection: " + object.find('EntityId').text) #Just until clusters get sorted
 
-            #Remove this Else when you've got joints sussed out
+#Function to go through the large save using the entity index instead of loading it. Only the entities the options
+#   given need are parsed (see EntityNeedsParsing), one at a time. The rest never leave the file
+#Writes the save out with writer (a SaveWriter) as it goes, copying everything that wasn't changed. If writer is None nothing is written (whatif)
+#With a DecisionCache, CubeGrids that haven't changed since the last run and have nothing to change aren't even parsed
+#Returns (entities checked, entities kept, entities parsed)
+def SpliceSectorObjects(largesavefilepath, writer, args, owningplayers, asteroids, avoidents, cache=None):
+    index = LoadEntityIndex(largesavefilepath, args.whatif)
+    nsdecls = ReadRootNamespaces(largesavefilepath)
+    for prefix, uri in nsdecls:
+        if prefix != "":
+            ET.register_namespace(prefix, uri)
+    counts = collections.Counter()
+
+    #What to write out for each entity, see WriteSplicedSave
+    def EntityOutputs(data):
+        for offset, length, entitytype, entityid, x, y, z in index:
+            counts["checked"] += 1
+            if not EntityNeedsParsing(entitytype, args) and (x is not None or entitytype not in ("MyObjectBuilder_CubeGrid", "MyObjectBuilder_Character")):
+                counts["kept"] += 1
+                if entitytype in ("MyObjectBuilder_CubeGrid", "MyObjectBuilder_Character"):
+                    avoidents.Append((x, y, z))
+                yield True
+                continue
+
+            source = data[offset:offset + length]
+            decision = None
+            digest = None
+            if cache is not None and entitytype == "MyObjectBuilder_CubeGrid" and entityid is not None:
+                digest = DecisionDigest([source])
+                decision = cache.Find(entityid, digest)
+                if decision is not None and len(decision.mutations) == 0 and x is not None: #Nothing to change, so no need to parse it
+                    if not ApplyDecision([], decision, owningplayers):
+                        yield None
+                        continue
+                    counts["kept"] += 1
+                    avoidents.Append((x, y, z))
+                    yield True
+                    continue
+
+            counts["parsed"] += 1
+            obj = ParseEntityBytes(source, nsdecls)
+            if decision is None:
+                decision = DecideSectorObject(obj, args)
+                if digest is not None:
+                    cache.Store(entityid, digest, decision)
+            dirtyobjects = set()
+            if not ApplyDecision([obj], decision, owningplayers, dirtyobjects):
+                yield None
+                continue
+            counts["kept"] += 1
+            CollectAsteroidInfo(obj, asteroids, avoidents)
+            yield obj if obj in dirtyobjects else True
+
+    with open(largesavefilepath, "rb") as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            spans = [(entry[0], entry[1]) for entry in index]
+            if writer is not None:
+                WriteSplicedSave(writer, data, spans, EntityOutputs(data))
             else:
-                pass
-                #logger.info("Skipping object that has a joint: " + objectcluster[0].find('EntityId').text)
+                for output in EntityOutputs(data):
+                    pass
 
-            #End of If HasJoint
+    return counts["checked"], counts["kept"], counts["parsed"]
 
-            #---After processing removal stuff, THEN do modify stuff---
 
-            #Add to owner list
-            for owner in GetClusterOwners(objectcluster):
-                if owner not in owningplayers:
-                    owningplayers.append(owner)
+#Function to get the namespaces declared on the root node of a save, as (prefix, uri) pairs
+def ReadRootNamespaces(savefilepath):
+    nsdecls = []
+    for event, node in IterParseXML(savefilepath, ("start-ns", "start")):
+        if event == "start":
+            break
+        nsdecls.append(node)
 
-            #Turn off factories
-            #if args.disable_factories != '':
-            if len(args.disable_factories) > 0:
-                DisableFactories(objectcluster, args.disable_factories[0])
+    return nsdecls
 
-            #Remove refinery queues
-            if args.remove_refinery_queue:
-                RemoveRefineryQueue(objectcluster)
 
-            #Turn off Spotlights
-            if args.disable_spotlights:
-                DisableSpotLights(objectcluster)
+#Function to parse a single entity cut out of the large save. It needs the root's namespaces for the xsi:type attribs
+def ParseEntityBytes(data, nsdecls):
+    wrapper = "<semu" + "".join(' xmlns:%s="%s"' % (prefix, uri) for prefix, uri in nsdecls if prefix != "") + ">"
+    return ParseXMLString(wrapper.encode('ascii') + data + b"</semu>")[0]
 
-            #Stop movement
-            if args.stop_movement:
-                KillClusterInertia(objectcluster)
 
-        #end CubeGrid if
+#Function to set up logging in a --jobs worker. The per-block detail isn't logged from the workers, just problems
+def InitClassifyWorker():
+    global logger
+    logging.basicConfig(format='%(levelname)-8s %(message)s', level='WARNING')
+    logger = logging.getLogger()
+    detaillogger.setLevel(logging.WARNING)
+
+
+#Function run in a --jobs worker to decide what to do with a chunk of object clusters
+#Each item in the chunk is (sources, jointsmapped), a source being the (offset, length) of a grid in the large save
+#   or the grid's XML if it couldn't be found in the file. Returns an EntityDecision per item
+def ClassifyChunk(largesavefilepath, nsdecls, chunk, args):
+    UseXMLBackend(args.xml_backend, args.stream) #Workers start fresh, so they need telling
+    decisions = []
+    with open(largesavefilepath, "rb") as fh:
+        for sources, jointsmapped in chunk:
+            objectcluster = []
+            for source in sources:
+                if isinstance(source, bytes):
+                    data = source
+                else:
+                    fh.seek(source[0])
+                    data = fh.read(source[1])
+                objectcluster.append(ParseEntityBytes(data, nsdecls))
+            decisions.append(DecideSectorObject(objectcluster[0], args, objectcluster, jointsmapped))
+
+    return decisions
+
+
+#Function to work out an EntityDecision for every object cluster in units, the CubeGrids being done by --jobs worker processes
+#units is a list of (objectcluster, jointsmapped), the decisions come back in the same order
+#The workers read their grids straight out of the large save instead of having them sent over
+#With a DecisionCache (and the EntitySources to hash the grids with) only grids that have changed are sent to the workers
+def ClassifyInParallel(largesavefilepath, sectorobjects, units, args, cache=None, entitysources=None):
+    nsdecls = ReadRootNamespaces(largesavefilepath)
+    spans = ScanEntitySpans(largesavefilepath)
+    if len(spans) != len(sectorobjects): #Something odd in the file, send the XML over instead
+        logger.warning("Couldn't line up the entities in the large save, sending them to the workers instead")
+        spans = None
+    positions = dict((obj, index) for index, obj in enumerate(sectorobjects))
+
+    decisions = [None] * len(units)
+    digests = {} #Unit index to DecisionDigest, for caching what the workers decide
+    work = [] #(unit index, sources, jointsmapped, size)
+    for unitindex, (objectcluster, jointsmapped) in enumerate(units):
+        if FindAttrib(objectcluster[0]) != "MyObjectBuilder_CubeGrid": #Nothing worth sending off
+            decisions[unitindex] = DecideSectorObject(objectcluster[0], args, objectcluster, jointsmapped)
+            continue
+
+        if cache is not None and entitysources is not None:
+            raw = entitysources.Get(objectcluster)
+            if raw is not None:
+                digest = DecisionDigest(raw, jointsmapped)
+                decisions[unitindex] = cache.Find(objectcluster[0].findtext('EntityId'), digest)
+                if decisions[unitindex] is not None: #Unchanged since the last run
+                    continue
+                digests[unitindex] = digest
+
+        if spans is not None:
+            sources = [spans[positions[obj]] for obj in objectcluster]
+            size = sum(source[1] for source in sources)
+        else:
+            sources = [EntityToBytes(obj, nsdecls) for obj in objectcluster]
+            size = sum(len(source) for source in sources)
+        work.append((unitindex, sources, jointsmapped, size))
+
+    #Split the grids up into chunks of about the same size, a few per worker so they all finish about the same time
+    chunks = []
+    chunksize = max(1, sum(item[3] for item in work) // (args.jobs * 4))
+    currentsize = 0 #Size of the chunk being filled, kept as we go so it's not summed again for every grid
+    for item in work:
+        if len(chunks) == 0 or currentsize >= chunksize:
+            chunks.append([])
+            currentsize = 0
+        chunks[-1].append(item)
+        currentsize += item[3]
+
+    logger.info("Checking %d CubeGrids in %d chunks with %d workers...", len(work), len(chunks), args.jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, mp_context=multiprocessing.get_context("spawn"), initializer=InitClassifyWorker) as pool:
+        futures = [pool.submit(ClassifyChunk, largesavefilepath, nsdecls, [(item[1], item[2]) for item in chunk], args) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            for item, decision in zip(chunk, future.result()):
+                objectcluster = units[item[0]][0]
+                if decision.entityid != objectcluster[0].findtext('EntityId'): #Should never happen, but removing the wrong grid would be bad
+                    raise RuntimeError("Worker decision for entity %s doesn't match entity %s" % (decision.entityid, objectcluster[0].findtext('EntityId')))
+                decisions[item[0]] = decision
+                if item[0] in digests:
+                    cache.Store(decision.entityid, digests[item[0]], decision)
+
+    return decisions
+
+
+#Function to stream the large save one SectorObjects entity at a time instead of loading the whole thing
+#Each entity is checked with CachedDecision & ApplyDecision, written straight out with writer (a SaveWriter) if it's
+#   kept and then thrown away, so memory only ever has to hold the biggest single grid. If writer is None nothing is
+#   written (whatif)
+#Kept entities that weren't changed are copied straight from the file (see ScanEntitySpans) instead of being written out again
+#CubeGrids that haven't changed since the last run are decided by cache (a DecisionCache) if there is one
+#Returns (entities checked, entities kept), or None if there was no SectorObjects node
+def StreamSectorObjects(largesavefilepath, writer, args, owningplayers, asteroids, avoidents, cache=None):
+    nsdecls = []
+    depth = 0
+    root = None
+    sectorobjects = None
+    found = False
+    checked = 0
+    kept = 0
+    spans = ScanEntitySpans(largesavefilepath) if writer is not None or cache is not None else []
+    data = None
+
+    with open(largesavefilepath, "rb") as fh:
+        if len(spans) > 0:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for event, node in IterParseXML(largesavefilepath, ("start", "end", "start-ns")):
+                if event == "start-ns":
+                    nsdecls.append(node)
+                    if node[0] != "":
+                        ET.register_namespace(node[0], node[1])
+                    continue
+
+                if event == "start":
+                    depth += 1
+                    if depth == 1: #The root node, write its start tag with the namespaces SE wants
+                        root = node
+                        if writer is not None:
+                            writer.nsdecls = senamespaces + [decl for decl in nsdecls if decl not in senamespaces]
+                            writer.WriteHeader(node)
+                    elif depth == 2 and node.tag == "SectorObjects":
+                        sectorobjects = node
+                        found = True
+                        if writer is not None:
+                            writer.Write(b"\n  <SectorObjects>")
+                    continue
+
+                #End events
+                depth -= 1
+                if depth == 2 and sectorobjects is not None: #Finished reading an entity
+                    dirtyobjects = set()
+                    span = spans[checked] if checked < len(spans) else None
+                    checked += 1
+                    spanmatches = span is not None and SpansMatchObjects(data, [span], [node])
+                    decision = CachedDecision(cache, [node], args, sources=[data[span[0]:span[0] + span[1]]] if spanmatches else None)
+                    if ApplyDecision([node], decision, owningplayers, dirtyobjects):
+                        kept += 1
+                        CollectAsteroidInfo(node, asteroids, avoidents)
+                        if writer is not None:
+                            writer.Write(b"\n    ")
+                            if spanmatches and node not in dirtyobjects:
+                                writer.Write(data[span[0]:span[0] + span[1]])
+                            else:
+                                writer.WriteElement(node)
+                    node.clear()
+                    sectorobjects.remove(node) #Free it up, it's always at the front so this is cheap
+                elif depth == 1: #Finished a child of the root
+                    if node is sectorobjects:
+                        sectorobjects = None
+                        if writer is not None:
+                            writer.Write(b"\n  </SectorObjects>")
+                    elif writer is not None:
+                        writer.Write(b"\n  ")
+                        writer.WriteElement(node)
+                    node.clear()
+                    root.remove(node)
+                elif depth == 0 and writer is not None:
+                    writer.Write(("\n</%s>" % node.tag).encode('ascii'))
+        except:
+            if writer is not None:
+                writer.Abort()
+            raise
+        finally:
+            if data is not None:
+                data.close()
+
+    if not found:
+        return None
+    return checked, kept
+
+
+#Function to check SectorObjects with the whole large save loaded, the normal way. Needed for --map-joints & --jobs
+#Returns (the EntityRecords to write the large save from, None), or (None, the root of the large save) if the file
+#   doesn't line up with what was loaded and the tree has to be written out whole. With whatif it's (None, None)
+def CheckLoadedSectorObjects(largesavefilepath, args, report, runsummary, owningplayers, asteroids, avoidents):
+    report.Phase("load_large_save", bytes=os.path.getsize(largesavefilepath))
+    logger.info("Loading %s file...", os.path.basename(largesavefilepath))
+    xmllargesavetree = ParseXML(largesavefilepath)
+    xmllargesave = xmllargesavetree.getroot()
+
+    logger.info("Getting Started...")
+
+    #Try to find the Sector Objects node
+    if xmllargesave.find('SectorObjects') is None:
+        logger.error("Unable to locate SectorObjects node!")
+        sys.exit()
+
+    sectorobjects = xmllargesave.find('SectorObjects')
+
+    #Big loop through entity list
+    report.Phase("sector_objects", entities=len(sectorobjects))
+    logger.info("===Beginning SectorObject check...===")
+
+    #Mark then compact. Every entity gets its decision first (DecideSectorObject still looks at the removal stuff before
+    #   the modify stuff, ApplyDecision then does it) and the kept ones are compacted once at the end, see
+    #   CompactSectorObjects & WriteEntityRecords. Removing as we go meant a search and a shift of the whole list for
+    #   every single floating ore, which gets very slow on a big cleanup
+    #Jointed grids are checked as a whole cluster, the first time any part of the cluster comes up
+    clustermap = {}
+    if args.map_joints:
+        logger.info("Mapping rotor & piston joints...")
+        clustermap = MapObjectClusters(sectorobjects)
+
+    #One unit per entity, or per cluster for jointed grids
+    units = []
+    keepobject = {}
+    dirtyobjects = set() #Kept entities that have been changed, see CompactSectorObjects
+    for obj in sectorobjects:
+        if obj in keepobject: #Already part of a cluster
+            continue
+        if obj in clustermap:
+            units.append(clustermap[obj])
+        else:
+            units.append(([obj], False))
+        for o in units[-1][0]:
+            keepobject[o] = True
+
+    #Grids that haven't changed since the last run are decided by the cache, hashed straight from the file
+    cache = OpenDecisionCache(args)
+    entitysources = EntitySources(largesavefilepath, sectorobjects) if cache is not None else None
+
+    if args.jobs > 1:
+        #Work out what to do in worker processes first, then do it all here
+        decisions = ClassifyInParallel(largesavefilepath, sectorobjects, units, args, cache, entitysources)
+        for (objectcluster, jointsmapped), decision in zip(units, decisions):
+            keep = ApplyDecision(objectcluster, decision, owningplayers, dirtyobjects)
+            for o in objectcluster:
+                keepobject[o] = keep
+    else:
+        for objectcluster, jointsmapped in units:
+            decision = CachedDecision(cache, objectcluster, args, jointsmapped, entitysources.Get(objectcluster) if entitysources is not None else None)
+            keep = ApplyDecision(objectcluster, decision, owningplayers, dirtyobjects)
+            for o in objectcluster:
+                keepobject[o] = keep
+
+    if entitysources is not None:
+        entitysources.Close()
+    CloseDecisionCache(cache)
+
+    keptobjects = [obj for obj in sectorobjects if keepobject[obj]]
+    logger.info("Removing %d of %d entities", len(sectorobjects) - len(keptobjects), len(sectorobjects))
+    runsummary["entities"] = len(sectorobjects)
+    runsummary["removed_entities"] = len(sectorobjects) - len(keptobjects)
+    originalobjects = list(sectorobjects) #In the order they are in the file, for CompactSectorObjects
+    sectorobjects[:] = keptobjects
+
+    for obj in keptobjects:
+        CollectAsteroidInfo(obj, asteroids, avoidents)
+    report.Count(blocks=tally["Blocks checked"], blocks_skipped=tally["Blocks skipped"])
+
+    #Everything left to do with the large save is in the EntityRecords, so all of its XML goes as soon as this returns
+    if args.whatif:
+        return None, None
+    entityrecords = CompactSectorObjects(largesavefilepath, originalobjects, keepobject, dirtyobjects)
+    if entityrecords is None: #The file doesn't line up with what was loaded, keep the lot to write it out whole
+        return None, xmllargesave
+    return entityrecords, None
+
+#Function to go through the SectorObjects entities of a save one at a time without loading the whole thing
+#Each entity is thrown away as soon as the next one is asked for, so keep what's needed from it rather than the node
+def IterSectorObjects(largesavefilepath):
+    depth = 0
+    sectorobjects = None
+    for event, node in IterParseXML(largesavefilepath, ("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 2 and node.tag == "SectorObjects":
+                sectorobjects = node
+            continue
+
+        depth -= 1
+        if depth == 2 and sectorobjects is not None: #Finished reading an entity
+            yield node
+            node.clear()
+            sectorobjects.remove(node)
+        elif depth == 1:
+            if node is sectorobjects:
+                return #Nothing else in the file is wanted
+            node.clear()
+
+
+#########################################
+### Compact Records #####################
+#########################################
+
+#What's kept about the save from one phase of a run to the next, instead of holding on to its XML. Each record has
+#   __slots__, so it's a few dozen bytes instead of a dict. Positions & offsets are packed into arrays of numbers and
+#   names that come up over and over (entity types) are stored once in a NameTable and referred to by a small int
+#The XML is only looked at again to write the saves out
+
+#Stores each distinct name once & gives it a small int code, in the order they were first seen
+class NameTable:
+    __slots__ = ("codes", "names")
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def Code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.codes[name] = code
+            self.names.append(name)
+        return code
+
+    def Name(self, code):
+        return self.names[code]
+
+    def __len__(self):
+        return len(self.names)
+
+
+entitytypes = NameTable() #xsi:type of SectorObjects entities (what FindAttrib gives), see EntityIndex
+
+
+#A list of (x, y, z) positions, packed one after the other into a single array of doubles
+class PositionArray:
+    __slots__ = ("values",)
 
-        #Made it to the end without removing object, go to the next item
-        i += 1
+    def __init__(self):
+        self.values = array.array('d')
 
-    #End SectorObjects loop
+    def Append(self, pos):
+        self.values.extend(pos)
+
+    def __len__(self):
+        return len(self.values) // 3
+
+    def __getitem__(self, i):
+        return tuple(self.values[i * 3:i * 3 + 3])
+
+    def __iter__(self):
+        values = self.values
+        for i in range(0, len(values), 3):
+            yield (values[i], values[i + 1], values[i + 2])
+
+
+#The voxel file name & position of each asteroid, goes through as (name, (x, y, z)) pairs
+class AsteroidRecords:
+    __slots__ = ("names", "positions")
+
+    def __init__(self):
+        self.names = []
+        self.positions = PositionArray()
+
+    def Append(self, name, pos):
+        self.names.append(name)
+        self.positions.Append(pos)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return zip(self.names, self.positions)
+
+
+#The entity index (see IndexLargeSave) packed into arrays, goes through the same (offset, length, xsi:type, EntityId,
+#   x, y, z) entries. Missing positions are NaN in the array & None again on the way out
+class EntityIndex:
+    __slots__ = ("offsets", "lengths", "typecodes", "entityids", "positions")
+
+    def __init__(self, entries):
+        self.offsets = array.array('q')
+        self.lengths = array.array('q')
+        self.typecodes = array.array('i')
+        self.entityids = []
+        self.positions = PositionArray()
+        for offset, length, entitytype, entityid, x, y, z in entries:
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.typecodes.append(entitytypes.Code(entitytype))
+            self.entityids.append(entityid)
+            self.positions.Append((math.nan, math.nan, math.nan) if x is None else (x, y, z))
+
+    def __len__(self):
+        return len(self.entityids)
+
+    def __iter__(self):
+        for offset, length, typecode, entityid, (x, y, z) in zip(self.offsets, self.lengths, self.typecodes, self.entityids, self.positions):
+            if math.isnan(x):
+                x, y, z = None, None, None
+            yield offset, length, entitytypes.Name(typecode), entityid, x, y, z
+
+
+#What to write out for an entity of a loaded large save, once its XML has been let go. See CompactSectorObjects
+#output is the same as for WriteSplicedSave; True to copy it from the old save, None if it's removed or its new bytes
+class EntityRecord:
+    __slots__ = ("entityid", "output")
+
+    def __init__(self, entityid, output):
+        self.entityid = entityid
+        self.output = output
+
+
+#Function to turn the entities of a loaded large save into EntityRecords, serialising the ones that changed
+#originalobjects is every entity in the order they're in the file, keepobject says if each one is staying and
+#   dirtyobjects are the kept ones that were changed
+#Gives None if the file doesn't line up with originalobjects, the whole tree has to be written out then
+def CompactSectorObjects(largesavefilepath, originalobjects, keepobject, dirtyobjects):
+    spans = ScanEntitySpans(largesavefilepath)
+    if len(spans) == 0:
+        return None
+
+    with open(largesavefilepath, "rb") as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if not SpansMatchObjects(data, spans, originalobjects):
+                return None
+
+    records = []
+    for obj in originalobjects:
+        if not keepobject[obj]:
+            output = None
+        elif obj in dirtyobjects:
+            output = ElementBytes(obj, senamespaces) #The same as SaveWriter would write it
+        else:
+            output = True
+        records.append(EntityRecord(obj.findtext('EntityId'), output))
+    return records
+
+
+#Function to write the large save from its EntityRecords, copying everything that wasn't changed from the save on disk
+#Returns False without writing anything if the save on disk isn't the one the records were made from
+def WriteEntityRecords(writer, largesavefilepath, records):
+    spans = ScanEntitySpans(largesavefilepath)
+    with open(largesavefilepath, "rb") as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if not SpansMatchEntityIds(data, spans, [record.entityid for record in records]):
+                return False
+            WriteSplicedSave(writer, data, spans, [record.output for record in records])
+    return True
+
+
+#What the player check needs to know about each player in AllPlayers
+class PlayerRecord:
+    __slots__ = ("playerid", "name", "isdead", "infaction")
+
+    def __init__(self, playerid, name, isdead, infaction):
+        self.playerid = playerid
+        self.name = name
+        self.isdead = isdead
+        self.infaction = infaction
+
+
+#Function to get a PlayerRecord for every player in a PlayerFactionIndex
+def PlayerRecords(playerfactionindex):
+    return [PlayerRecord(playerID, player.findtext('Name'), player.findtext('IsDead') == 'true', playerfactionindex.FindPlayerFaction(playerID) is not None)
+            for playerID, player in playerfactionindex.players.items()]
+
+
+#########################################
+### Saving ##############################
+#########################################
+
+#The namespaces Space Engineers puts on the root node of its saves, in its order. It gets upset if they're not there
+senamespaces = [("xsd", "http://www.w3.org/2001/XMLSchema"), ("xsi", "http://www.w3.org/2001/XMLSchema-instance")]
+savebuffersize = 4 * 1024 * 1024 #Saves are written out this much at a time
+
+
+#Function to make the XML declaration & root start tag of a save, exactly how Space Engineers writes them
+#Any namespaces in nsdecls that SE doesn't normally have are put on the end
+def SaveHeader(root, nsdecls=()):
+    header = '<?xml version="1.0"?>\n<' + root.tag
+    for prefix, uri in senamespaces + [decl for decl in nsdecls if decl not in senamespaces]:
+        header += ' xmlns:%s="%s"' % (prefix, uri) if prefix != "" else ' xmlns="%s"' % uri
+    for key, value in root.attrib.items():
+        if not key.startswith("xmlns"): #Namespaces are already done
+            header += ' %s=%s' % (key, quoteattr(value))
+    return (header + ">").encode('ascii', 'xmlcharrefreplace')
+
+
+#Function to serialise a child of the root or an entity the way SaveWriter writes it, without its tail (the whitespace after it)
+#nsdecls are the namespaces declared on the root of the save it's going in, see SaveWriter
+def ElementBytes(node, nsdecls):
+    tail = node.tail
+    node.tail = None
+    data = EntityToBytes(node, nsdecls)
+    node.tail = tail
+    return data
+
+
+#Writes a save out the way Space Engineers writes them, to a temp file beside the real one through a big buffer
+#Nothing on disk changes until Commit swaps the temp file in. Abort throws it away
+class SaveWriter:
+    def __init__(self, filepath, nsdecls=()):
+        self.filepath = filepath
+        self.temppath = filepath + ".semu-tmp"
+        self.nsdecls = senamespaces + [decl for decl in nsdecls if decl not in senamespaces]
+        self.out = open(self.temppath, "wb", buffering=savebuffersize)
+
+    def Write(self, data):
+        self.out.write(data)
+
+    def WriteHeader(self, root):
+        self.out.write(SaveHeader(root, self.nsdecls))
+
+    #Write a child of the root or an entity, without its tail (the whitespace after it)
+    def WriteElement(self, node):
+        self.out.write(ElementBytes(node, self.nsdecls))
+
+    #Write a whole save from its root node
+    def WriteTree(self, root):
+        self.WriteHeader(root)
+        if root.text is not None:
+            self.out.write(escape(root.text).encode('ascii', 'xmlcharrefreplace'))
+        for node in root:
+            self.WriteElement(node)
+            if node.tail is not None:
+                self.out.write(escape(node.tail).encode('ascii', 'xmlcharrefreplace'))
+        self.out.write(("</%s>" % root.tag).encode('ascii'))
+
+    def Commit(self):
+        self.out.flush()
+        os.fsync(self.out.fileno()) #Make sure it's really on the disk before it replaces the old save
+        self.out.close()
+        os.replace(self.temppath, self.filepath)
+
+    def Abort(self):
+        self.out.close()
+        if os.path.isfile(self.temppath):
+            os.remove(self.temppath)
+
+
+#Function to check that the entity spans from ScanEntitySpans are the entities in objects, in the same order
+#Each one just has to have the same EntityId in it, it's only there to make sure nothing's out of step
+def SpansMatchObjects(data, spans, objects):
+    return SpansMatchEntityIds(data, spans, [obj.findtext('EntityId') for obj in objects])
+
+
+#Same as SpansMatchObjects, going by the EntityId of each one
+def SpansMatchEntityIds(data, spans, entityids):
+    if len(spans) != len(entityids):
+        return False
+    for (offset, length), entityid in zip(spans, entityids):
+        if entityid is None or data.find(b"<EntityId>" + entityid.encode('ascii') + b"</EntityId>", offset, offset + length) < 0:
+            return False
+    return True
+
+
+#Function to write out a save made from the one on disk (data, the whole file) with some of its entities swapped out
+#spans are the (offset, length) of each entity, outputs says what to write for each one in order; True to copy it
+#   as it is, None to leave it out, or an element or the bytes of one (see ElementBytes) to write in its place.
+#   outputs can be a generator, it's only gone through once, in step with the writing
+#The root start tag is swapped for a proper SE one, everything that isn't an entity is copied as it is
+def WriteSplicedSave(writer, data, spans, outputs):
+    rootstart = data.find(b"<")
+    while data[rootstart + 1:rootstart + 2] in (b"?", b"!"): #Skip the XML declaration & any comments
+        rootstart = data.find(b"<", rootstart + 1)
+    previous = data.find(b">", rootstart) + 1
+    roottag = data[rootstart + 1:previous - 1].split()[0].rstrip(b"/")
+    writer.WriteHeader(ET.fromstring(data[rootstart:previous] + b"</" + roottag + b">"))
+
+    for (offset, length), output in zip(spans, outputs):
+        gap = data[previous:offset] #Whitespace between entities, or everything before SectorObjects' first entity
+        previous = offset + length
+        if output is None:
+            writer.Write(gap.rstrip(b" \t\r\n")) #Drop its whitespace with it
+            continue
+
+        writer.Write(gap)
+        if output is True:
+            writer.Write(data[offset:offset + length])
+        elif isinstance(output, bytes):
+            writer.Write(output)
+        else:
+            writer.WriteElement(output)
+
+    writer.Write(data[previous:])
+
+
+#########################################
+### Backups #############################
+#########################################
+
+#Backups go into a chunk store in the save folder instead of being whole copies of the save files
+#The files are cut into chunks where an entity or block ends (see FindChunkBoundaries) and each chunk is stored once,
+#   named by its hash. A backup is just a manifest listing the chunks of each file, so anything that hasn't changed since
+#   the last backup takes up no extra room at all, and a save that hasn't changed at all isn't even read
+backupfoldername = "semu-backups"
+backupminchunk = 64 * 1024 #Chunks are at least this big
+backupmaxchunk = 1024 * 1024 #Cut at the next tag after this, content or not
+backuphardchunk = 4 * 1024 * 1024 #Cut here no matter what, for files without any tags
+backupchunkmask = 7 #1 in 8 tag ends is a chunk boundary, once past the minimum
+backupwindow = 256 #How many bytes before a tag end decide if it's a boundary
+
+
+#Function to cut a file's contents into chunks. data is anything that can be sliced & searched (bytes, mmap)
+#Boundaries are only ever put right after a closing </MyObjectBuilder_...> tag and picked by a checksum of the bytes
+#   just before it, so they depend on what's in the save rather than where it is. Removing or adding a grid only changes
+#   the chunks around it, everything after it still lines up with the last backup
+#Yields (start, end) offsets
+def FindChunkBoundaries(data):
+    size = len(data)
+    start = 0
+    while start < size:
+        limit = min(size, start + backuphardchunk)
+        cut = limit
+        searchfrom = start + backupminchunk
+        while searchfrom < limit:
+            tag = data.find(b"</MyObjectBuilder_", searchfrom, limit)
+            if tag < 0:
+                break
+            end = data.find(b">", tag, limit)
+            if end < 0:
+                break
+            end += 1
+            if end - start >= backupmaxchunk or zlib.crc32(data[max(start, end - backupwindow):end]) & backupchunkmask == 0:
+                cut = end
+                break
+            searchfrom = end
+        yield start, cut
+        start = cut
+
+
+#Function to write a file so that it's either all there or not there at all, for anything a crash halfway through would ruin
+def WriteFileAtomic(filepath, data):
+    temppath = filepath + ".semu-tmp"
+    with open(temppath, "wb") as outfile:
+        outfile.write(data)
+    os.replace(temppath, filepath)
+
+
+#The chunk store & its backups for a single save folder
+#semu-backups/chunks/<first 2 of hash>/<hash> are the chunks, semu-backups/manifests/<timestamp>.json the backups
+#New chunks are compressed with codec, and get its extension on the end. Chunks already in the store are used however
+#   they were compressed, so changing the codec doesn't mean starting the store again
+class BackupStore:
+    def __init__(self, savedir, codec="none", level=None):
+        self.backupdir = os.path.join(savedir, backupfoldername)
+        self.chunkdir = os.path.join(self.backupdir, "chunks")
+        self.manifestdir = os.path.join(self.backupdir, "manifests")
+        self.codec = codec
+        self.level = level
+
+    def ChunkPath(self, chunkhash, codec="none"):
+        return os.path.join(self.chunkdir, chunkhash[:2], chunkhash + compressionextensions[codec])
+
+    #Returns (path, codec) of a chunk that's in the store, or (None, None)
+    def FindChunk(self, chunkhash):
+        for codec in compressionextensions:
+            chunkpath = self.ChunkPath(chunkhash, codec)
+            if os.path.isfile(chunkpath):
+                return chunkpath, codec
+        return None, None
+
+    #Backups, oldest first
+    def ListBackups(self):
+        if not os.path.isdir(self.manifestdir):
+            return []
+        return sorted(filename[:-len(".json")] for filename in os.listdir(self.manifestdir) if filename.endswith(".json"))
+
+    def LoadManifest(self, timestamp):
+        with open(os.path.join(self.manifestdir, timestamp + ".json")) as manifestfile:
+            return json.load(manifestfile)
+
+    #Put a chunk in the store if it's not there already. Returns its hash & whether it was new
+    def StoreChunk(self, data):
+        chunkhash = hashlib.sha256(data).hexdigest()
+        if self.FindChunk(chunkhash)[0] is not None:
+            return chunkhash, False
+
+        chunkpath = self.ChunkPath(chunkhash, self.codec)
+        if not os.path.isdir(os.path.dirname(chunkpath)):
+            os.makedirs(os.path.dirname(chunkpath))
+        temppath = chunkpath + ".semu-tmp"
+        with OpenCompressed(temppath, "wb", self.codec, self.level) as chunkfile:
+            chunkfile.write(data)
+        os.replace(temppath, chunkpath)
+        return chunkhash, True
+
+    #Chunk a single file into the store. Returns its manifest entry & a Counter of what was done
+    def StoreFile(self, filepath):
+        stats = collections.Counter()
+        filehash = hashlib.sha256()
+        chunks = []
+
+        with open(filepath, "rb") as infile:
+            size = os.fstat(infile.fileno()).st_size
+            if size > 0:
+                with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for start, end in FindChunkBoundaries(data):
+                        chunk = data[start:end]
+                        filehash.update(chunk)
+                        chunkhash, new = self.StoreChunk(chunk)
+                        chunks.append([chunkhash, end - start])
+                        stats["chunks"] += 1
+                        if new:
+                            stats["newchunks"] += 1
+                            stats["bytesstored"] += end - start
+                        stats["bytesread"] += end - start
+
+        stat = os.stat(filepath)
+        entry = {"size": size, "mtime_ns": stat.st_mtime_ns, "sha256": filehash.hexdigest(), "chunks": chunks}
+        return entry, stats
+
+    #Back up the given files as a new timestamped backup. Files that are the same size & age as in the last backup aren't
+    #   even read, they just point at the same chunks
+    #With keepall the backup is marked to be kept. Without it, the older backups that weren't are dropped afterwards
+    #Returns the new backup's timestamp & a Counter of what was done
+    def Backup(self, filepaths, keepall=False):
+        stats = collections.Counter()
+        backups = self.ListBackups()
+        lastmanifest = self.LoadManifest(backups[-1]) if len(backups) > 0 else {"files": {}}
+
+        manifest = {"version": 1, "created": datetime.datetime.now().isoformat(), "keep": keepall, "files": {}}
+        for filepath in filepaths:
+            filename = os.path.basename(filepath)
+            stat = os.stat(filepath)
+            lastentry = lastmanifest["files"].get(filename)
+            if lastentry is not None and lastentry["size"] == stat.st_size and lastentry["mtime_ns"] == stat.st_mtime_ns \
+                    and all(self.FindChunk(chunkhash)[0] is not None for chunkhash, length in lastentry["chunks"]):
+                manifest["files"][filename] = lastentry
+                stats["unchanged"] += 1
+                continue
+
+            manifest["files"][filename], filestats = self.StoreFile(filepath)
+            stats.update(filestats)
+
+        if not os.path.isdir(self.manifestdir):
+            os.makedirs(self.manifestdir)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        while timestamp in backups: #More than one a second
+            timestamp = timestamp + "a"
+        WriteFileAtomic(os.path.join(self.manifestdir, timestamp + ".json"), json.dumps(manifest, indent=1).encode("utf-8"))
+
+        if not keepall:
+            for oldtimestamp in backups:
+                if not self.IsKept(self.LoadManifest(oldtimestamp)):
+                    os.remove(os.path.join(self.manifestdir, oldtimestamp + ".json"))
+            stats["chunksremoved"] = self.RemoveUnusedChunks()
+
+        return timestamp, stats
+
+    #Was a backup made with --big-backup? Ones from before backups were marked don't say, they're kept to be safe
+    def IsKept(self, manifest):
+        return manifest.get("keep", True)
+
+    #Delete any chunks that no backup uses any more. Returns how many were deleted
+    def RemoveUnusedChunks(self):
+        used = set()
+        for timestamp in self.ListBackups():
+            for entry in self.LoadManifest(timestamp)["files"].values():
+                used.update(chunkhash for chunkhash, length in entry["chunks"])
+
+        removed = 0
+        if not os.path.isdir(self.chunkdir):
+            return removed
+        for folder in os.listdir(self.chunkdir):
+            for chunkfilename in os.listdir(os.path.join(self.chunkdir, folder)):
+                if chunkfilename.split(".")[0] not in used: #Hash without the codec's extension
+                    os.remove(os.path.join(self.chunkdir, folder, chunkfilename))
+                    removed += 1
+        return removed
+
+    #Put the files from a backup back into the save folder, checking they come out exactly as they were backed up
+    #Each file is rebuilt beside the real one and swapped in, so a missing chunk can't leave half a save behind
+    def Restore(self, timestamp, savedir):
+        manifest = self.LoadManifest(timestamp)
+        for filename, entry in manifest["files"].items():
+            filepath = os.path.join(savedir, filename)
+            temppath = filepath + ".semu-tmp"
+            filehash = hashlib.sha256()
+            with open(temppath, "wb") as outfile:
+                for chunkhash, length in entry["chunks"]:
+                    chunkpath, codec = self.FindChunk(chunkhash)
+                    if chunkpath is None:
+                        os.remove(temppath)
+                        raise ValueError("Backup %s of %s is missing chunk %s" % (timestamp, filename, chunkhash))
+                    with OpenCompressed(chunkpath, "rb", codec) as chunkfile:
+                        chunk = chunkfile.read()
+                    filehash.update(chunk)
+                    outfile.write(chunk)
+
+            if filehash.hexdigest() != entry["sha256"]:
+                os.remove(temppath)
+                raise ValueError("Backup %s of %s is damaged, it doesn't match what was backed up" % (timestamp, filename))
+            os.replace(temppath, filepath)
+            logger.info("Restored %s from backup %s", filename, timestamp)
+
+
+#Function to back up the save files before a run changes them, see BackupStore
+def BackupSaves(args, savefilepaths, report):
+    report.Phase("backup", bytes=sum(os.path.getsize(path) for path in savefilepaths))
+    logger.info("Saving backups...")
+    #Only the parts of the saves that changed since the last backup take up any room, see BackupStore
+    backupstore = BackupStore(args.save_path, args.compress, args.compress_level)
+    timestamp, backupstats = backupstore.Backup(savefilepaths, keepall=args.big_backup)
+    logger.info("Saved backup %s, %d of %d chunks were new (%.1f MB), %d files unchanged since the last backup",
+                timestamp, backupstats["newchunks"], backupstats["chunks"], backupstats["bytesstored"] / (1024.0 * 1024), backupstats["unchanged"])
+    report.Count(bytes_read=backupstats["bytesread"], bytes_stored=backupstats["bytesstored"])
+
+
+#Function for --list-backups & --restore-backup, instead of doing any maintenance
+def RunBackupCommand(args):
+    backupstore = BackupStore(args.save_path)
+    backups = backupstore.ListBackups()
+
+    if args.list_backups:
+        if len(backups) == 0:
+            logger.info("No backups in %s", backupstore.backupdir)
+        for timestamp in backups:
+            manifest = backupstore.LoadManifest(timestamp)
+            logger.info("%s%s  %s", timestamp, "  kept" if backupstore.IsKept(manifest) else "", ", ".join("%s %.1f MB" % (filename, entry["size"] / (1024.0 * 1024)) for filename, entry in sorted(manifest["files"].items())))
+        return
+
+    timestamp = args.restore_backup
+    if timestamp == "latest" and len(backups) > 0:
+        timestamp = backups[-1]
+    if timestamp not in backups:
+        logger.error("No backup called %s, use --list-backups to see them", timestamp)
+        sys.exit()
+    backupstore.Restore(timestamp, args.save_path)
+
+
+#########################################
+### Decision Cache ######################
+#########################################
+
+#CubeGrid decisions are cached in semu-cache/decisions.sqlite in the save folder, so grids that haven't changed since
+#   the last run don't need checking again. Rows are keyed by the EntityId of the grid (the first one, for a cluster)
+#   and the fingerprint of the RulePlan it was decided with, and are only used if the hash of the grid's XML still matches
+#Each row remembers the last run it was used in, the least recently used ones are thrown out past --cache-size rows
+cachefoldername = "semu-cache"
+decisioncacheversion = 2 #Bump whenever a change to the checks would decide something differently
+
+
+#Function to hash the XML of an object cluster for the decision cache. sources is the bytes of each entity in it
+def DecisionDigest(sources, jointsmapped=False):
+    digest = hashlib.blake2b(digest_size=16)
+    for source in sources:
+        digest.update(len(source).to_bytes(8, "little"))
+        digest.update(source)
+    digest.update(b"J" if jointsmapped else b"-")
+    return digest.digest()
+
+
+class DecisionCache:
+    def __init__(self, savedir, plan, maxentries=100000):
+        self.savedir = savedir
+        self.path = os.path.join(savedir, cachefoldername, "decisions.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.plan = plan.Fingerprint()
+        self.maxentries = maxentries
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or version[0] != str(decisioncacheversion):
+            self.db.execute("DROP TABLE IF EXISTS decisions")
+        self.db.execute("CREATE TABLE IF NOT EXISTS decisions (entityid TEXT NOT NULL, plan TEXT NOT NULL, digest BLOB NOT NULL, "
+                        "decision TEXT NOT NULL, lastrun INTEGER NOT NULL, PRIMARY KEY (entityid, plan))")
+        self.StartRun()
+
+    #Start counting for the next run. --watch keeps the cache open & calls this again for every run
+    def StartRun(self):
+        self.hits = 0
+        self.misses = 0
+        self.used = [] #Rows that were used, their lastrun is updated on Flush
+        self.stored = [] #Rows to write on Flush
+        run = self.db.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+        self.run = int(run[0]) + 1 if run is not None else 1
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?), ('run', ?)", (str(decisioncacheversion), str(self.run)))
+        self.db.commit()
+
+    #Get the cached EntityDecision for an entity if its XML hasn't changed since, or None
+    def Find(self, entityid, digest):
+        row = self.db.execute("SELECT digest, decision FROM decisions WHERE entityid = ? AND plan = ?", (entityid, self.plan)).fetchone()
+        if row is None or row[0] != digest:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.used.append((self.run, entityid, self.plan))
+        detaillogger.info("Entity unchanged since the last run: %s", entityid)
+        packed = json.loads(row[1])
+        decision = EntityDecision(entityid, packed["keep"], packed["reason"], tuple(packed["reasonargs"]), packed["category"], packed["owners"],
+                                  [tuple(mutation) for mutation in packed["mutations"]])
+        decision.blocks = packed["blocks"]
+        decision.blocksskipped = packed["blocksskipped"]
+        return decision
+
+    def Store(self, entityid, digest, decision):
+        packed = {"keep": decision.keep, "reason": decision.reason, "reasonargs": list(decision.reasonargs), "category": decision.category,
+                  "owners": decision.owners, "mutations": decision.mutations, "blocks": decision.blocks, "blocksskipped": decision.blocksskipped}
+        self.stored.append((entityid, self.plan, digest, json.dumps(packed), self.run))
+
+    #Write everything out and throw out the least recently used rows if there's too many
+    def Flush(self):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?)", self.stored)
+            self.db.executemany("UPDATE decisions SET lastrun = ? WHERE entityid = ? AND plan = ?", self.used)
+            count = self.db.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+            if count > self.maxentries:
+                self.db.execute("DELETE FROM decisions WHERE rowid IN (SELECT rowid FROM decisions ORDER BY lastrun LIMIT ?)", (count - self.maxentries,))
+        self.used = []
+        self.stored = []
+
+    def Close(self):
+        self.Flush()
+        self.db.close()
+
+
+#Function to decide what to do with an object cluster, using the cache for CubeGrids when there is one (see DecisionCache)
+#sources is the bytes of each entity in the cluster straight from the large save, if they're handy. Without them the
+#   cluster is checked as normal
+def CachedDecision(cache, objectcluster, args, jointsmapped=False, sources=None):
+    if cache is None or sources is None or FindAttrib(objectcluster[0]) != "MyObjectBuilder_CubeGrid":
+        return DecideSectorObject(objectcluster[0], args, objectcluster, jointsmapped)
+
+    entityid = objectcluster[0].findtext('EntityId')
+    digest = DecisionDigest(sources, jointsmapped)
+    decision = cache.Find(entityid, digest)
+    if decision is None:
+        decision = DecideSectorObject(objectcluster[0], args, objectcluster, jointsmapped)
+        cache.Store(entityid, digest, decision)
+    return decision
+
+
+#The bytes of each entity in a loaded SectorObjects, straight from the large save, for hashing them for the decision cache
+#Get gives None if the file doesn't line up with the entities (see SpansMatchObjects)
+class EntitySources:
+    def __init__(self, largesavefilepath, sectorobjects):
+        self.spans = {}
+        self.data = None
+        spans = ScanEntitySpans(largesavefilepath)
+        if len(spans) == 0:
+            return
+
+        with open(largesavefilepath, "rb") as fh:
+            self.data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if SpansMatchObjects(self.data, spans, sectorobjects):
+            self.spans = dict(zip(sectorobjects, spans))
+
+    def Get(self, objectcluster):
+        sources = []
+        for obj in objectcluster:
+            span = self.spans.get(obj)
+            if span is None:
+                return None
+            sources.append(self.data[span[0]:span[0] + span[1]])
+        return sources
+
+    def Close(self):
+        if self.data is not None:
+            self.data.close()
+
+
+#Decision caches kept open between runs by --watch, save folder -> DecisionCache. None when they're closed after each run
+keptcaches = None
+
+
+#Function to open the decision cache for a run, or None if it's turned off or can't be used
+#WhatIf doesn't use it, it would have to write to the save folder
+def OpenDecisionCache(args):
+    if args.no_cache or args.whatif:
+        return None
+    if keptcaches is not None and args.save_path in keptcaches:
+        cache = keptcaches[args.save_path]
+        cache.StartRun()
+        return cache
+    try:
+        cache = DecisionCache(args.save_path, GetRulePlan(args), args.cache_size)
+    except (OSError, sqlite3.Error) as err:
+        logger.warning("Unable to open the decision cache, checking every grid: %s", err)
+        return None
+    if keptcaches is not None:
+        keptcaches[args.save_path] = cache
+    return cache
+
+
+#Function to finish with the decision cache, logging how much it was used
+def CloseDecisionCache(cache):
+    if cache is None:
+        return
+    logger.info("Decision cache: %d grids unchanged since the last run, %d checked", cache.hits, cache.misses)
+    if cache.hits > 0:
+        tally["CubeGrids decided from cache"] += cache.hits
+    try:
+        if keptcaches is not None and keptcaches.get(cache.savedir) is cache:
+            cache.Flush()
+        else:
+            cache.Close()
+    except sqlite3.Error as err:
+        logger.warning("Unable to save the decision cache: %s", err)
+
+
+#########################################
+### Catalog #############################
+#########################################
+
+#--export-catalog writes what's in the save out to an SQLite database, semu-cache/catalog.sqlite, so questions about the
+#   world can be answered with --query without loading the save again. Names, owners & types are worked out the same
+#   way the cleanup does it (FindObjectName, GetClusterOwners, FindAttrib, GetFloatingItemName) so they match the log
+#The catalog remembers the size & age of the saves it was made from, --query makes it again if they've changed since
+catalogversion = 1
+catalogtables = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE entities (entityid TEXT, type TEXT NOT NULL, name TEXT, x REAL, y REAL, z REAL, blocks INTEGER NOT NULL,
+                       gridsize TEXT, isstatic INTEGER, amount REAL);
+CREATE TABLE blocks (entityid TEXT, type TEXT NOT NULL, subtype TEXT, count INTEGER NOT NULL);
+CREATE TABLE owners (entityid TEXT, playerid TEXT NOT NULL, blocks INTEGER NOT NULL);
+CREATE TABLE players (playerid TEXT PRIMARY KEY, name TEXT, isdead INTEGER, factionid TEXT);
+CREATE TABLE factions (factionid TEXT PRIMARY KEY, tag TEXT, name TEXT, members INTEGER NOT NULL);
+CREATE TABLE factionmembers (factionid TEXT NOT NULL, playerid TEXT NOT NULL, isleader INTEGER, isfounder INTEGER);
+"""
+catalogindexes = """
+CREATE INDEX entities_id ON entities (entityid);
+CREATE INDEX entities_type ON entities (type);
+CREATE INDEX blocks_entity ON blocks (entityid);
+CREATE INDEX blocks_type ON blocks (type, subtype);
+CREATE INDEX blocks_subtype ON blocks (subtype);
+CREATE INDEX owners_player ON owners (playerid);
+CREATE INDEX owners_entity ON owners (entityid);
+CREATE INDEX factionmembers_player ON factionmembers (playerid);
+"""
+
+#The reports --query knows by name, anything else given to it is run as SQL
+catalogqueries = collections.OrderedDict([
+    ("types", "SELECT type, COUNT(*) AS entities, SUM(blocks) AS blocks FROM entities GROUP BY type ORDER BY entities DESC"),
+    ("owners", "SELECT o.playerid, p.name, f.tag AS faction, COUNT(*) AS grids, SUM(o.blocks) AS blocks FROM owners o "
+               "LEFT JOIN players p ON p.playerid = o.playerid LEFT JOIN factions f ON f.factionid = p.factionid "
+               "GROUP BY o.playerid ORDER BY blocks DESC"),
+    ("grids", "SELECT entityid, name, blocks, gridsize, isstatic, x, y, z FROM entities WHERE type = 'MyObjectBuilder_CubeGrid' ORDER BY blocks DESC"),
+    ("refineries", "SELECT e.entityid, e.name, b.count AS refineries, e.x, e.y, e.z FROM blocks b JOIN entities e ON e.entityid = b.entityid "
+                   "WHERE b.type = 'MyObjectBuilder_Refinery' ORDER BY refineries DESC"),
+    ("floating", "SELECT name, COUNT(*) AS objects, SUM(amount) AS amount, AVG(x) AS x, AVG(y) AS y, AVG(z) AS z FROM entities "
+                 "WHERE type = 'MyObjectBuilder_FloatingObject' GROUP BY name ORDER BY objects DESC"),
+    ("factions", "SELECT factionid, tag, name, members FROM factions ORDER BY members DESC"),
+    ("players", "SELECT p.playerid, p.name, p.isdead, f.tag AS faction, COALESCE(SUM(o.blocks), 0) AS blocks FROM players p "
+                "LEFT JOIN factions f ON f.factionid = p.factionid LEFT JOIN owners o ON o.playerid = p.playerid "
+                "GROUP BY p.playerid ORDER BY blocks DESC"),
+])
+
+
+#Function to get the size & age of the saves a catalog would be made from, to tell if a catalog is out of date
+def CatalogSaveStamp(savefilepaths):
+    return json.dumps([[os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in savefilepaths])
+
+
+#Function to turn a "true" / "false" node's text into 1 / 0 for the catalog, None if it's not there
+def CatalogFlag(text):
+    return None if text is None else int(text == "true")
+
+
+#Function to write the catalog rows for a single SectorObjects entity
+def CatalogEntity(db, obj):
+    entitytype = FindAttrib(obj)
+    entityid = obj.findtext('EntityId')
+    position = obj.find('PositionAndOrientation/Position')
+    try:
+        x, y, z = PositionTuple(position) if position is not None else (None, None, None)
+    except (KeyError, ValueError):
+        x, y, z = None, None, None
+    name = None
+    amount = None
+    blockcount = 0
+
+    if entitytype == "MyObjectBuilder_CubeGrid":
+        summary = SummariseCluster([obj])
+        name = FindObjectName([obj], summary)
+        blocks = collections.Counter()
+        ownedblocks = collections.Counter()
+        for block in obj.find('CubeBlocks'):
+            blocks[(FindAttrib(block), block.findtext('SubtypeName'))] += 1
+            owner = block.findtext('Owner')
+            if owner is not None:
+                ownedblocks[owner] += 1
+            blockcount += 1
+        db.executemany("INSERT INTO blocks VALUES (?, ?, ?, ?)", [(entityid, blocktype, subtype, count) for (blocktype, subtype), count in blocks.items()])
+        db.executemany("INSERT INTO owners VALUES (?, ?, ?)", [(entityid, owner, ownedblocks[owner]) for owner in GetClusterOwners([obj], summary)])
+    elif entitytype == "MyObjectBuilder_FloatingObject":
+        try:
+            name = GetFloatingItemName(obj)
+        except AttributeError: #Not a normal item
+            name = ""
+        try:
+            amount = float(obj.findtext('Item/Amount'))
+        except (TypeError, ValueError):
+            pass
+    elif entitytype == "MyObjectBuilder_VoxelMap":
+        name = obj.findtext('Filename')
+    else:
+        name = obj.findtext('DisplayName')
+
+    db.execute("INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+               (entityid, entitytype, name, x, y, z, blockcount, obj.findtext('GridSizeEnum'), CatalogFlag(obj.findtext('IsStatic')), amount))
+
+
+#Function to write the catalog for a save folder in one pass over the large save, see catalogtables
+#It's written to a temp file that replaces the old catalog once it's done. Returns the number of entities
+def ExportCatalog(savedir, catalogpath):
+    smallsavefilepath = os.path.join(savedir, "Sandbox.sbc")
+    largesavefilepath = os.path.join(savedir, "SANDBOX_0_0_0_.sbs")
+    os.makedirs(os.path.dirname(catalogpath), exist_ok=True)
+    temppath = catalogpath + ".semu-tmp"
+    if os.path.isfile(temppath):
+        os.remove(temppath)
+
+    db = sqlite3.connect(temppath)
+    try:
+        db.executescript(catalogtables)
+        db.executemany("INSERT INTO meta VALUES (?, ?)", [("version", str(catalogversion)), ("saves", CatalogSaveStamp([smallsavefilepath, largesavefilepath])),
+                                                          ("exported", datetime.datetime.now().isoformat())])
+
+        #Players & factions, from the small save
+        playerfactions = PlayerFactionIndex(ParseXML(smallsavefilepath).getroot())
+        for playerID, player in playerfactions.players.items():
+            faction = playerfactions.FindPlayerFaction(playerID)
+            db.execute("INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?)",
+                       (playerID, player.findtext('Name'), CatalogFlag(player.findtext('IsDead')), faction.findtext('FactionId') if faction is not None else None))
+        for factionId, faction in playerfactions.factions.items():
+            db.execute("INSERT OR REPLACE INTO factions VALUES (?, ?, ?, ?)", (factionId, faction.findtext('Tag'), faction.findtext('Name'), len(playerfactions.GetFactionMembers(factionId))))
+            for member in faction.find('Members'):
+                db.execute("INSERT INTO factionmembers VALUES (?, ?, ?, ?)",
+                           (factionId, member.findtext('PlayerId'), CatalogFlag(member.findtext('IsLeader')), CatalogFlag(member.findtext('IsFounder'))))
+
+        #Everything in SectorObjects
+        entities = 0
+        for obj in IterSectorObjects(largesavefilepath):
+            CatalogEntity(db, obj)
+            entities += 1
+
+        db.executescript(catalogindexes)
+        db.commit()
+    except:
+        db.close()
+        os.remove(temppath)
+        raise
+    db.close()
+    os.replace(temppath, catalogpath)
+    return entities
+
+
+#Function to run a --query against the catalog, a name from catalogqueries or some SQL. Returns (column names, rows)
+#The catalog is opened read only, so the SQL can't change it
+def QueryCatalog(catalogpath, query):
+    sql = catalogqueries.get(query, query)
+    db = sqlite3.connect("file:%s?mode=ro" % catalogpath.replace("?", "%3f").replace("#", "%23"), uri=True)
+    try:
+        cursor = db.execute(sql)
+        columns = [column[0] for column in cursor.description] if cursor.description is not None else []
+        return columns, cursor.fetchall()
+    finally:
+        db.close()
+
+
+#Function to see if the catalog is there & was made from the saves as they are now
+def CatalogIsCurrent(savedir, catalogpath):
+    if not os.path.isfile(catalogpath):
+        return False
+    try:
+        db = sqlite3.connect(catalogpath)
+        try:
+            meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return False
+    return meta.get("version") == str(catalogversion) and \
+        meta.get("saves") == CatalogSaveStamp([os.path.join(savedir, "Sandbox.sbc"), os.path.join(savedir, "SANDBOX_0_0_0_.sbs")])
+
+
+#Function to do --export-catalog & --query
+def RunCatalogCommand(args):
+    savedir = args.save_path
+    catalogpath = os.path.join(savedir, cachefoldername, "catalog.sqlite")
+    for savefilename in ("Sandbox.sbc", "SANDBOX_0_0_0_.sbs"):
+        if not os.path.isfile(os.path.join(savedir, savefilename)):
+            logger.error("Unable to find save file: %s", savefilename)
+            sys.exit()
+
+    UseXMLBackend(args.xml_backend, stream=True)
+    if args.export_catalog or not CatalogIsCurrent(savedir, catalogpath):
+        logger.info("Writing the catalog of %s...", savedir)
+        starttime = time.perf_counter()
+        entities = ExportCatalog(savedir, catalogpath)
+        logger.info("Catalogued %d entities in %.1fs to %s", entities, time.perf_counter() - starttime, catalogpath)
+
+    if args.query == '':
+        return
+
+    try:
+        columns, rows = QueryCatalog(catalogpath, args.query)
+    except sqlite3.Error as err:
+        logger.error("Query failed: %s", err)
+        logger.info("Reports that can be asked for by name: %s", ", ".join(catalogqueries))
+        sys.exit()
+
+    #Straight to stdout, tab separated, so it can be piped into something else
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+    logger.info("%d rows", len(rows))
+
+
+#########################################
+### Change Plans ########################
+#########################################
+
+#With --whatif everything the run would change is written down in a plan, which --apply-plan can then do later without
+#   checking anything again. So the checks can be run and looked over whenever, and the save only has to be down for
+#   as long as it takes to write it out
+#Entities are keyed by EntityId, players by PlayerId & factions by FactionId. Block changes go by where the block is in
+#   its grid's CubeBlocks, which is only right for the exact save the plan was made from, so the size & sha256 of both
+#   save files are in the plan too and --apply-plan won't touch a save that doesn't match
+#Asteroid snapshots & respawns aren't planned, they depend on what's near each asteroid when it's done
+changeplanversion = 1
+changeplan = None #The ChangePlan being filled in by a --whatif run, see ApplyDecision
+
+
+#Function to get the size & sha256 of each save file, to tell if a plan was made from them
+def SaveChecksums(savefilepaths):
+    return dict((os.path.basename(path), {"size": os.path.getsize(path), "sha256": HashFile(path)}) for path in savefilepaths)
+
+
+class ChangePlan:
+    def __init__(self, saves):
+        self.saves = saves #See SaveChecksums
+        self.removeentities = {} #EntityId -> what it's counted as in the tally, "" for all but the first entity of a cluster
+        self.mutateentities = {} #EntityId -> list of [kind, index of the block in CubeBlocks], see ApplyMutations
+        self.removeplayers = []
+        self.removefactions = []
+        self.unkeyed = 0 #Entities with something to do to them but no EntityId to find them by
+
+    #Note down what an EntityDecision would do to an object cluster. An empty cluster is the entity the decision was
+    #   made for, without it having been parsed (see SpliceSectorObjects)
+    def AddDecision(self, objectcluster, decision):
+        entityids = [obj.findtext('EntityId') for obj in objectcluster] if len(objectcluster) > 0 else [decision.entityid]
+        if not decision.keep:
+            category = decision.category #Counted once for the whole cluster, same as ApplyDecision does
+            for entityid in entityids:
+                if entityid is None:
+                    self.unkeyed += 1
+                else:
+                    self.removeentities[entityid] = category
+                    category = ""
+            return
+
+        for kind, gridindex, blockindex in decision.mutations:
+            entityid = entityids[gridindex]
+            if entityid is None:
+                self.unkeyed += 1
+            else:
+                self.mutateentities.setdefault(entityid, []).append([kind, blockindex])
+
+    #Write the plan to filepath, or next to the log if there isn't one. Returns the path it was written to
+    def Write(self, filepath=None):
+        if filepath is None:
+            if logfilename is not None:
+                filepath = os.path.splitext(logfilename)[0] + ".plan.json"
+            else:
+                filepath = os.path.join("./semu_logs/", '{0}.plan.json'.format(datetime.datetime.now().strftime("%Y%m%d_%H%M")))
+        if os.path.dirname(filepath) != "":
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        plan = {"version": changeplanversion,
+                "created": datetime.datetime.now().isoformat(),
+                "saves": self.saves,
+                "remove_entities": self.removeentities,
+                "mutate_entities": self.mutateentities,
+                "remove_players": self.removeplayers,
+                "remove_factions": self.removefactions}
+        WriteFileAtomic(filepath, json.dumps(plan, indent=1).encode('utf-8'))
+        return filepath
+
+
+#Function to load a plan written by ChangePlan.Write. Gives None if it's not a plan this version can do
+def LoadChangePlan(filepath):
+    try:
+        with open(filepath, encoding='utf-8') as planfile:
+            plan = json.load(planfile)
+    except (OSError, ValueError) as err:
+        logger.error("Unable to read the plan: %s", err)
+        return None
+    if not isinstance(plan, dict) or plan.get("version") != changeplanversion:
+        logger.error("%s isn't a version %d plan, make it again with --whatif", filepath, changeplanversion)
+        return None
+    return plan
+
+
+#Function to write the large save with a plan's entity removals & block changes done to it. Goes by the entity index,
+#   only the entities with blocks to change are parsed and everything else is copied straight across
+#Returns (entities, entities removed, entities changed)
+def ApplyPlanToLargeSave(largesavefilepath, plan):
+    removeentities = plan["remove_entities"]
+    mutateentities = plan["mutate_entities"]
+    index = LoadEntityIndex(largesavefilepath)
+    nsdecls = ReadRootNamespaces(largesavefilepath)
+    for prefix, uri in nsdecls:
+        if prefix != "":
+            ET.register_namespace(prefix, uri)
+    counts = collections.Counter()
+
+    def EntityOutputs(data):
+        for offset, length, entitytype, entityid, x, y, z in index:
+            if entityid in removeentities:
+                counts["removed"] += 1
+                detaillogger.info("Removing entity: %s", entityid)
+                if removeentities[entityid] != "":
+                    tally[removeentities[entityid]] += 1
+                yield None
+            elif entityid in mutateentities:
+                counts["changed"] += 1
+                obj = ParseEntityBytes(data[offset:offset + length], nsdecls)
+                ApplyMutations([obj], [(kind, 0, blockindex) for kind, blockindex in mutateentities[entityid]])
+                yield obj
+            else:
+                yield True
+
+    writer = SaveWriter(largesavefilepath)
+    try:
+        with open(largesavefilepath, "rb") as fh:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                WriteSplicedSave(writer, data, [(entry[0], entry[1]) for entry in index], EntityOutputs(data))
+        writer.Commit()
+    except:
+        writer.Abort()
+        raise
+
+    return len(index), counts["removed"], counts["changed"]
+
+
+#Function to do --apply-plan, making the changes a --whatif run planned without checking anything again
+def RunApplyPlan(args):
+    smallsavefilepath, largesavefilepath = FindSaveFiles(args)
+
+    runsummary = {"save": args.save_path, "entities": 0, "removed_entities": 0, "removed_players": 0, "removed_factions": 0}
+    starttime = datetime.datetime.now()
+    detaillogger.setLevel(logging.WARNING if args.quiet else logging.NOTSET)
+    tally.clear()
+    report = RunReport(args.trace_memory)
+    UseXMLBackend(args.xml_backend, stream=True) #Only ever parses single entities & the small save
+
+    smallsavefilename = os.path.basename(smallsavefilepath)
+    largesavefilename = os.path.basename(largesavefilepath)
+    savesizes = {smallsavefilename: os.path.getsize(smallsavefilepath), largesavefilename: os.path.getsize(largesavefilepath)}
+
+    plan = LoadChangePlan(args.apply_plan)
+    if plan is None:
+        sys.exit()
+
+    #Only the save the plan was made from will do
+    report.Phase("verify_plan", bytes=savesizes[smallsavefilename] + savesizes[largesavefilename])
+    logger.info("Checking the save is the one the plan was made from...")
+    for savefilepath in (smallsavefilepath, largesavefilepath):
+        planned = plan["saves"].get(os.path.basename(savefilepath))
+        if planned is None or planned["size"] != os.path.getsize(savefilepath) or planned["sha256"] != HashFile(savefilepath):
+            logger.error("%s has changed since the plan was made (%s), make a new one with --whatif", os.path.basename(savefilepath), plan["created"])
+            sys.exit()
+
+    logger.info("===Applying plan from %s: %d entities to remove, %d to change, %d players & %d factions to remove===", plan["created"],
+                len(plan["remove_entities"]), len(plan["mutate_entities"]), len(plan["remove_players"]), len(plan["remove_factions"]))
+
+    if not args.skip_backup:
+        BackupSaves(args, [smallsavefilepath, largesavefilepath], report)
+
+    if len(plan["remove_entities"]) > 0 or len(plan["mutate_entities"]) > 0:
+        report.Phase("apply_large_save", bytes=savesizes[largesavefilename])
+        logger.info("Saving largesave...")
+        entities, removed, changed = ApplyPlanToLargeSave(largesavefilepath, plan)
+        logger.info("Removed %d & changed %d of %d entities", removed, changed, entities)
+        if removed != len(plan["remove_entities"]) or changed != len(plan["mutate_entities"]):
+            logger.warning("Only found %d of the %d entities in the plan", removed + changed, len(plan["remove_entities"]) + len(plan["mutate_entities"]))
+        runsummary["entities"] = entities
+        runsummary["removed_entities"] = removed
+        report.Count(entities=entities, removed=removed, changed=changed)
+
+    if len(plan["remove_players"]) > 0 or len(plan["remove_factions"]) > 0:
+        report.Phase("apply_small_save", bytes=savesizes[smallsavefilename])
+        logger.info("Saving smallsave...")
+        xmlsmallsave = ParseXML(smallsavefilepath).getroot()
+        playerfactionindex = PlayerFactionIndex(xmlsmallsave)
+        if len(plan["remove_players"]) > 0:
+            playerfactionindex.RemovePlayers(set(plan["remove_players"]))
+        if len(plan["remove_factions"]) > 0:
+            playerfactionindex.RemoveFactions(set(plan["remove_factions"]))
+            tally["Factions removed"] += len(plan["remove_factions"])
+        runsummary["removed_players"] = len(plan["remove_players"])
+        runsummary["removed_factions"] = len(plan["remove_factions"])
+
+        #Same as a normal run, SaveWriter gets the top of the sbc file just right
+        writer = SaveWriter(smallsavefilepath)
+        try:
+            writer.WriteTree(xmlsmallsave)
+            writer.Commit()
+        except:
+            writer.Abort()
+            raise
+
+    logger.info("===Summary===")
+    for name, count in sorted(tally.items()):
+        logger.info("%-36s %d", name + ":", count)
+
+    runsummary["seconds"] = (datetime.datetime.now() - starttime).total_seconds()
+    report.Finish()
+    runsummary["report"] = report.Write(args, savesizes, runsummary)
+    logger.info("Run report written to %s", runsummary["report"])
+    return runsummary
+
+
+#########################################
+### Run Report ##########################
+#########################################
+
+#Function to get the peak RSS of this process so far, in MB. None if it can't be found out
+def GetPeakRSS():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": #Bytes on a Mac, KB everywhere else
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+#Keeps track of how long each phase of a run takes and how much memory it used, then writes it all out as JSON
+#Phases are started one after the other with Phase(), starting a new one ends the last one. Finish() ends the last one.
+#   counts is whatever's worth knowing about how much work the phase did, entities, blocks, players and so on
+#With tracememory, tracemalloc is used to get the peak Python memory of each phase. It's accurate but slows things down a lot
+class RunReport:
+    def __init__(self, tracememory=False):
+        self.phases = []
+        self.current = None
+        self.tracememory = tracememory
+        self.starttime = datetime.datetime.now()
+        if tracememory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def Phase(self, name, **counts):
+        self.EndPhase()
+        times = os.times()
+        self.current = {"phase": name, "counts": counts, "wall": time.perf_counter(),
+                        "cpu": times.user + times.system, "childcpu": times.children_user + times.children_system}
+        if self.tracememory:
+            tracemalloc.reset_peak()
+
+    #Add to the counts of the current phase
+    def Count(self, **counts):
+        for name, count in counts.items():
+            self.current["counts"][name] = self.current["counts"].get(name, 0) + count
+
+    def EndPhase(self):
+        if self.current is None:
+            return
+        times = os.times()
+        phase = {"phase": self.current["phase"],
+                 "wall_seconds": round(time.perf_counter() - self.current["wall"], 4),
+                 "cpu_seconds": round(times.user + times.system - self.current["cpu"], 4),
+                 "child_cpu_seconds": round(times.children_user + times.children_system - self.current["childcpu"], 4), #--jobs workers
+                 "peak_rss_mb": GetPeakRSS(),
+                 "counts": self.current["counts"]}
+        if self.tracememory:
+            phase["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        self.phases.append(phase)
+        self.current = None
+
+    def Finish(self):
+        self.EndPhase()
+        if self.tracememory:
+            tracemalloc.stop()
+
+    #Write the report next to the log, or into semu_logs if there isn't one. Returns the report's path
+    def Write(self, args, savesizes, runsummary):
+        if logfilename is not None:
+            filename = os.path.splitext(logfilename)[0] + ".report.json"
+        else:
+            filename = os.path.join("./semu_logs/", '{0}.report.json'.format(self.starttime.strftime("%Y%m%d_%H%M")))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        report = {"save": args.save_path,
+                  "started": self.starttime.isoformat(),
+                  "options": vars(args),
+                  "xml_backend": xmlbackend,
+                  "save_sizes": savesizes,
+                  "summary": runsummary,
+                  "tally": dict(tally),
+                  "phases": self.phases,
+                  "total_wall_seconds": round(sum(phase["wall_seconds"] for phase in self.phases), 4),
+                  "total_cpu_seconds": round(sum(phase["cpu_seconds"] for phase in self.phases), 4),
+                  "peak_rss_mb": GetPeakRSS()}
+        with open(filename, "w") as reportfile:
+            json.dump(report, reportfile, indent=2, default=str)
+        return filename
+
+
+#########################################
+### Batch ###############################
+#########################################
+
+#Rough guess at how many times the size of a save file it takes in RAM to load it
+#Used for --batch-memory, streamed large saves only ever hold a single entity
+domloadfactor = 10
+streamloadmb = 64
+
+
+#Function to find out how much RAM the machine has, in MB. None if it can't be worked out
+def GetPhysicalMemory():
+    try:
+        if hasattr(os, "sysconf"):
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+        #Windows
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("sullAvailExtendedVirtual", ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        return status.ullTotalPhys // (1024 * 1024)
+    except Exception:
+        return None
+
+
+#Function to guess how much RAM doing a save will take, in MB
+def EstimateSaveMemory(savedir, stream):
+    smallsize = os.path.getsize(os.path.join(savedir, "Sandbox.sbc"))
+    largesize = os.path.getsize(os.path.join(savedir, "SANDBOX_0_0_0_.sbs"))
+    if stream:
+        return (smallsize * domloadfactor) // (1024 * 1024) + streamloadmb
+    return ((smallsize + largesize) * domloadfactor) // (1024 * 1024)
+
+
+#Function to turn the --batch folders & wildcards into a list of save folders
+#Anything that matches but doesn't have both save files in it is skipped
+def FindBatchSaves(patterns):
+    saves = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for savedir in matches:
+            if not os.path.isfile(os.path.join(savedir, "Sandbox.sbc")) or not os.path.isfile(os.path.join(savedir, "SANDBOX_0_0_0_.sbs")):
+                logger.warning("Skipping %s, it's not a save folder", savedir)
+                continue
+            if os.path.abspath(savedir) not in [os.path.abspath(s) for s in saves]:
+                saves.append(savedir)
+
+    return saves
+
+
+#Function run in a --batch worker process for a single save. Gets its own log file, named after the save
+def RunBatchJob(args, lognumber):
+    global logger
+
+    name = "".join(c if c.isalnum() else "_" for c in os.path.basename(os.path.normpath(args.save_path)))
+    logfilename = OpenLog("_%d_%s" % (lognumber, name), console=False)
+    logger = logging.getLogger()
+
+    try:
+        runsummary = RunMaintenance(args)
+        runsummary["status"] = "OK"
+    except BaseException as err: #Includes sys.exit() from a missing node or the like
+        logger.error(traceback.format_exc())
+        runsummary = {"save": args.save_path, "status": "FAILED (%s)" % (err.__class__.__name__)}
+
+    runsummary["log"] = logfilename
+    return runsummary
+
+
+#Function to do the full maintenance on every save in --batch, a process per save
+#How many run at once is limited by --workers and by a rough guess of how much RAM each save will need
+def RunBatch(args):
+    saves = FindBatchSaves(args.batch)
+    if len(saves) == 0:
+        logger.error("No save folders found for --batch.")
+        sys.exit()
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    memorylimit = args.batch_memory
+    if memorylimit <= 0:
+        physical = GetPhysicalMemory()
+        memorylimit = physical * 3 // 4 if physical else 0
+
+    estimates = dict((savedir, EstimateSaveMemory(savedir, args.stream)) for savedir in saves)
+    pending = sorted(saves, key=lambda savedir: estimates[savedir], reverse=True) #Biggest first so they don't hold up the end
+    logger.info("===Beginning batch of %d saves, %d workers, %s MB memory limit===", len(saves), workers, memorylimit if memorylimit > 0 else "no")
+
+    results = []
+    running = {}
+    memoryinuse = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(pending) > 0 or len(running) > 0:
+            #Start up as many as will fit. Something always gets to run, even if it's bigger than the limit on its own
+            i = 0
+            while i < len(pending) and len(running) < workers:
+                savedir = pending[i]
+                if len(running) > 0 and memorylimit > 0 and memoryinuse + estimates[savedir] > memorylimit:
+                    i += 1
+                    continue
+                pending.pop(i)
+                jobargs = copy.copy(args)
+                jobargs.save_path = savedir
+                jobargs.batch = []
+                logger.info("Starting %s", savedir)
+                running[pool.submit(RunBatchJob, jobargs, len(results) + len(running) + 1)] = savedir
+                memoryinuse += estimates[savedir]
+
+            done, notdone = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                savedir = running.pop(future)
+                memoryinuse -= estimates[savedir]
+                try:
+                    runsummary = future.result()
+                except BaseException as err: #The worker itself died
+                    runsummary = {"save": savedir, "status": "FAILED (%s)" % (err.__class__.__name__)}
+                logger.info("Finished %s: %s", savedir, runsummary["status"])
+                results.append(runsummary)
+
+    #Combined summary
+    logger.info("===Batch summary===")
+    totals = {"entities": 0, "removed_entities": 0, "removed_players": 0, "removed_factions": 0}
+    failed = 0
+    for runsummary in sorted(results, key=lambda r: r["save"]):
+        if runsummary["status"] != "OK":
+            failed += 1
+            logger.info("%s  %s, see %s", runsummary["status"], runsummary["save"], runsummary.get("log", "the log"))
+            continue
+        for key in totals:
+            totals[key] += runsummary[key]
+        logger.info("OK  %s: removed %d of %d entities, %d players, %d factions in %.1fs", runsummary["save"], runsummary["removed_entities"], runsummary["entities"], runsummary["removed_players"], runsummary["removed_factions"], runsummary["seconds"])
+    logger.info("Total: %d saves done, %d failed. Removed %d of %d entities, %d players, %d factions", len(results) - failed, failed, totals["removed_entities"], totals["entities"], totals["removed_players"], totals["removed_factions"])
+
+    return results
+
+
+#########################################
+### Watch ###############################
+#########################################
+
+#--watch keeps running and does the maintenance on the save folder every time the server writes a new save
+#It waits for both save files to stop changing for --watch-settle seconds first, so it never reads a half written save
+#Between runs the RulePlan, XML parser, entity index and decision cache are all kept, see keptcaches & entityindexes
+watchfilenames = ("Sandbox.sbc", "SANDBOX_0_0_0_.sbs")
+
+#inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+#Function to get the size & age of each save file, None for one that isn't there. Changes whenever the save is written
+def SaveStamp(savedir):
+    stamp = []
+    for savefilename in watchfilenames:
+        try:
+            stat = os.stat(os.path.join(savedir, savefilename))
+            stamp.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+#Waits for something to happen to the save files in a folder. Uses inotify where there is one (Linux), otherwise
+#   just looks at the files every pollinterval seconds
+class SaveWatcher:
+    def __init__(self, savedir, pollinterval=5.0):
+        self.savedir = savedir
+        self.pollinterval = pollinterval
+        self.fd = None
+        self.laststamp = SaveStamp(savedir)
+
+        libcname = ctypes.util.find_library("c")
+        try:
+            libc = ctypes.CDLL(libcname, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError): #No inotify, not Linux
+            return
+        if fd < 0:
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(savedir), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    #Wait up to timeout seconds for one of the save files to change. Returns True if one did
+    def Wait(self, timeout):
+        if self.fd is None:
+            deadline = time.monotonic() + timeout
+            while True:
+                stamp = SaveStamp(self.savedir)
+                if stamp != self.laststamp:
+                    self.laststamp = stamp
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.pollinterval, remaining))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = max(deadline - time.monotonic(), 0)
+            readable = select.select([self.fd], [], [], remaining)[0]
+            if len(readable) == 0:
+                return False
+            if self.ReadEvents():
+                return True
+
+    #Read whatever inotify has, True if any of it was about a save file. Everything else in the folder (semu-cache,
+    #   the entity index, temp files) is ignored
+    def ReadEvents(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+        changed = False
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, namelength = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + namelength].rstrip(b"\0")
+            offset += 16 + namelength
+            if os.fsdecode(name) in watchfilenames:
+                changed = True
+        return changed
+
+    def Close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+#Function to wait for the server to write a new save, and for it to finish writing it
+#Returns once the save files have been there & not changed for settle seconds, and they aren't the same as lastrunstamp
+def WaitForNewSave(watcher, settle, lastrunstamp):
+    while True:
+        stamp = SaveStamp(watcher.savedir)
+        if stamp == lastrunstamp or None in stamp:
+            watcher.Wait(3600) #Nothing new yet, wait as long as it takes
+            continue
+
+        #Something's new, now wait for it to go quiet. Any change starts the wait over
+        while watcher.Wait(settle):
+            pass
+        if SaveStamp(watcher.savedir) == stamp:
+            return stamp
+        #Changed without telling the watcher (polling between checks), go around again
+
+
+#Function to do --watch, runs the maintenance every time the server saves until it's stopped (Ctrl+C) or has done --watch-runs
+#A run that fails is logged & the next save is waited for as normal
+def RunWatch(args):
+    global keptcaches
+    keptcaches = {}
+
+    #Normalised the same way RunMaintenance does it, so the decision cache is found again each run
+    #The save files don't have to be there yet, the server might not have written them
+    FindSaveFiles(args, savefiles=False)
+
+    watcher = SaveWatcher(args.save_path, args.watch_poll)
+    logger.info("===Watching %s for new saves (%s), running once they've been quiet for %ss===", args.save_path,
+                "inotify" if watcher.fd is not None else "checking every %ss" % args.watch_poll, args.watch_settle)
+
+    #The save as it is now hasn't been done yet, unless it's told to wait for the next one
+    lastrunstamp = SaveStamp(args.save_path) if args.watch_skip_current else None
+    runs = 0
+    try:
+        while args.watch_runs <= 0 or runs < args.watch_runs:
+            WaitForNewSave(watcher, args.watch_settle, lastrunstamp)
+            runs += 1
+            OpenLog("_watch_%d" % runs) #Each run gets its own log & run report
+            logger.info("===Watch run %d===", runs)
+            try:
+                runsummary = RunMaintenance(args)
+                logger.info("Watch run %d done: removed %d of %d entities, %d players, %d factions in %.1fs", runs, runsummary["removed_entities"], runsummary["entities"],
+                            runsummary["removed_players"], runsummary["removed_factions"], runsummary["seconds"])
+            except KeyboardInterrupt:
+                raise
+            except BaseException: #Includes sys.exit() from a missing node or the like
+                logger.error(traceback.format_exc())
+                logger.info("Watch run %d failed, waiting for the next save", runs)
+            #Whatever the run wrote itself isn't a new save
+            lastrunstamp = SaveStamp(args.save_path)
+            watcher.laststamp = lastrunstamp
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+    finally:
+        watcher.Close()
+        for cache in keptcaches.values():
+            try:
+                cache.Close()
+            except sqlite3.Error as err:
+                logger.warning("Unable to save the decision cache: %s", err)
+        keptcaches = None
+
+
+#########################################
+### Main ################################
+#########################################
+#Function to set up all the command line options
+def BuildArgParser():
+    argparser = argparse.ArgumentParser(description="Utility for performing maintenance & cleanup on SE save files.")
+    argparser.add_argument('save_path', nargs='?', help='Path to the share folder.', default='') #? used to compress into single item (not list) and will accept it if it's missing
+    argparser.add_argument('--skip-backup', '-B', help='Skip backup up the save files.', default=False, action='store_true')
+    argparser.add_argument('--big-backup', '-b', help='Keep every backup instead of just the last one. Only the parts of the save that changed take up room, see --list-backups & --restore-backup.', default=False, action='store_true')
+    argparser.add_argument('--compress', help="How to compress backups & asteroid snapshots. zstd needs the zstandard module installed.", choices=list(compressionextensions), default='gzip')
+    argparser.add_argument('--compress-level', help="Compression level for --compress, e.g. 1-9 for gzip & lzma or 1-22 for zstd. Defaults to the codec's usual level.", type=int, default=None)
+    argparser.add_argument('--io-threads', help="How many asteroid snapshots to save or respawn at once.", type=int, default=4)
+    argparser.add_argument('--list-backups', help="List the backups of the save and stop.", default=False, action='store_true')
+    argparser.add_argument('--restore-backup', help="Put the save files back the way they were in the given backup (a timestamp from --list-backups, or latest) and stop.", nargs='?', const='latest', default='')
+    argparser.add_argument('--export-catalog', help="Write everything in the save (entities, blocks by type, owners, players & factions) to an SQLite database in semu-cache and stop.", default=False, action='store_true')
+    argparser.add_argument('--query', help="Answer a question from the catalog and stop, making the catalog first if it's missing or the save has changed. Either a report; %s, or some SQL." % ", ".join(catalogqueries), default='')
+    argparser.add_argument('--cleanup-items', '-i', help="Clean up free floating objects like ores and components. Doesn't do corpses, they are more complicated.", default=False, action='store_true')
+    argparser.add_argument('--prune-players', '-p', help="Removes old entries in the player list. Considered old if they don't own any blocks and either don't belong to a faction or IsDead is true. WARNING: Running this on a single-player save will force you to respawn.", default=False, action='store_true')
+    argparser.add_argument('--prune-factions', '-f', help="Remove empty factions", default=False, action='store_true')
+    argparser.add_argument('--whatif', '-w', help="For debugging, won't do any backups and won't save changes. Writes a plan of the changes it would make for --apply-plan.", default=False, action='store_true')
+    argparser.add_argument('--plan-file', help="Where --whatif writes its plan. Default is next to the log.", default='')
+    argparser.add_argument('--apply-plan', help="Make the changes in a plan written by --whatif, without checking anything again. Only works on the exact save the plan was made from.", default='')
+    argparser.add_argument('--disable-factories', '-d', help='To save on wasted CPU cycles, turn off factories. Soft turns off idle assemblers and empty refineries. Hard turns off assemblers and refineries regardless.', default="", metavar="soft / hard", choices=['soft', 'hard'], nargs=1)
+    argparser.add_argument('--stop-movement', '-m', help="Stops all CubeGrid linear and angular velocity, stopping them still. WARNING: This will affect civilian ships as well, may lead to a buildup of civilian ships as they rely on inertia to leave the sector.", default=False, action='store_true')
+    argparser.add_argument('--remove-npc-ships', '-n', help='Removes any ship with inertial dampners turned off and have a beacon named Private Sail, Business Shipment, Commercial Freighter, Mining Carriage / Transport / Hauler and Military Escort / Minelayer / Transporter. Is a rough match but the option is there.', default=False, action='store_true')
+    argparser.add_argument('--ignore-joint', '-I', help="At current, the utility won't remove anything with a joint on it (e.g. motor). This restriction can be ignored but use with caution as it may leave 1-ended joints.", default=False, action='store_true')
+    argparser.add_argument('--map-joints', '-J', help="Works out which grids are joined together by rotors & pistons, so they can be checked & removed as one. Grids with a joint that can't be paired up are still left alone.", default=False, action='store_true')
+    argparser.add_argument('--full-cleanup', '-F', help="A complete cleanup. Cleans Factions, Players, Items and all unpowered Objects. Also soft-disables factories and stops movement", default=False, action='store_true')
+    argparser.add_argument('--save-asteroids', '-s', help="Saves a copy of all asteroids as they are", default=False, action='store_true')
+    argparser.add_argument('--respawn-asteroids', '-r', help="If there's nothing close to the asteroids, restores them to their original state from a backup", default=False, action='store_true')
+    argparser.add_argument('--respawn-euclidean', help="When checking if anything is too close to respawn an asteroid, use the straight line distance instead of adding up the X, Y & Z distances.", default=False, action='store_true')
+    argparser.add_argument('--cleanup-unpowered', '-u', help="When setting up a cleanup, removes objects without reactors or batteries or with unfueled reactors or dead batteries. By default, doesn't count solar panels as power", default=False, action='store_true')
+    argparser.add_argument('--cleanup-include-solar', '-S', help="Normally solar panels are excluded because its impossible to confirm with certainty that it's powered. Using this switch forces them to be included in the power check.", default=False, action='store_true')
+    argparser.add_argument('--cleanup-missing-attrib', '-c', help="Removes objects that are missing cubes with the given attribute, except those that have cubes that match --cleanup-missing-subtype. A list of attributes can be found on the wiki.", nargs="*", default=[])
+    argparser.add_argument('--cleanup-missing-subtype', '-C', help="Removes objects that are missing cubes with the given subtype, except those that have cubes that match --cleanup-missing-attrib. A list of subtypes can be found on the wiki.", nargs="*", default=[])
+    argparser.add_argument('--remove-refinery-queue', '-Q', help="As of SE 01.043, the refinery queue self-replicates and can easily get out of control and cause serious lag. This removes the 'queue' node from refineries which doesn't seem to really do anything.", default=False, action='store_true')
+    argparser.add_argument('--disable-spotlights', '-L', help="Turns off all spotlights.", default=False, action='store_true')
+    argparser.add_argument('--batch', help="Run on a whole lot of save folders at once, each in its own process. Takes folders or wildcards, e.g. --batch C:\\servers\\*\\Saves\\*", nargs="+", default=[], metavar="FOLDER")
+    argparser.add_argument('--workers', help="How many saves to work on at once with --batch. Defaults to the number of CPUs.", type=int, default=0)
+    argparser.add_argument('--batch-memory', help="Rough limit in MB on the RAM all of the --batch saves being worked on at once can use. Defaults to 3/4 of the machine's RAM.", type=int, default=0)
+    argparser.add_argument('--quiet', '-q', '--summary-only', help="Don't log every entity, block and player that's checked or changed, just the totals at the end. Much faster on big saves. Also lets grids be read only until their fate is known, as long as nothing else needs every block (--full-cleanup, --prune-players, --disable-factories, --remove-refinery-queue & --disable-spotlights do) and --ignore-joint or --map-joints is given.", default=False, action='store_true')
+    argparser.add_argument('--trace-memory', help="Use tracemalloc to record the peak memory of each phase in the run report. Slows things down a lot.", default=False, action='store_true')
+    argparser.add_argument('--jobs', '-j', help="Check the CubeGrids of the save in this many processes at once. Can't be used with --stream.", type=int, default=1)
+    argparser.add_argument('--splice', help="Only parse the entities in the large save the other options need, copy everything else straight through. Fastest for things like --cleanup-items. Uses an index of the save cached beside it.", default=False, action='store_true')
+    argparser.add_argument('--no-cache', help="Check every grid instead of using the decisions cached in semu-cache for grids that haven't changed since the last run.", default=False, action='store_true')
+    argparser.add_argument('--cache-size', help="How many grid decisions to keep in semu-cache, the least recently used are thrown out past this.", type=int, default=100000)
+    argparser.add_argument('--xml-backend', help="Which XML library reads the saves. auto uses lxml if it's installed, it loads big saves much quicker, except with --stream where etree is quicker. The saves are written out the same either way.", choices=['auto', 'lxml', 'etree'], default='auto')
+    argparser.add_argument('--watch', help="Keep running and do the maintenance every time the server writes a new save, until stopped with Ctrl+C.", default=False, action='store_true')
+    argparser.add_argument('--watch-settle', help="With --watch, how many seconds the save files have to go unchanged before they're read. Default 10.", type=float, default=10.0)
+    argparser.add_argument('--watch-poll', help="With --watch, how often in seconds to check the save files where inotify can't be used. Default 5.", type=float, default=5.0)
+    argparser.add_argument('--watch-runs', help="With --watch, stop after this many runs. Default 0, keeps going.", type=int, default=0)
+    argparser.add_argument('--watch-skip-current', help="With --watch, wait for the next save instead of starting on the save that's already there.", default=False, action='store_true')
+    argparser.add_argument('--stream', help="Reads the large save one entity at a time and writes kept entities straight back out, instead of loading the whole thing. Uses far less RAM on big saves.", default=False, action='store_true')
+
+    return argparser
+
+
+#Function to tidy up args.save_path and find the save files in it, for everything that works on a single save folder
+#All the "\" become "/" and there's always a "/" on the end, so a folder is always the same path (the decision caches &
+#   entity indexes are kept by it). A path to one of the save files is taken to mean the folder it's in
+#Returns (small save path, large save path). Exits if the folder can't be found, or either save file if savefiles is set
+def FindSaveFiles(args, savefiles=True):
+    args.save_path = args.save_path.replace("\\", "/")
+    if os.path.basename(args.save_path) in ("Sandbox.sbc", "SANDBOX_0_0_0_.sbs") and os.path.isfile(args.save_path):
+        args.save_path = os.path.dirname(args.save_path)
+    if args.save_path[-1:] != "/":
+        args.save_path = args.save_path + "/"
+
+    smallsavefilepath = os.path.join(args.save_path, "Sandbox.sbc")
+    largesavefilepath = os.path.join(args.save_path, "SANDBOX_0_0_0_.sbs")
+
+    #Attempt to find the save folder
+    if not os.path.isdir(args.save_path):
+        logger.error("Unable to load save folder.")
+        logger.info("%s", args.save_path)
+        sys.exit()
+
+    #Check for save files
+    if savefiles and not os.path.isfile(smallsavefilepath):
+        logger.error("Unable to find small save: %s", os.path.basename(smallsavefilepath))
+        sys.exit()
+    if savefiles and not os.path.isfile(largesavefilepath):
+        logger.error("Unable to find large save: %s", os.path.basename(largesavefilepath))
+        sys.exit()
+
+    return smallsavefilepath, largesavefilepath
+
+
+#Function to run the whole maintenance pipeline on the save folder in args.save_path
+#Returns a dict summing up what was done, used for the --batch summary
+def RunMaintenance(args):
+    global changeplan
+
+    smallsavefilepath, largesavefilepath = FindSaveFiles(args)
+
+    runsummary = {"save": args.save_path, "entities": 0, "removed_entities": 0, "removed_players": 0, "removed_factions": 0}
+    starttime = datetime.datetime.now()
+
+    #--quiet turns off all the per-entity lines, the tally at the end sums it all up instead
+    detaillogger.setLevel(logging.WARNING if args.quiet else logging.NOTSET)
+    tally.clear()
+    report = RunReport(args.trace_memory)
+
+    if UseXMLBackend(args.xml_backend, args.stream) != args.xml_backend and args.xml_backend == "lxml":
+        logger.warning("lxml isn't installed, reading the saves with Python's own XML library instead. Install it with: pip install lxml")
+    logger.info("Reading the saves with %s", xmlbackend)
+
+    ### Save some in-built vars ###
+    savedir = args.save_path
+    asteroidsnapshotdir = os.path.join(savedir, "semu-asteroid-snapshots")
+    asteroidspawnrange = 600 #Nothing can be within this many units of an asteroid for it to safely respawn
+    moonspawnrange = 200 #Nothing can be within this many units of an asteroid moon for it to safely respawn
+
+    #Set up names
+    smallsavefilename = os.path.basename(smallsavefilepath)
+    largesavefilename = os.path.basename(largesavefilepath)
+
+    savesizes = {smallsavefilename: os.path.getsize(smallsavefilepath), largesavefilename: os.path.getsize(largesavefilepath)}
+
+    #Save backups
+    if not args.skip_backup and not args.whatif:
+        BackupSaves(args, [smallsavefilepath, largesavefilepath], report)
+
+    #WhatIf writes down everything it would do as a plan for --apply-plan. Hashed now, before anything can change
+    changeplan = None
+    if args.whatif:
+        report.Phase("hash_saves", bytes=savesizes[smallsavefilename] + savesizes[largesavefilename])
+        changeplan = ChangePlan(SaveChecksums([smallsavefilepath, largesavefilepath]))
+
+    #Load saves
+    report.Phase("load_small_save", bytes=savesizes[smallsavefilename])
+    logger.info("Loading %s...", smallsavefilename)
+    xmlsmallsavetree = ParseXML(smallsavefilepath)
+    xmlsmallsave = xmlsmallsavetree.getroot()
+
+    #Checked before anything's written, --stream & --splice start writing the large save out in the next phase
+    if args.prune_factions and xmlsmallsave.find('Factions') is None:
+        logger.error("Unable to location the Factions node in save!")
+        sys.exit()
+
+    #Init the ownership table
+    owningplayers = set()
+
+    #What the asteroid phases need, collected from the kept entities as they go past
+    asteroids = AsteroidRecords()
+    avoidents = PositionArray()
+
+    if args.splice:
+        #Splice mode, goes by the entity index and only ever parses the entities the options need, one at a time
+        #Everything else is copied from the old save as it is
+        if args.map_joints:
+            logger.warning("--map-joints needs the whole save loaded, can't be used with --splice. Jointed grids will be skipped.")
+        if args.jobs > 1:
+            logger.warning("--jobs can't be used with --splice, only one process will be used.")
+        report.Phase("splice_sector_objects", bytes=savesizes[largesavefilename])
+        logger.info("Splicing %s file...", largesavefilename)
+        logger.info("===Beginning SectorObject check...===")
+        streamwriter = None if args.whatif else SaveWriter(largesavefilepath)
+        cache = OpenDecisionCache(args)
+        try:
+            splicecounts = SpliceSectorObjects(largesavefilepath, streamwriter, args, owningplayers, asteroids, avoidents, cache)
+        except:
+            if streamwriter is not None:
+                streamwriter.Abort()
+            raise
+        CloseDecisionCache(cache)
+        logger.info("Parsed %d of %d entities, removed %d", splicecounts[2], splicecounts[0], splicecounts[0] - splicecounts[1])
+        runsummary["entities"] = splicecounts[0]
+        runsummary["removed_entities"] = splicecounts[0] - splicecounts[1]
+        report.Count(entities=splicecounts[0], parsed=splicecounts[2], blocks=tally["Blocks checked"], blocks_skipped=tally["Blocks skipped"])
+    elif args.stream:
+        #Streaming mode, never holds more than a single entity of the large save in memory
+        #Kept entities get written out to a temp file as they go, which replaces the large save at the end
+        if args.map_joints:
+            logger.warning("--map-joints needs the whole save loaded, can't be used with --stream. Jointed grids will be skipped.")
+        if args.jobs > 1:
+            logger.warning("--jobs can't be used with --stream, only one process will be used.")
+        report.Phase("stream_sector_objects", bytes=savesizes[largesavefilename])
+        logger.info("Streaming %s file...", largesavefilename)
+        logger.info("===Beginning SectorObject check...===")
+        streamwriter = None if args.whatif else SaveWriter(largesavefilepath)
+        cache = OpenDecisionCache(args)
+        streamcounts = StreamSectorObjects(largesavefilepath, streamwriter, args, owningplayers, asteroids, avoidents, cache)
+        CloseDecisionCache(cache)
+        if streamcounts is None:
+            if streamwriter is not None:
+                streamwriter.Abort()
+            logger.error("Unable to locate SectorObjects node!")
+            sys.exit()
+        runsummary["entities"] = streamcounts[0]
+        runsummary["removed_entities"] = streamcounts[0] - streamcounts[1]
+        report.Count(entities=streamcounts[0], blocks=tally["Blocks checked"], blocks_skipped=tally["Blocks skipped"])
+    else:
+        entityrecords, xmllargesave = CheckLoadedSectorObjects(largesavefilepath, args, report, runsummary, owningplayers, asteroids, avoidents)
+        #End SectorObjects loop
 
     #After cleanup, should be good to save snapshots
     #Asteroids
+    if args.save_asteroids or args.respawn_asteroids:
+        snapshotmanifest = LoadSnapshotManifest(asteroidsnapshotdir)
+
     if args.save_asteroids:
+        report.Phase("asteroid_snapshot", asteroids=len(asteroids))
         logger.info("===Beginning asteroid snapshot...===")
-        for obj in sectorobjects:
-            if FindAttrib(object) == "MyObjectBuilder_VoxelMap":
-                #Save a copy of this entity to a backup
-                SaveAsteroid(object.find('Filename').text) #Don't worry about Print, SaveAsteroid will do that
+        #Save a copy of each asteroid to a backup, several at once
+        iostart = time.perf_counter()
+        work = [(savedir, asteroidsnapshotdir, asteroidname, args.compress, args.compress_level, args.whatif, snapshotmanifest) for asteroidname, asteroidpos in asteroids]
+        copies, bytescopied = RunAsteroidIO(SaveAsteroid, work, args.io_threads) #Don't worry about Print, SaveAsteroid will do that
+        LogAsteroidThroughput("Snapshotted", copies, bytescopied, time.perf_counter() - iostart)
+        report.Count(copies=copies, bytes=bytescopied)
     #End asteroid saving
 
     #Sector objects have now been cleaned up, lets thing about respawning
     #Asteroids
     if args.respawn_asteroids:
+        report.Phase("asteroid_respawn", asteroids=len(asteroids), avoid=len(avoidents))
         logger.info("===Beginning asteroid respawn...===")
 
-        #For efficiency, generate a list of what entites are where
-        avoidents = []
-        for obj in sectorobjects:
-            if FindAttrib(object) == "MyObjectBuilder_Character" or FindAttrib(object) == "MyObjectBuilder_CubeGrid": #Only do checks for CubeGrids and players. Who cares about floating items or other asteroids.
-                avoidents.append(object.find('PositionAndOrientation').find('Position').attrib) #Add the XYZ dict to the list
+        #Bucket everything that needs avoiding once, then each asteroid is just a range query
+        #avoidents was filled in during the SectorObjects check, only CubeGrids and players are in it
+        avoidindex = SpatialHash(max(asteroidspawnrange, moonspawnrange))
+        for pos in avoidents:
+            avoidindex.Insert(pos)
 
         #Now, loop through the asteroids and check if they should be respawned
-        for obj in sectorobjects:
-            if FindAttrib(object) == "MyObjectBuilder_VoxelMap":
+        #The ones that can be are all respawned at the end, several at once
+        work = []
+        for asteroidname, asteroidpos in asteroids:
 
-                #Is it a moon or a large asteroid?
-                ismoon = ("moon" in obj.find('Filename').text)
-                spawnrange = 0
+            #Is it a moon or a large asteroid?
+            ismoon = ("moon" in asteroidname)
 
-                if ismoon: spawn = moonspawnrange
-                if not ismoon: spawn = asteroidspawnrange
+            if ismoon: spawnrange = moonspawnrange
+            if not ismoon: spawnrange = asteroidspawnrange
 
-                if CanRespawnAsteroid(avoidents, obj.find('PositionAndOrientation').find('Position').attrib, spawnrange):
-                    RestoreAsteroid(object.find('Filename').text)
+            if CanRespawnAsteroid(avoidindex, asteroidpos, spawnrange, args.respawn_euclidean):
+                work.append((savedir, asteroidsnapshotdir, asteroidname, args.whatif, snapshotmanifest))
 
-                else:
-                    logger.info("Can't respawn asteroid, something is too close: " + obj.find('Filename').text)
+            else:
+                detaillogger.info("Can't respawn asteroid, something is too close: %s", asteroidname)
+                tally["Asteroids too close to respawn"] += 1
+
+        iostart = time.perf_counter()
+        copies, bytescopied = RunAsteroidIO(RestoreAsteroid, work, args.io_threads)
+        LogAsteroidThroughput("Respawned", copies, bytescopied, time.perf_counter() - iostart)
+        report.Count(copies=copies, bytes=bytescopied)
     #End asteroid respawning
 
+    if (args.save_asteroids or args.respawn_asteroids) and not args.whatif and os.path.isdir(asteroidsnapshotdir):
+        SaveSnapshotManifest(asteroidsnapshotdir, snapshotmanifest)
+
+    #Index the players & factions, both pruning phases work off this
+    if args.prune_players or args.prune_factions:
+        report.Phase("index_players_factions")
+        playerfactionindex = PlayerFactionIndex(xmlsmallsave)
+        report.Count(players=len(playerfactionindex.players), factions=len(playerfactionindex.factions))
+
     #Begin player check. Must be after object check
     if args.prune_players:
+        report.Phase("prune_players", players=len(playerfactionindex.players))
         logger.info("===Beginning player check...===")
 
-        playerlist = xmlsmallsave.find('AllPlayers')
-        playerIDtoremove = []
-
-        #This'll be slightly different because there's 2 player lists
-        """
-        for player in playerlist:
-            playerID = player.find('PlayerId').text
-            if (not playerID in owningplayers) == True and (player.find('IsDead').text == 'true' or FindPlayerFaction(xmlsmallsave.find('Factions').find('Factions'), playerID) == None): #Doesn't own anything AND (isDead = True OR not in a faction)
-                try: #Error handling for unicode names
-                    logger.info("Marking player for removal: %s, %s"%(player.find('Name').text, playerID))
-                except:
-                    logger.info("Marking player for removal: %s, %s"%("<unicode name>", playerID))
-
-                playerIDtoremove.append(playerID)
-        """
-        for player in playerlist:
-            playerID = player.find('PlayerId').text
-            logger.info("Checking player entry: ", playerID, " ", player.find('Name').text)
-            ownsstuff = playerID in owningplayers
-            isdead = player.find('IsDead').text == 'true'
-            inafaction = FindPlayerFaction(xmlsmallsave.find('Factions').find('Factions'), playerID) is not None
-
-            logger.info("Owns stuff   : ", ownsstuff)
-            logger.info("Is alive     : ", not isdead)
-            logger.info("Is in faction: ", inafaction)
-
-            if not ownsstuff and (isdead or not inafaction): #Doesn't own anything AND (isDead = True OR not in a faction)
-                logger.info("Marking player for removal: ", player.find('Name').text, ", ", playerID)
-                playerIDtoremove.append(playerID)
+        playerIDtoremove = set()
+
+        for player in PlayerRecords(playerfactionindex):
+            detaillogger.info("Checking player entry: %s %s", player.playerid, player.name)
+            ownsstuff = player.playerid in owningplayers
+
+            detaillogger.info("Owns stuff   : %s", ownsstuff)
+            detaillogger.info("Is alive     : %s", not player.isdead)
+            detaillogger.info("Is in faction: %s", player.infaction)
+
+            if not ownsstuff and (player.isdead or not player.infaction): #Doesn't own anything AND (isDead = True OR not in a faction)
+                detaillogger.info("Marking player for removal: %s, %s", player.name, player.playerid)
+                playerIDtoremove.add(player.playerid)
         #End player list loop
 
         #Remove from relevant lists
         if len(playerIDtoremove) > 0: #If there's things to do
             logger.info("===Removing marked players...===")
-
-            #AllPlayers section
-            for player in playerlist[:]:
-                if player.find('PlayerId').text in playerIDtoremove:
-                    logger.info("Removing ", player.find('PlayerId').text, " from All Players list")
-                    playerlist.remove(player)
-
-            #Players section. Yes, there's a second one
-            pllist = xmlsmallsave.find('Players')[0]
-            for player in pllist[:]:
-                if player.find('Value').find('PlayerId') in playerIDtoremove:
-                    logger.info("Removing ", player.find('Value').find('PlayerId'), " from Players list")
-                    pllist.remove(player)
-
-            #Factions
-            #Loop through members of each faction.
-            for faction in xmlsmallsave.find('Factions').find('Factions'):
-                factionId = faction.find('FactionId').text
-                memberlist = faction.find('Members')
-                joinrequests = faction.find('JoinRequests')
-
-                #Cleanup Members
-                for member in memberlist[:]:
-                    if member.find('PlayerId').text in playerIDtoremove:
-                        logger.info("Removing ", member.find('PlayerId').text, " from faction ", factionId, " ", faction.find('Name').text)
-                        memberlist.remove(member)
-
-                #Cleanup Join Requests
-                for joinrequest in joinrequests[:]:
-                    if joinrequest.find('PlayerId').text in playerIDtoremove:
-                        logger.info("Removing ", joinrequest.find('PlayerId').text, " from faction request list ", factionId, " ", faction.find('Name').text)
-                        joinrequests.remove(joinrequest)
-
-            #Factions Players, yep another second one
-            factionplayers = xmlsmallsave.find('Factions').find('Players')[0]
-            for factionplayer in factionplayers[:]:
-                if factionplayer.find('Key').text in playerIDtoremove:
-                    logger.info("Removing ", factionplayer.find('Key').text, "from faction player list")
-                    factionplayers.remove(factionplayer)
+            playerfactionindex.RemovePlayers(playerIDtoremove)
+            if changeplan is not None:
+                changeplan.removeplayers.extend(sorted(playerIDtoremove))
+            runsummary["removed_players"] = len(playerIDtoremove)
 
     #End player pruning
 
 
     #Begin checking factions. Must be after object check and player check
     if args.prune_factions:
+        report.Phase("prune_factions", factions=len(playerfactionindex.factions))
         logger.info("===Beginning faction check...===")
 
-        factionIDtoremove = []
-
-        if xmlsmallsave.find('Factions') is None:
-            logger.error("Unable to location the Factions node in save!")
-            sys.exit()
+        factionIDtoremove = set()
 
         #Find and mark down factions to be removed
-        factionlist = xmlsmallsave.find('Factions').find('Factions')
-        for faction in factionlist[:]:
-            if len(faction.find('Members')) == 0: #Has no members
-                logger.info("Marking faction for removal, no members: ", faction.find('Name').text, ", ", faction.find('FactionId').text)
-                factionIDtoremove.append(faction.find('FactionId').text)
-                factionlist.remove(faction)
+        for factionId, faction in playerfactionindex.factions.items():
+            if len(playerfactionindex.GetFactionMembers(factionId)) == 0: #Has no members
+                detaillogger.info("Marking faction for removal, no members: %s, %s", faction.find('Name').text, factionId)
+                tally["Factions removed"] += 1
+                factionIDtoremove.add(factionId)
 
         logger.info("===Removing marked factions...===")
-
-        #Skip the FactionPlayer table. Will only remove factions that have no players, so it should never even be present in the FactionPlayers list
-
-        #Remove from Relations table
-        factionrelations = xmlsmallsave.find('Factions').find('Relations')
-        for factionrelation in factionrelations[:]:
-            if (factionrelation.find('FactionId1').text in factionIDtoremove) or (factionrelation.find('FactionId2').text in factionIDtoremove):
-                factionrelations.remove(factionrelation)
-
-        #Clean from FactionRequests
-        #2 kinds, either an entire entry for the faction or another entry referring to the faction
-        factionrequests = xmlsmallsave.find('Factions').find('Requests')
-        requestbodytoremove = []
-        for i in range(0, len(factionrequests)):
-            #First, is this entry about a faction to be removed
-            if factionrequests[i].find('FactionId').text in factionIDtoremove:
-                requestbodytoremove.append(i)
-                continue #Go to the next entry, don't bother about the individual requests
-
-            #Second, loop through the requests that've been sent by this faction
-            factionsubrequests = factionrequests[i].find('FactionRequests')
-            for factionsubrequest in range(0, len(factionsubrequests)):
-                if factionsubrequest.text in factionIDtoremove:
-                    factionsubrequests.remove(factionsubrequests[i])
-
-        requestbodytoremove.reverse()
-        for i in requestbodytoremove:
-            factionrequests.remove(factionrequests[i])
+        playerfactionindex.RemoveFactions(factionIDtoremove)
+        if changeplan is not None:
+            changeplan.removefactions.extend(sorted(factionIDtoremove))
+        runsummary["removed_factions"] = len(factionIDtoremove)
 
 
     #Ok, that should be all the checks, lets save it
     if not args.whatif:
+        report.Phase("save", entities=runsummary["entities"] - runsummary["removed_entities"])
         logger.info("===Saving changes...===")
         logger.info("Saving largesave...")
-        xmllargesave.attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
-        xmllargesavetree.write(largesavefilepath)
+        if args.stream or args.splice: #Already written out while streaming, just swap it in
+            streamwriter.Commit()
+        else:
+            #Copy whatever didn't change straight from the old save, only write out what did
+            writer = SaveWriter(largesavefilepath)
+            try:
+                if entityrecords is not None:
+                    if not WriteEntityRecords(writer, largesavefilepath, entityrecords):
+                        logger.error("%s has changed since it was loaded, not saving anything", largesavefilename)
+                        sys.exit() #The temp file's thrown away below
+                    changed = sum(1 for record in entityrecords if isinstance(record.output, bytes))
+                    kept = sum(1 for record in entityrecords if record.output is not None)
+                    logger.info("Rewrote %d changed entities, copied the other %d as they were", changed, kept - changed)
+                else:
+                    logger.warning("Couldn't match the entities up with the old save, writing the whole thing out")
+                    writer.WriteTree(xmllargesave)
+                writer.Commit()
+            except:
+                writer.Abort()
+                raise
 
         logger.info("Saving smallsave...")
-        #Space Engineers freaks the fuck out if the top of the XML in the sbc file isn't juuuuuuust right
-        xmlsmallsave.attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
-        xmlsmallsavetree.write(smallsavefilepath)
+        #Space Engineers freaks the fuck out if the top of the XML in the sbc file isn't juuuuuuust right, SaveWriter gets it right
+        writer = SaveWriter(smallsavefilepath)
+        try:
+            writer.WriteTree(xmlsmallsave)
+            writer.Commit()
+        except:
+            writer.Abort()
+            raise
     else:
         logger.info("===Script complete. WhatIf was used, no action has been taken.===")
+        runsummary["plan"] = changeplan.Write(args.plan_file if args.plan_file != '' else None)
+        logger.info("Plan of the changes written to %s, do them with --apply-plan", runsummary["plan"])
+        if changeplan.unkeyed > 0:
+            logger.warning("%d entities to be changed have no EntityId, they aren't in the plan", changeplan.unkeyed)
+        changeplan = None
+
+    logger.info("===Summary===")
+    for name, count in sorted(tally.items()):
+        logger.info("%-36s %d", name + ":", count)
+
+    runsummary["seconds"] = (datetime.datetime.now() - starttime).total_seconds()
+
+    report.Finish()
+    runsummary["report"] = report.Write(args, savesizes, runsummary)
+    logger.info("Run report written to %s", runsummary["report"])
+    return runsummary
+
+
+def main():
+    global logger
+
+    #Load up argparse
+    argparser = BuildArgParser()
+    args = argparser.parse_args()
+
+    print("")
+    #print(args)
+    #print("")
+
+    #Definition for a full cleanup
+    if args.full_cleanup:
+        args.cleanup_unpowered = True
+        args.cleanup_items = True
+        args.prune_players = True
+        args.prune_factions = True
+        args.stop_movement = True
+        args.disable_factories = ["soft"] #Same as --disable-factories soft, it's a list of one
+        args.remove_refinery_queue = True
+
+    #Check to see if an action has been specified
+    simpleusagemsg = """
+    To quickly use this utility in Windows;
+    - Hold the Windows keyboard key and press R
+        A window saying Open or Run will appear
+    - Type in "cmd" and press Enter
+        A black window with white writing will appear
+    - Drag & drop SEMU into the window, hit Space and then type "-h" and hit enter
+        This is the list of available options for SEMU
+    - Drag & drop SEMU into the window again
+    - Press space, then drag & drop the save folder to clean into the window
+    - Press space, then enter the commands you want to use
+    e.g. Semu.exe C:\save\path\ --full-cleanup
+
+    For instructions on how to make shortcuts & scripts
+    for frequent cleanups, check out the wiki on the SEMU site;
+    https://sourceforge.net/projects/semaintenanceutility/
+    """
+
+    #Ok, we're good. Get the log ready
+    OpenLog()
+    logger = logging.getLogger()
+
+    if not sys.argv[1:]:
+        logger.error("no actions given.")
+        print(simpleusagemsg)
+        input("Press the ENTER key to exit.")
+        sys.exit()
+
+    if args.save_path == '' and len(args.batch) == 0:
+        logger.error("No save path given.")
+        print(simpleusagemsg)
+        input("Press the ENTER key to exit.")
+        sys.exit()
+
+    if args.compress == "zstd" and zstandard is None:
+        logger.error("--compress zstd needs the zstandard module, install it with: pip install zstandard")
+        sys.exit()
+
+    if len(args.batch) > 0:
+        RunBatch(args)
+    elif args.list_backups or args.restore_backup != '':
+        RunBackupCommand(args)
+    elif args.export_catalog or args.query != '':
+        RunCatalogCommand(args)
+    elif args.apply_plan != '':
+        RunApplyPlan(args)
+    elif args.watch:
+        RunWatch(args)
+    else:
+        RunMaintenance(args)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,62 @@
+"""
+Checks the backups SEMaintenanceUtility keeps in semu-backups
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SEMaintenanceBenchmark
+
+utilitypath = SEMaintenanceBenchmark.utilitypath
+savefilenames = ("SANDBOX_0_0_0_.sbs", "Sandbox.sbc")
+
+
+#Function to run the utility on a save folder, failing the test if it doesn't finish cleanly. Returns what it logged
+def RunUtility(savedir, options):
+    process = subprocess.run([sys.executable, utilitypath, savedir, "--quiet"] + options, cwd=os.path.dirname(savedir),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    assert process.returncode == 0, process.stderr
+    assert "Traceback" not in process.stderr, process.stderr
+    return process.stderr
+
+
+#Function to read both save files of a save folder
+def ReadSave(savedir):
+    save = {}
+    for filename in savefilenames:
+        with open(os.path.join(savedir, filename), "rb") as savefile:
+            save[filename] = savefile.read()
+    return save
+
+
+#Function to get the backups --list-backups shows, [(timestamp, kept)]
+def ListBackups(savedir):
+    logged = RunUtility(savedir, ["--list-backups"])
+    return [(timestamp, kept != "") for timestamp, kept in re.findall(r"^INFO\s+(\d{8}-\d{6}a*)(  kept)?  ", logged, re.MULTILINE)]
+
+
+def test_big_backup_survives_normal_runs(tmp_path):
+    savedir = str(tmp_path / "save")
+    SEMaintenanceBenchmark.GenerateSave(savedir, grids=20, blocks=8, floating=20, voxels=2, players=10, factions=3, relations=2,
+                                        refineryqueue=2, characters=2, seed=3)
+    original = ReadSave(savedir)
+
+    RunUtility(savedir, ["--big-backup", "--cleanup-items"])
+    RunUtility(savedir, ["--stop-movement"])
+    backups = ListBackups(savedir)
+    assert [kept for timestamp, kept in backups] == [True, False]
+
+    #Another normal run only replaces the last normal backup
+    RunUtility(savedir, ["--remove-npc-ships"])
+    laterbackups = ListBackups(savedir)
+    assert [kept for timestamp, kept in laterbackups] == [True, False]
+    assert laterbackups[0] == backups[0]
+    assert laterbackups[1] != backups[1]
+
+    #The kept backup's chunks weren't thrown away with the normal ones
+    RunUtility(savedir, ["--restore-backup", backups[0][0]])
+    assert ReadSave(savedir) == original
@@ -0,0 +1,121 @@
+"""
+Checks that every way of running SEMaintenanceUtility over a save gives the same save back
+
+Makes a small save with SEMaintenanceBenchmark.GenerateSave, runs the utility over copies of it in each mode and
+compares the saves that come out byte for byte.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SEMaintenanceBenchmark
+
+utilitypath = SEMaintenanceBenchmark.utilitypath
+savefilenames = ("SANDBOX_0_0_0_.sbs", "Sandbox.sbc")
+
+
+#Function to run the utility on a save folder, failing the test if it doesn't finish cleanly. Returns what it logged
+def RunUtility(savedir, options):
+    process = subprocess.run([sys.executable, utilitypath, savedir, "-B", "--quiet"] + options, cwd=os.path.dirname(savedir),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    assert process.returncode == 0, process.stderr
+    assert "Traceback" not in process.stderr, process.stderr
+    return process.stderr
+
+
+#Function to read both save files of a save folder
+def ReadSave(savedir):
+    save = {}
+    for filename in savefilenames:
+        with open(os.path.join(savedir, filename), "rb") as savefile:
+            save[filename] = savefile.read()
+    return save
+
+
+#Function to get the summary counts from what a run logged, e.g. {"CubeGrids removed": 12}
+def ReadTally(logged):
+    return dict((name, int(count)) for name, count in re.findall(r"^INFO\s+([^:\n]+):\s+(\d+)$", logged, re.MULTILINE))
+
+
+@pytest.fixture(scope="module")
+def world(tmp_path_factory):
+    savedir = str(tmp_path_factory.mktemp("world") / "save")
+    SEMaintenanceBenchmark.GenerateSave(savedir, grids=60, blocks=12, floating=20, voxels=3, players=20, factions=6, relations=8,
+                                        refineryqueue=3, characters=3, joints=0.2, seed=7)
+    return savedir
+
+
+#Function to run the utility on a fresh copy of the world. Returns (the save that came out, what it logged)
+def RunOnCopy(world, tmp_path, name, options):
+    savedir = str(tmp_path / name)
+    shutil.copytree(world, savedir)
+    logged = RunUtility(savedir, options)
+    return ReadSave(savedir), logged
+
+
+@pytest.fixture(scope="module")
+def reference(world, tmp_path_factory):
+    save, logged = RunOnCopy(world, tmp_path_factory.mktemp("reference"), "save", ["--full-cleanup", "--no-cache"])
+    assert save != ReadSave(world) #Make sure there was something to clean up
+    return save
+
+
+@pytest.mark.parametrize("options", [
+    [],
+    ["--stream"],
+    ["--splice"],
+    ["--jobs", "2"],
+    ["--xml-backend", "etree"],
+    ["--xml-backend", "lxml"],
+], ids=lambda options: " ".join(options) or "dom")
+def test_modes_match(world, reference, tmp_path, options):
+    save, logged = RunOnCopy(world, tmp_path, "save", ["--full-cleanup"] + options)
+    assert save == reference
+
+
+def test_map_joints_jobs_match(world, tmp_path):
+    single, logged = RunOnCopy(world, tmp_path, "single", ["--full-cleanup", "--map-joints", "--no-cache"])
+    jobs, logged = RunOnCopy(world, tmp_path, "jobs", ["--full-cleanup", "--map-joints", "--jobs", "2", "--no-cache"])
+    assert jobs == single
+
+
+@pytest.mark.parametrize("options", [[], ["--splice"], ["--jobs", "2"]], ids=lambda options: " ".join(options) or "dom")
+def test_warm_cache_matches(world, reference, tmp_path, options):
+    savedir = str(tmp_path / "save")
+    shutil.copytree(world, savedir)
+    RunUtility(savedir, ["--full-cleanup"] + options)
+
+    #Put the original save back, but keep semu-cache, so every grid can be decided from the cache
+    for filename in savefilenames:
+        shutil.copyfile(os.path.join(world, filename), os.path.join(savedir, filename))
+    logged = RunUtility(savedir, ["--full-cleanup"] + options)
+    assert ReadTally(logged).get("CubeGrids decided from cache", 0) > 0
+    assert ReadSave(savedir) == reference
+
+
+@pytest.mark.parametrize("options", [["--full-cleanup"], ["--full-cleanup", "--map-joints"], ["--full-cleanup", "--splice"]],
+                         ids=lambda options: " ".join(options))
+def test_plan_round_trip(world, tmp_path, options):
+    direct, directlogged = RunOnCopy(world, tmp_path, "direct", options + ["--no-cache"])
+
+    savedir = str(tmp_path / "planned")
+    shutil.copytree(world, savedir)
+    planpath = str(tmp_path / "plan.json")
+    RunUtility(savedir, options + ["--whatif", "--plan-file", planpath])
+    assert sorted(os.listdir(savedir)) == sorted(os.listdir(world)) #WhatIf doesn't write anything to the save folder
+    assert ReadSave(savedir) == ReadSave(world)
+
+    appliedlogged = RunUtility(savedir, ["--apply-plan", planpath])
+    assert ReadSave(savedir) == direct
+
+    #Removals are counted the same way as the run that decided them
+    directtally = ReadTally(directlogged)
+    appliedtally = ReadTally(appliedlogged)
+    for name in ("CubeGrids removed", "NPC ships removed", "Floating objects removed", "Players removed", "Factions removed"):
+        assert appliedtally.get(name, 0) == directtally.get(name, 0), name
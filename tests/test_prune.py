@@ -0,0 +1,86 @@
+"""
+Checks that pruning players & factions leaves the small save indented the way it was
+"""
+
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SEMaintenanceUtility
+
+smallsave = """<MyObjectBuilder_Checkpoint>
+  <AllPlayers>
+    <PlayerItem>
+      <PlayerId>1</PlayerId>
+    </PlayerItem>
+    <PlayerItem>
+      <PlayerId>2</PlayerId>
+    </PlayerItem>
+  </AllPlayers>
+  <Factions>
+    <Factions>
+      <MyObjectBuilder_Faction>
+        <FactionId>10</FactionId>
+        <Name>A</Name>
+        <Members>
+          <MyObjectBuilder_FactionMember>
+            <PlayerId>2</PlayerId>
+          </MyObjectBuilder_FactionMember>
+        </Members>
+      </MyObjectBuilder_Faction>
+      <MyObjectBuilder_Faction>
+        <FactionId>11</FactionId>
+        <Name>B</Name>
+        <Members>
+          <MyObjectBuilder_FactionMember>
+            <PlayerId>1</PlayerId>
+          </MyObjectBuilder_FactionMember>
+        </Members>
+      </MyObjectBuilder_Faction>
+      <MyObjectBuilder_Faction>
+        <FactionId>12</FactionId>
+        <Name>C</Name>
+        <Members>
+          <MyObjectBuilder_FactionMember>
+            <PlayerId>2</PlayerId>
+          </MyObjectBuilder_FactionMember>
+        </Members>
+      </MyObjectBuilder_Faction>
+    </Factions>
+  </Factions>
+</MyObjectBuilder_Checkpoint>"""
+
+prunedsave = """<MyObjectBuilder_Checkpoint>
+  <AllPlayers>
+    <PlayerItem>
+      <PlayerId>1</PlayerId>
+    </PlayerItem>
+  </AllPlayers>
+  <Factions>
+    <Factions>
+      <MyObjectBuilder_Faction>
+        <FactionId>11</FactionId>
+        <Name>B</Name>
+        <Members>
+          <MyObjectBuilder_FactionMember>
+            <PlayerId>1</PlayerId>
+          </MyObjectBuilder_FactionMember>
+        </Members>
+      </MyObjectBuilder_Faction>
+    </Factions>
+  </Factions>
+</MyObjectBuilder_Checkpoint>"""
+
+
+def test_pruned_save_keeps_its_indenting():
+    root = ET.fromstring(smallsave)
+    index = SEMaintenanceUtility.PlayerFactionIndex(root)
+    index.RemovePlayers(set(["2"]))
+    assert index.GetFactionMembers("10") == [] and index.GetFactionMembers("12") == []
+
+    #Faction A has no members left now, its Members closes where it did
+    assert ET.tostring(root.find("Factions/Factions")[0].find("Members")).decode() == "<Members>\n        </Members>\n      "
+
+    index.RemoveFactions(set(["10", "12"]))
+    assert ET.tostring(root).decode() == prunedsave
@@ -0,0 +1,58 @@
+"""
+Checks how much of a grid SummariseCluster reads for a RulePlan, on small grids built by hand
+"""
+
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SEMaintenanceUtility
+
+xsitype = "{http://www.w3.org/2001/XMLSchema-instance}type"
+
+
+#Function to make a CubeGrid from a list of (attrib, subtype) blocks. Reactors get some fuel in them
+def MakeGrid(blocks):
+    grid = ET.Element("MyObjectBuilder_EntityBase", {xsitype: "MyObjectBuilder_CubeGrid"})
+    ET.SubElement(grid, "EntityId").text = "1001"
+    cubeblocks = ET.SubElement(grid, "CubeBlocks")
+    for attrib, subtype in blocks:
+        block = ET.SubElement(cubeblocks, "MyObjectBuilder_CubeBlock", {xsitype: attrib})
+        ET.SubElement(block, "SubtypeName").text = subtype
+        if attrib == "MyObjectBuilder_Reactor":
+            items = ET.SubElement(ET.SubElement(block, "Inventory"), "Items")
+            ET.SubElement(items, "MyObjectBuilder_InventoryItem")
+    return grid
+
+
+def MakePlan(options):
+    return SEMaintenanceUtility.RulePlan(SEMaintenanceUtility.BuildArgParser().parse_args(["save"] + options))
+
+
+armor = ("MyObjectBuilder_CubeBlock", "LargeBlockArmorBlock")
+
+
+def test_attrib_pass_counts_unread_blocks():
+    grid = MakeGrid([armor, ("MyObjectBuilder_Reactor", "LargeBlockSmallGenerator"), armor, armor, armor])
+    plan = MakePlan(["--cleanup-unpowered", "--ignore-joint", "--quiet"])
+    assert plan.canstop
+    summary = SEMaintenanceUtility.SummariseCluster([grid], plan)
+    assert summary.fueledreactors == 1
+    assert summary.blocksskipped == 3 #Settled on the reactor, the three after it were never read
+
+
+def test_subtype_pass_skips_nothing():
+    grid = MakeGrid([armor, armor, ("MyObjectBuilder_CubeBlock", "Wanted"), armor, armor])
+    plan = MakePlan(["--cleanup-missing-subtype", "Wanted", "--ignore-joint", "--quiet"])
+    assert plan.canstop
+    summary = SEMaintenanceUtility.SummariseCluster([grid], plan)
+    assert summary.subtypes == set(["Wanted"])
+    assert summary.blocksskipped == 0 #The attrib pass read every block before the subtypes were looked at
+
+
+def test_nothing_skipped_without_quiet():
+    grid = MakeGrid([("MyObjectBuilder_Reactor", "LargeBlockSmallGenerator"), armor, armor])
+    plan = MakePlan(["--cleanup-unpowered", "--ignore-joint"])
+    assert not plan.canstop #Every grid's name goes in the log
+    assert SEMaintenanceUtility.SummariseCluster([grid], plan).blocksskipped == 0